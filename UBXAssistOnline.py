@@ -1,8 +1,13 @@
 #! /usr/bin/env python
 import urllib.request as req
+import urllib.error
 import threading
 import time
 import os
+import random
+
+from assistance_cache import AssistanceCache
+from geodesy import ecef_distance, llh_to_ecef
 
 
 import logging
@@ -12,16 +17,41 @@ logger = logging.getLogger(__name__)
 token_file = "~/.keys/ublox_token.txt"
 token_file=os.path.expanduser(token_file)
 
+SERVICE_URL = "http://online-live1.services.u-blox.com/GetOnlineData.ashx"
+
 class UBXAssistOnline(threading.Thread):
-    def __init__(self, location, output_file):
-        self.assistance_data = b''
+    """
+    downloads assistance data when the cached data is about to expire or the
+    location moved more than location_threshold from the one of the last download
+    (also the one of a cached file), the thread sleeps on a condition until then
+    """
+    def __init__(self, location, output_file, service_url=SERVICE_URL, timeout=30, min_interval=600, retry_interval=60, max_backoff=3600, location_threshold=10000):
+        """
+        timeout: seconds until a stalled download is aborted \n
+        min_interval: minimum seconds between successful downloads \n
+        retry_interval / max_backoff: first and maximum delay after failed downloads, doubled per failure \n
+        location_threshold: distance in m the location has to move to trigger a download
+        """
         self.keep_running = True
-        self.data = b''
         self.token = ''
         self.location_valid=0
-        self.update_location(location)
-        self.last_update = 0
+        self.location_changed = False  # set under the condition, a download for the new location is due
+        self.condition = threading.Condition()
+        self.location_threshold = location_threshold
         self.output_file = output_file
+        self.service_url = service_url
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.retry_interval = retry_interval
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.cache = AssistanceCache(output_file)
+        if output_file:
+            self.cache.load()
+        # a fresh cached file is used until it is about to expire or the location moves away from its one
+        self.next_fetch = self.cache.next_fetch()
+        self.fetch_location = llh_to_ecef(*self.cache.location) if self.cache.location else None  # ECEF of the location of the last download
+        self.update_location(location)
 
         try:
             with open(token_file, 'r') as f:
@@ -34,53 +64,82 @@ class UBXAssistOnline(threading.Thread):
         threading.Thread.__init__(self)
 
     def update_location(self, location):
+        """called on every valid fix, wakes the thread only if the location moved beyond the threshold"""
+        lat, lon, alt, acc = location
+        if not (lat and lon and alt and acc):
+            return
         self.lat ,self.lon, self.alt,self.acc = location
-        location_valid_old=self.location_valid
-
-        if self.lat and self.lon and self.alt and self.acc :
-            self.location_valid = 1
-        else:
-            self.location_valid = 0
-
-        if (not location_valid_old )and self.location_valid:
-            self.last_update=0 #force update because we have a valid location now
-
+        self.location_valid = 1
+        ecef = llh_to_ecef(lat, lon, alt)
+        if self.fetch_location and ecef_distance(ecef, self.fetch_location) < self.location_threshold:
+            return
+        # the location is taken for the download even if it fails, so the backoff is kept
+        self.fetch_location = ecef
+        with self.condition:
+            # a flag, next_fetch is overwritten when a running download finishes
+            self.location_changed = True
+            self.condition.notify()
+
+
+    def location(self):
+        """last valid location (lat, lon, alt, acc) or None"""
+        if not self.location_valid:
+            return None
+        return (self.lat, self.lon, self.alt, self.acc)
+
+    def get_data(self):
+        """currently valid assistance data"""
+        return self.cache.data()
 
     def run(self):
-        interval = 600  # 10 minutes
-        update_due = 1
         while(self.keep_running):
-
-            now = time.time()
-            if (now > self.last_update+interval):
-                update_due = 1
-            else:
-                update_due = 0
-
-            if update_due:
-                self.update_assistance_data()
-                self.last_update=now
-            
-            time.sleep(1)
+            with self.condition:
+                due = self.next_fetch
+                if self.location_changed and not self.failures:
+                    # a new location does not wait for the coverage to end, only for min_interval
+                    due = min(due, self.cache.downloaded + self.min_interval)
+                delay = due - time.time()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                self.location_changed = False
+            self.update_assistance_data()
                 
     def update_assistance_data(self):
         data = None
+        location = None
         if self.location_valid:
-            url = f"http://online-live1.services.u-blox.com/GetOnlineData.ashx?token={self.token};gnss=gps;datatype=eph;lat={self.lat:.6f};lon={self.lon:.6f};alt={self.alt:.6f};pacc={self.acc:.6f};filteronpos"
+            location = (self.lat, self.lon, self.alt)
+            url = f"{self.service_url}?token={self.token};gnss=gps;datatype=eph;lat={self.lat:.6f};lon={self.lon:.6f};alt={self.alt:.6f};pacc={self.acc:.6f};filteronpos"
         else:
-            url = f"http://online-live1.services.u-blox.com/GetOnlineData.ashx?token={self.token};gnss=gps;datatype=eph"
+            url = f"{self.service_url}?token={self.token};gnss=gps;datatype=eph"
 
         try:
-            data = req.urlopen(url).read()
-        except:
+            with req.urlopen(url, timeout=self.timeout) as response:
+                data = response.read()
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            logger.warning(f"UBXAssistOnline | Download failed: {e}")
             data = None
 
         if data:
             data = self.remove_mga_ini_msg(data)
-            self.data = data
-            self.write_data_to_file()
-        else:
-            self.load_data_from_file()
+        if not data:
+            self.schedule_retry()
+            return
+
+        self.failures = 0
+        new = self.cache.update(data, location=location)
+        self.cache.save()
+        self.next_fetch = max(self.cache.next_fetch(), time.time()+self.min_interval)
+        logger.info(f"UBXAssistOnline | {new} new ephemerides, {self.cache.status()}, next download in {(self.next_fetch-time.time())/60:.0f}min")
+
+    def schedule_retry(self):
+        """exponential backoff with jitter, the cached data stays in use"""
+        delay = min(self.max_backoff, self.retry_interval*2**self.failures)
+        delay *= random.uniform(0.8, 1.2)
+        self.failures += 1
+        self.next_fetch = time.time() + delay
+        logger.info(f"UBXAssistOnline | Retrying download in {delay:.0f}s, {self.cache.status()}")
 
     def remove_mga_ini_msg(self, data):
         while (data[:6] == b'\xb5\x62\x13\x40\x18\x00'):
@@ -89,24 +148,10 @@ class UBXAssistOnline(threading.Thread):
             data = None
         return data
 
-    def load_data_from_file(self):
-        try:
-            f = open(self.output_file, 'rb')
-            self.data = f.read()
-            f.close()
-        except FileNotFoundError:
-            pass
-
-    def write_data_to_file(self):
-        logger.info(f"UBXAssistOnline | Writing {len(self.data)} bytes Assistance Data to file {self.output_file}")
-        try:
-            f = open(self.output_file, 'wb')
-            f.write(self.data)
-        finally:
-            f.close()
-
     def stop(self):
-        self.keep_running = False
+        with self.condition:
+            self.keep_running = False
+            self.condition.notify()
         logger.info("UBXAssistOnline | Stopping Thread")
     
     def __del__(self):
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+"""
+Catalogue of registered antenna positions (Antennas.loc) with a spatial index.
+
+The file is CSV with the columns name, lat, lon, height, acc; rows that do not
+parse (the header, comments) are skipped. Entries are kept in a dict by name
+and in cubic ECEF cells of `cell` m, so finding the antennas around a position
+only looks at the few cells that the search radius touches, however large the
+catalogue is. load_catalog() caches the catalogue per file and reloads it only
+when the file changed.
+"""
+import csv
+import math
+import os
+
+from geodesy import ecef_distance, llh_to_ecef
+
+import logging
+logger = logging.getLogger(__name__)
+
+_CATALOGS = {}  # filename -> (mtime, AntennaCatalog)
+
+
+class AntennaCatalog():
+    def __init__(self, cell=1000.0):
+        """cell: edge length in m of the ECEF cells of the index"""
+        self.cell = cell
+        self.locations = {}  # name -> (lat, lon, height, acc)
+        self.cells = {}  # (i, j, k) -> [(x, y, z, name)]
+
+    def __len__(self):
+        return len(self.locations)
+
+    def add(self, name, location):
+        """the first entry of a name wins, like the sequential lookup did"""
+        if name in self.locations:
+            logger.warning(f"AntennaCatalog | Duplicate antenna {name}, keeping the first entry")
+            return
+        self.locations[name] = location
+        x, y, z = llh_to_ecef(*location[0:3])
+        self.cells.setdefault(self.key(x, y, z), []).append((x, y, z, name))
+
+    def key(self, x, y, z):
+        cell = self.cell
+        return (math.floor(x/cell), math.floor(y/cell), math.floor(z/cell))
+
+    def read(self, filename):
+        with open(filename, 'r') as f:
+            for row in csv.reader(f, delimiter=','):
+                if len(row) < 5 or row[0].startswith('#'):
+                    continue
+                try:
+                    location = tuple(float(value) for value in row[1:5])
+                except ValueError:
+                    continue  # header
+                self.add(row[0].strip(), location)
+        return self
+
+    def get(self, name):
+        return self.locations.get(name)
+
+    def within(self, lat, lon, height, radius):
+        """[(distance, name, location)] of the antennas within radius m, nearest first"""
+        x, y, z = llh_to_ecef(lat, lon, height)
+        i, j, k = self.key(x, y, z)
+        reach = math.ceil(radius/self.cell)
+        found = []
+        for di in range(-reach, reach+1):
+            for dj in range(-reach, reach+1):
+                for dk in range(-reach, reach+1):
+                    for entry in self.cells.get((i+di, j+dj, k+dk), ()):
+                        distance = ecef_distance((x, y, z), entry)
+                        if distance <= radius:
+                            found.append((distance, entry[3], self.locations[entry[3]]))
+        found.sort()
+        return found
+
+    def nearest(self, lat, lon, height, radius):
+        """(distance, name, location) of the nearest antenna within radius m or None"""
+        found = self.within(lat, lon, height, radius)
+        return found[0] if found else None
+
+
+def load_catalog(filename):
+    """catalogue of filename, read again only when its modification time changed"""
+    mtime = os.stat(filename).st_mtime
+    cached = _CATALOGS.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    catalog = AntennaCatalog().read(filename)
+    logger.info(f"AntennaCatalog | Loaded {len(catalog)} antennas from {filename}")
+    _CATALOGS[filename] = (mtime, catalog)
+    return catalog
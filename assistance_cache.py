@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+"""
+Cache of AssistNow Online data with validity tracking per satellite.
+
+A GPS ephemeris is valid for half its fit interval around its reference time
+toe. The cache keeps the newest MGA-GPS-EPH per satellite and knows when
+fewer than `min_satellites` valid ephemerides will remain, a new download is
+only due `margin` seconds before that.
+
+toe is given in seconds of the GPS week, the week is the one that puts toe
+closest to the reference time, i.e. the download time (the modification time
+for the cached file). Ephemerides whose validity has not started yet are
+dropped, they come from a wrongly resolved week.
+
+The file holds the cached UBX frames as delivered by the service and is
+replaced atomically, readers never see a partial file. The location the data
+was downloaded for is kept next to it in <file>.location (lat,lon,alt), so a
+restart knows whether the cached data fits the current location.
+"""
+import os
+import threading
+import time
+
+from time_output import write_file_atomic
+from ubxhelper import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+GPS_EPOCH = 315964800  # 1980-01-06 in unix time
+GPS_LEAP_SECONDS = 18
+WEEK = 604800
+
+
+def gps_time_of_week(unix_time):
+    return (unix_time - GPS_EPOCH + GPS_LEAP_SECONDS) % WEEK
+
+
+def ephemeris_validity(eph, reference_time):
+    """(valid from, valid until) in unix time of an UBX_MGA_GPS_EPH"""
+    offset = eph.toe - gps_time_of_week(reference_time)
+    offset = (offset + WEEK/2) % WEEK - WEEK/2
+    toe = reference_time + offset
+    half_fit = eph.fit_hours()*3600/2
+    return (toe - half_fit, toe + half_fit)
+
+
+class AssistanceCache():
+    def __init__(self, filename, min_satellites=8, margin=1800):
+        """
+        filename: file of the cached UBX frames \n
+        min_satellites: a download is due before fewer valid ephemerides remain \n
+        margin: seconds before the coverage ends at which the download is due
+        """
+        self.filename = filename
+        self.min_satellites = min_satellites
+        self.margin = margin
+        self.ephemerides = {}  # sv id -> (valid from, valid until, frame)
+        self.other = []  # frames without tracked validity, e.g. ionosphere and UTC parameters
+        self.downloaded = 0  # time of the last merged download
+        self.location = None  # (lat, lon, alt) the last download was made for, None if without position
+        self.lock = threading.Lock()  # the controller reads while the download thread updates
+
+    def update(self, data, reference_time=None, now=None, location=None):
+        """
+        merges the MGA frames of a download, returns the number of new ephemerides \n
+        reference_time: time the data was downloaded, default now \n
+        location: (lat, lon, alt) the data was downloaded for, None if without position
+        """
+        now = now or time.time()
+        with self.lock:
+            self.downloaded = reference_time or now
+            self.location = location
+            return self.merge(data, reference_time or now, now)
+
+    def merge(self, data, reference_time, now):
+        other = []
+        new = 0
+        while data:
+            length = starts_with_UBX_Message(data)
+            if not length:
+                data = data[1:]
+                continue
+            msg = UBXMSG(data[:length]).specify()
+            data = data[length:]
+            if msg.class_ID != b'\x13':
+                continue
+            if msg.msg_type != 'MGA-GPS-EPH':
+                other.append(msg.buffer)
+                continue
+            valid_from, valid_until = ephemeris_validity(msg, reference_time)
+            if valid_from > now:
+                continue
+            if msg.sv_health:
+                self.ephemerides.pop(msg.sv_id, None)
+                continue
+            # the later data replaces the cached ephemeris, also one with the same toe
+            cached = self.ephemerides.get(msg.sv_id)
+            if not cached or cached[0:2] != (valid_from, valid_until):
+                new += 1
+            self.ephemerides[msg.sv_id] = (valid_from, valid_until, msg.buffer)
+        if other:
+            self.other = other
+        return new
+
+    def expire(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            for sv_id in [sv for sv, (_, valid_until, _) in self.ephemerides.items() if valid_until <= now]:
+                del self.ephemerides[sv_id]
+
+    def valid_satellites(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            return sorted(sv for sv, (valid_from, valid_until, _) in self.ephemerides.items() if valid_from <= now < valid_until)
+
+    def coverage_until(self, now=None):
+        """time at which fewer than min_satellites valid ephemerides remain"""
+        now = now or time.time()
+        with self.lock:
+            ends = sorted((valid_until for valid_from, valid_until, _ in self.ephemerides.values() if valid_from <= now < valid_until), reverse=True)
+        if len(ends) < self.min_satellites:
+            return now
+        return ends[self.min_satellites-1]
+
+    def next_fetch(self, now=None):
+        """time the next download is due"""
+        now = now or time.time()
+        return max(now, self.coverage_until(now) - self.margin)
+
+    def data(self, now=None):
+        """UBX frames of the valid ephemerides and the other cached messages"""
+        now = now or time.time()
+        with self.lock:
+            frames = [frame for valid_from, valid_until, frame in self.ephemerides.values() if valid_from <= now < valid_until]
+            return b''.join(self.other + frames)
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+            downloaded = os.path.getmtime(self.filename)
+        except FileNotFoundError:
+            return
+        self.update(data, downloaded, location=self.load_location())
+        self.expire()
+        logger.info(f"AssistanceCache | Loaded {len(self.valid_satellites())} valid ephemerides from {self.filename}")
+
+    def load_location(self):
+        try:
+            with open(f"{self.filename}.location", 'r') as f:
+                return tuple(float(value) for value in f.read().split(','))[0:3] or None
+        except (OSError, ValueError):
+            return None
+
+    def save(self):
+        self.expire()
+        data = self.data()
+        if self.location:
+            write_file_atomic(f"{self.filename}.location", "{:.6f},{:.6f},{:.3f}\n".format(*self.location))
+        elif os.path.exists(f"{self.filename}.location"):
+            os.remove(f"{self.filename}.location")
+        write_file_atomic(self.filename, data)
+        logger.info(f"AssistanceCache | Writing {len(data)} bytes Assistance Data to file {self.filename}, {len(self.valid_satellites())} valid ephemerides")
+
+    def status(self, now=None):
+        now = now or time.time()
+        return f"valid: {len(self.valid_satellites(now))}, coverage for {(self.coverage_until(now)-now)/60:.0f}min"
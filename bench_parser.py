@@ -0,0 +1,238 @@
+#! /usr/bin/env python3
+"""
+Benchmark for the GPSParser framing, checksum/CRC and decode paths.
+
+Synthetic streams are built from a configurable mix of UBX, RTCM and NMEA
+frames with an optional corruption rate. Results are written as JSON so runs
+of different commits can be compared, e.g.
+
+./bench_parser.py --frames 20000 --corrupt 0.01 -o bench_output.txt
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import time
+
+from gpsparser import GPSParser
+from rtcmhelper import *
+from ubxhelper import *
+
+# kind:weight pairs, see build_frame for the available kinds
+DEFAULT_MIX = "NAV-PVT:10,NAV-SVIN:1,MGA:5,RTCM-1005:1,RTCM-MSM4:20,RTCM-MSM7:10,RTCM-1230:1,NMEA:5"
+
+# typical payload sizes of the RTCM frames streamed by the M8P
+RTCM_PAYLOAD_SIZES = {
+    "RTCM-1005": (1005, 19, 19),
+    "RTCM-MSM4": (1074, 120, 220),
+    "RTCM-MSM7": (1077, 250, 480),
+    "RTCM-1230": (1230, 8, 8),
+}
+
+
+def build_ubx_frame(class_id, msg_id, payload):
+    msg = UBXMSG()
+    msg.class_ID = class_id
+    msg.msg_ID = msg_id
+    msg.payload = payload
+    return msg.serialize()
+
+
+def build_rtcm_frame(msg_type, payload_length, rnd):
+    return build_rtcm_msg(msg_type, bytes(rnd.getrandbits(8) for _ in range(payload_length)))
+
+
+def build_nmea_frame(rnd):
+    body = f"GNGGA,{rnd.randint(0, 235959):06d}.00,4938.07530,N,00837.88809,E,1,12,0.62,149.9,M,47.9,M,,"
+    checksum = 0
+    for c in body.encode():
+        checksum ^= c
+    return f"${body}*{checksum:02X}\r\n".encode()
+
+
+def build_frame(kind, rnd):
+    if kind == "NAV-PVT":
+        payload = bytearray(rnd.getrandbits(8) for _ in range(92))
+        payload[4:6] = (2021).to_bytes(2, 'little')
+        return build_ubx_frame(b'\x01', b'\x07', bytes(payload))
+    if kind == "NAV-SVIN":
+        return build_ubx_frame(b'\x01', b'\x3B', bytes(rnd.getrandbits(8) for _ in range(40)))
+    if kind == "MGA":
+        # MGA-GPS-EPH sized blob
+        return build_ubx_frame(b'\x13', b'\x00', bytes(rnd.getrandbits(8) for _ in range(68)))
+    if kind in RTCM_PAYLOAD_SIZES:
+        msg_type, min_len, max_len = RTCM_PAYLOAD_SIZES[kind]
+        return build_rtcm_frame(msg_type, rnd.randint(min_len, max_len), rnd)
+    if kind == "NMEA":
+        return build_nmea_frame(rnd)
+    raise ValueError(f"unknown frame kind {kind}")
+
+
+def parse_mix(mix):
+    kinds = []
+    weights = []
+    for entry in mix.split(","):
+        kind, weight = entry.split(":")
+        kinds.append(kind.strip())
+        weights.append(float(weight))
+    return kinds, weights
+
+
+def corrupt(frame, rnd):
+    data = bytearray(frame)
+    pos = rnd.randrange(len(data))
+    data[pos] ^= 1 << rnd.randrange(8)
+    return bytes(data)
+
+
+def generate_stream(n_frames, mix=DEFAULT_MIX, corruption_rate=0.0, seed=1):
+    """returns (stream, list of intact frames, number of corrupted frames)"""
+    rnd = random.Random(seed)
+    kinds, weights = parse_mix(mix)
+    frames = []
+    chunks = []
+    corrupted = 0
+    for kind in rnd.choices(kinds, weights, k=n_frames):
+        frame = build_frame(kind, rnd)
+        if corruption_rate and rnd.random() < corruption_rate:
+            chunks.append(corrupt(frame, rnd))
+            corrupted += 1
+        else:
+            chunks.append(frame)
+            frames.append(frame)
+    return b''.join(chunks), frames, corrupted
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values)-1, int(round(p/100*(len(sorted_values)-1))))
+    return sorted_values[index]
+
+
+def latency_stats(latencies):
+    latencies.sort()
+    return {
+        "p50_us": percentile(latencies, 50)*1e6,
+        "p90_us": percentile(latencies, 90)*1e6,
+        "p99_us": percentile(latencies, 99)*1e6,
+        "max_us": latencies[-1]*1e6 if latencies else 0.0,
+    }
+
+
+def throughput(n_bytes, n_frames, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    return {
+        "seconds": elapsed,
+        "mb_per_s": n_bytes/elapsed/1e6,
+        "frames_per_s": n_frames/elapsed,
+    }
+
+
+def bench_framing(gpsp, stream, chunk_size):
+    """feed the stream in serial sized chunks and extract all frames"""
+    latencies = []
+    n_frames = 0
+    gpsp.buffer = b''
+    start = time.perf_counter()
+    for offset in range(0, len(stream), chunk_size):
+        gpsp.buffer += stream[offset:offset+chunk_size]
+        t0 = time.perf_counter()
+        msg = gpsp.extract_next_msg()
+        while msg:
+            t1 = time.perf_counter()
+            latencies.append(t1-t0)
+            n_frames += 1
+            t0 = t1
+            msg = gpsp.extract_next_msg()
+    elapsed = time.perf_counter()-start
+    result = throughput(len(stream), n_frames, elapsed)
+    result.update(latency_stats(latencies))
+    return result
+
+
+def bench_checksum(frames):
+    ubx_frames = [f for f in frames if starts_with_UBX_Header(f)]
+    rtcm_frames = [f for f in frames if starts_with_RTCM_Header(f)]
+
+    start = time.perf_counter()
+    for frame in ubx_frames:
+        UBXMSG().verify(frame)
+    ubx_elapsed = time.perf_counter()-start
+
+    start = time.perf_counter()
+    for frame in rtcm_frames:
+        check_crc(frame)
+    rtcm_elapsed = time.perf_counter()-start
+
+    return {
+        "ubx": throughput(sum(map(len, ubx_frames)), len(ubx_frames), ubx_elapsed),
+        "rtcm": throughput(sum(map(len, rtcm_frames)), len(rtcm_frames), rtcm_elapsed),
+    }
+
+
+def bench_decode(frames):
+    ubx_frames = [f for f in frames if starts_with_UBX_Header(f)]
+    latencies = []
+    start = time.perf_counter()
+    for frame in ubx_frames:
+        t0 = time.perf_counter()
+        UBXMSG(frame, 1).specify()
+        latencies.append(time.perf_counter()-t0)
+    elapsed = time.perf_counter()-start
+    result = throughput(sum(map(len, ubx_frames)), len(ubx_frames), elapsed)
+    result.update(latency_stats(latencies))
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmark(n_frames, mix, corruption_rate, chunk_size, seed):
+    stream, frames, corrupted = generate_stream(n_frames, mix, corruption_rate, seed)
+    gpsp = GPSParser()
+    return {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "parameters": {
+            "frames": n_frames,
+            "mix": mix,
+            "corruption_rate": corruption_rate,
+            "corrupted_frames": corrupted,
+            "chunk_size": chunk_size,
+            "stream_bytes": len(stream),
+            "seed": seed,
+        },
+        "framing": bench_framing(gpsp, stream, chunk_size),
+        "checksum": bench_checksum(frames),
+        "decode": bench_decode(frames),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark GPSParser on synthetic mixed protocol streams")
+    parser.add_argument("-n", "--frames", help="number of frames in the synthetic stream", type=int, default=10000)
+    parser.add_argument("-m", "--mix", help="frame mix as kind:weight,...", default=DEFAULT_MIX)
+    parser.add_argument("-c", "--corrupt", help="fraction of frames with a flipped bit", type=float, default=0.0)
+    parser.add_argument("-k", "--chunk_size", help="bytes per simulated serial read", type=int, default=1152)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="append JSON result line to file")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.frames, args.mix, args.corrupt, args.chunk_size, args.seed)
+    line = json.dumps(result, sort_keys=True)
+    print(line)
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+"""
+Ring buffer of validated frames in shared memory.
+
+One process writes complete frames (UBX, RTCM, NMEA) with their receive time,
+any number of processes read them without pickling or locking. The memory
+holds a header, an index of `slots` entries and `capacity` bytes of frame
+data:
+
+    header: published frames, reserved data position (absolute byte counts)
+    index:  per slot sequence number, data position, length, receive time
+    data:   frames back to back, a frame never wraps around the end
+
+The writer reserves the data range before it writes the frame, then writes
+the index entry and finally publishes the sequence number. A reader copies
+the frame and checks afterwards that neither its data nor its index entry
+was reused meanwhile, readers that fall behind lose frames instead of
+blocking the writer.
+"""
+import struct
+import sys
+
+from multiprocessing import shared_memory
+
+import logging
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<QQII')  # published frames, reserved position, slots, capacity
+HEADER_SIZE = 64
+INDEX = struct.Struct('<QQId')  # sequence, position, length, receive time
+
+
+class FrameRing():
+    def __init__(self, name=None, slots=4096, capacity=1 << 20):
+        """
+        name: attach to the ring of another process, None creates a new ring \n
+        slots: maximum number of frames held \n
+        capacity: bytes of frame data held
+        """
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + slots*INDEX.size + capacity)
+            HEADER.pack_into(self.shm.buf, 0, 0, 0, slots, capacity)
+        else:
+            self.shm = attach(name)
+            _, _, slots, capacity = HEADER.unpack_from(self.shm.buf, 0)
+        self.name = self.shm.name
+        self.slots = slots
+        self.capacity = capacity
+        self.data_start = HEADER_SIZE + slots*INDEX.size
+        self.write_seq, self.write_pos = self.published()
+
+    def put(self, frame, time_received):
+        """appends a frame, only one process may write"""
+        length = len(frame)
+        if length > self.capacity:
+            return False
+        pos = self.write_pos
+        offset = pos % self.capacity
+        if offset + length > self.capacity:
+            pos += self.capacity - offset
+            offset = 0
+        buf = self.shm.buf
+        struct.pack_into('<Q', buf, 8, pos + length)
+        buf[self.data_start+offset:self.data_start+offset+length] = frame
+        INDEX.pack_into(buf, HEADER_SIZE + (self.write_seq % self.slots)*INDEX.size, self.write_seq, pos, length, time_received)
+        self.write_seq += 1
+        self.write_pos = pos + length
+        struct.pack_into('<Q', buf, 0, self.write_seq)
+        return True
+
+    def __reduce__(self):
+        # a spawned process attaches to the ring by name
+        return (FrameRing, (self.name,))
+
+    def published(self):
+        """(number of published frames, reserved data position)"""
+        write_seq, reserved, _, _ = HEADER.unpack_from(self.shm.buf, 0)
+        return write_seq, reserved
+
+    def reader(self):
+        return RingReader(self)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingReader():
+    """position of one consumer, starts with the next published frame"""
+    def __init__(self, ring: FrameRing):
+        self.ring = ring
+        self.next_seq, _ = ring.published()
+        self.lost = 0
+
+    def read(self):
+        """list of (frame, receive time) published since the last call"""
+        ring = self.ring
+        write_seq, _ = ring.published()
+        # the slot of frame write_seq-slots may already be rewritten by the next put
+        if write_seq - self.next_seq >= ring.slots:
+            self.lost += write_seq - ring.slots + 1 - self.next_seq
+            self.next_seq = write_seq - ring.slots + 1
+        frames = []
+        buf = ring.shm.buf
+        while self.next_seq < write_seq:
+            seq = self.next_seq
+            self.next_seq += 1
+            entry_seq, pos, length, time_received = INDEX.unpack_from(buf, HEADER_SIZE + (seq % ring.slots)*INDEX.size)
+            offset = ring.data_start + pos % ring.capacity
+            frame = bytes(buf[offset:offset+length])
+            published, reserved = ring.published()
+            # the slot is reused by frame seq+slots, the data once the writer reserved beyond pos+capacity
+            if entry_seq != seq or published >= seq + ring.slots or reserved > pos + ring.capacity:
+                self.lost += 1
+                continue
+            frames.append((frame, time_received))
+        return frames
+
+
+def attach(name):
+    """opens the shared memory of another process without taking over its cleanup"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    # before 3.13 attaching registers the ring with the resource tracker, the
+    # reader process shares the tracker of its parent, which ignores the duplicate
+    return shared_memory.SharedMemory(name)
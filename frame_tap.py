@@ -0,0 +1,241 @@
+#! /usr/bin/env python
+"""
+Local distribution of the receiver's frames over a unix stream socket.
+
+Other tools on the base station connect to the socket and send a
+subscription line of space separated protocols or message types, e.g.
+
+    "NAV-PVT NAV-SAT"      UBX messages by name
+    "rtcm"                 all RTCM messages
+    "1005 1230"            RTCM messages by number
+    ""                     everything
+
+and receive the matching raw frames back to back. A new line replaces the
+subscription. UBX, RTCM and NMEA frames carry their own length, see
+read_frames().
+
+The reader thread only appends each frame to a queue, classifying and
+sending is done by the tap thread. Consumers that do not keep up lose frames
+once MAX_PENDING bytes are queued for them, the reader is never slowed down.
+"""
+import collections
+import os
+import selectors
+import socket
+import struct
+import sys
+import threading
+
+from gpsparser import frame_labels
+from metrics import METRICS
+
+import logging
+logger = logging.getLogger(__name__)
+
+METRICS.describe("frame_tap_frames_total", "frames of the local tap by result")
+METRICS.describe("frame_tap_consumers", "consumers connected to the local tap", "gauge")
+
+MAX_PENDING = 256*1024  # bytes queued per consumer before frames are dropped
+WAKEUP = 'wakeup'
+LISTENER = 'listener'
+
+
+class TapConsumer():
+    def __init__(self, sock):
+        self.sock = sock
+        self.subscription = None  # None until the first line, empty set = everything
+        self.line = b''
+        self.pending = bytearray()
+
+    def subscribe(self, data):
+        """returns False if the consumer closed the connection"""
+        if not data:
+            return False
+        self.line += data
+        while b'\n' in self.line:
+            line, self.line = self.line.split(b'\n', 1)
+            self.subscription = {token.lower() for token in line.decode(errors='replace').split()}
+        return True
+
+    def wants(self, protocol, msg_type):
+        if self.subscription is None:
+            return False
+        return not self.subscription or protocol in self.subscription or msg_type in self.subscription
+
+
+class FrameTap(threading.Thread):
+    def __init__(self, gpsp, path):
+        """gpsp: GPSParser whose frames are distributed, path: unix socket path"""
+        self.gpsp = gpsp
+        self.path = path
+        self.keep_running = True
+        self.frames = collections.deque()
+        self.consumers = {}  # socket -> TapConsumer
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, WAKEUP)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, LISTENER)
+        METRICS.register_gauge('frame_tap_consumers', lambda: len(self.consumers), gpsp.metric_labels)
+        threading.Thread.__init__(self, name='tap', daemon=True)
+
+    def on_frame(self, frame, time_received):
+        """listener called by the reader thread"""
+        if not self.consumers:
+            return
+        self.frames.append(frame)
+        self.wake()
+
+    def wake(self):
+        try:
+            os.write(self.wakeup_w, b'\0')
+        except BlockingIOError:
+            pass  # a wakeup is pending anyway
+
+    def run(self):
+        logger.info(f"FrameTap | Serving frames on {self.path}")
+        self.gpsp.add_frame_listener(self.on_frame)
+        while self.keep_running:
+            for key, events in self.selector.select(1.0):
+                if key.data == WAKEUP:
+                    self.drain_wakeups()
+                elif key.data == LISTENER:
+                    self.accept()
+                else:
+                    self.service(key.data, events)
+            self.distribute()
+        self.gpsp.remove_frame_listener(self.on_frame)
+        self.close()
+
+    def drain_wakeups(self):
+        try:
+            while os.read(self.wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def accept(self):
+        try:
+            sock, _ = self.server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        consumer = TapConsumer(sock)
+        self.consumers[sock] = consumer
+        self.selector.register(sock, selectors.EVENT_READ, consumer)
+        logger.info(f"FrameTap | Consumer connected, {len(self.consumers)} connected")
+
+    def service(self, consumer, events):
+        if events & selectors.EVENT_READ:
+            try:
+                data = consumer.sock.recv(4096)
+            except BlockingIOError:
+                data = None
+            except OSError:
+                data = b''
+            if data is not None and not consumer.subscribe(data):
+                self.drop(consumer)
+                return
+        if events & selectors.EVENT_WRITE:
+            self.flush(consumer)
+
+    def distribute(self):
+        while self.frames:
+            frame = self.frames.popleft()
+            labels = dict(frame_labels(frame))
+            protocol, msg_type = labels['protocol'], labels['type'].lower()
+            for consumer in list(self.consumers.values()):
+                if not consumer.wants(protocol, msg_type):
+                    continue
+                if len(consumer.pending) + len(frame) > MAX_PENDING:
+                    METRICS.inc('frame_tap_frames_total', 1, self.gpsp.metric_labels + (('result', 'dropped'),))
+                    continue
+                consumer.pending += frame
+                METRICS.inc('frame_tap_frames_total', 1, self.gpsp.metric_labels + (('result', 'sent'),))
+        for consumer in list(self.consumers.values()):
+            if consumer.pending:
+                self.flush(consumer)
+
+    def flush(self, consumer):
+        try:
+            sent = consumer.sock.send(consumer.pending)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.drop(consumer)
+            return
+        del consumer.pending[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if consumer.pending else 0)
+        self.selector.modify(consumer.sock, events, consumer)
+
+    def drop(self, consumer):
+        if consumer.sock not in self.consumers:
+            return
+        del self.consumers[consumer.sock]
+        self.selector.unregister(consumer.sock)
+        consumer.sock.close()
+        logger.info(f"FrameTap | Consumer disconnected, {len(self.consumers)} connected")
+
+    def stop(self):
+        self.keep_running = False
+        self.wake()
+        self.join()
+
+    def close(self):
+        for consumer in list(self.consumers.values()):
+            self.drop(consumer)
+        self.selector.close()
+        self.server.close()
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def read_frames(sock):
+    """generator of the frames received from a tap socket"""
+    buffer = b''
+    while True:
+        length = frame_length(buffer)
+        if length and len(buffer) >= length:
+            yield buffer[:length]
+            buffer = buffer[length:]
+            continue
+        data = sock.recv(65536)
+        if not data:
+            return
+        buffer += data
+
+
+def frame_length(buffer):
+    """length of the frame at the start of buffer, 0 if not known yet"""
+    if buffer[:2] == b'\xb5\x62' and len(buffer) >= 6:
+        return struct.unpack('<H', buffer[4:6])[0] + 8
+    if buffer[:1] == b'\xd3' and len(buffer) >= 3:
+        return (struct.unpack('>H', buffer[1:3])[0] & 1023) + 6
+    if buffer[:1] == b'$' and b'\n' in buffer:
+        return buffer.index(b'\n') + 1
+    return 0
+
+
+if __name__ == "__main__":
+    # ./frame_tap.py /path/to/socket NAV-PVT rtcm   prints the received frame types
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(sys.argv[1])
+    sock.sendall(' '.join(sys.argv[2:]).encode() + b'\n')
+    try:
+        for frame in read_frames(sock):
+            print(dict(frame_labels(frame)), len(frame))
+    except KeyboardInterrupt:
+        pass
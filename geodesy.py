@@ -0,0 +1,41 @@
+#! /usr/bin/env python
+"""WGS84 conversions between geodetic coordinates and ECEF"""
+import math
+
+WGS84_A = 6378137.0
+WGS84_F = 1/298.257223563
+WGS84_E2 = WGS84_F*(2-WGS84_F)
+WGS84_B = WGS84_A*(1-WGS84_F)
+WGS84_EP2 = (WGS84_A**2-WGS84_B**2)/WGS84_B**2
+
+
+def llh_to_ecef(lat, lon, height):
+    """lat/lon in deg, height in m above ellipsoid, returns x, y, z in m"""
+    lat = math.radians(lat)
+    lon = math.radians(lon)
+    sin_lat = math.sin(lat)
+    n = WGS84_A/math.sqrt(1-WGS84_E2*sin_lat**2)
+    x = (n+height)*math.cos(lat)*math.cos(lon)
+    y = (n+height)*math.cos(lat)*math.sin(lon)
+    z = (n*(1-WGS84_E2)+height)*sin_lat
+    return x, y, z
+
+
+def ecef_to_llh(x, y, z):
+    """returns lat/lon in deg and height in m above ellipsoid"""
+    lon = math.atan2(y, x)
+    p = math.hypot(x, y)
+    # Bowring's initial value, two iterations are well below 0.1 mm
+    lat = math.atan2(z*WGS84_A, p*WGS84_B)
+    lat = math.atan2(z+WGS84_EP2*WGS84_B*math.sin(lat)**3, p-WGS84_E2*WGS84_A*math.cos(lat)**3)
+    for _ in range(2):
+        n = WGS84_A/math.sqrt(1-WGS84_E2*math.sin(lat)**2)
+        height = p/math.cos(lat)-n
+        lat = math.atan2(z, p*(1-WGS84_E2*n/(n+height)))
+    n = WGS84_A/math.sqrt(1-WGS84_E2*math.sin(lat)**2)
+    height = p/math.cos(lat)-n
+    return math.degrees(lat), math.degrees(lon), height
+
+
+def ecef_distance(a, b):
+    return math.sqrt((a[0]-b[0])**2 + (a[1]-b[1])**2 + (a[2]-b[2])**2)
@@ -14,13 +14,35 @@ import threading
 from os import fchown
 import socket
 import subprocess
+from metrics import METRICS, ThreadProfiler
+from hotplug import HotplugWatcher, BY_ID_DIR, by_id_path
+import os
 
 import logging
 logger = logging.getLogger(__name__)
 
+UBLOX_VID = 0x1546
+M8P_PID = 0x01a8
+HOTPLUG_RESCAN = 5.0 #seconds, rescan even without hotplug event
+
 class GPSParser(threading.Thread):
-    def __init__(self):
+    def __init__(self, port=None, baudrate=115200, name=None, udp_port=10777):
+        """
+        port: explicit serial device e.g. /dev/serial/by-id/usb-u-blox_... or a pty
+        of the simulator, if None the USB ports are scanned for a ublox M8P \n
+        name: receiver name used as metric label when several receivers are run \n
+        udp_port: port the RTCM data is broadcast to
+        """
         logger.debug(f' GPSParser | initializing object')
+        self.explicit_port = port
+        self.port = None
+        self.last_port = None
+        self.excluded_ports = set()
+        self.hotplug = None
+        self.mux = None  # DeviceMultiplexer servicing this parser instead of its own thread
+        self.receiver_name = name
+        self.udp_port = udp_port
+        self.baudrate = baudrate
         self.buffer = b''
         self.tx_buffer = b''
         self.rx_buffer = b''
@@ -33,11 +55,49 @@ class GPSParser(threading.Thread):
         self.stream = serial.Serial()
         self.ubx_buffer=[]
         self.ubx_lock= threading.Lock()
+        self.ubx_listeners = []
+        self.frame_listeners = []
+        self.ubx_event = threading.Event()
         self.ready=False
+        self.connection_count = 0
         self.udp_stream_active = False
         self.last_stream_read= time.time()
+        self.read_monotonic = time.monotonic()  # when the last read returned
+        self.previous_read_monotonic = self.read_monotonic
+        self.last_data_received = time.time()
+        self.reconnect_requested = False
+        self.link_capacity = 0 # bytes/s of a UART link, 0 for USB or unknown
+        self.rx_rate = 0.0
+        self.rx_window_start = time.monotonic()
+        self.rx_window_bytes = 0
+        self.metrics = METRICS
+        self.metric_labels = (('receiver', name),) if name else ()
+        self.profiler = ThreadProfiler('reader')
+        self.register_queue_gauges()
         self.init_udp_sock()
         threading.Thread.__init__(self)
+
+    def register_queue_gauges(self):
+        queues = {
+            'rx_buffer': lambda: len(self.buffer),
+            'tx_buffer': lambda: len(self.rx_buffer),
+            'rtcm_buffer': lambda: len(self.rtcm_buffer),
+            'ubx_msgs': lambda: len(self.ubx_buffer),
+        }
+        for queue, callback in queues.items():
+            self.metrics.register_gauge('gpsparser_queue_depth', callback, self.metric_labels + (('queue', queue),))
+        self.metrics.register_gauge('gpsparser_link_bytes_per_second', lambda: self.rx_rate, self.metric_labels)
+        self.metrics.register_gauge('gpsparser_link_utilisation', self.link_utilisation, self.metric_labels)
+
+    def link_utilisation(self):
+        """received bytes per second against the capacity of a UART link, 0 if unknown"""
+        if not self.link_capacity:
+            return 0.0
+        return self.rx_rate/self.link_capacity
+
+    def set_link_baudrate(self, baudrate):
+        """capacity of a UART link, 8N1 needs 10 bit per byte. None for USB"""
+        self.link_capacity = baudrate/10 if baudrate else 0
     
     def init_udp_sock(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -49,7 +109,7 @@ class GPSParser(threading.Thread):
         for ip in ip_list:
             if ip=='':
                 continue
-            self.udp_broadcasts.append((ip,10777)) 
+            self.udp_broadcasts.append((ip,self.udp_port)) 
         if ip_list:
             logger.info (f"GPSParser | Found following UDP broadcasts: {ip_list}")
         else:
@@ -59,59 +119,209 @@ class GPSParser(threading.Thread):
 
 
     def open_stream_to_gps_device(self):
-        gps_found = False
-
-        logger.info ("GPSParser | Scanning for GPS device on USB Ports")
+        """
+        tries the candidate ports and otherwise waits for hotplug events,
+        the ports are only scanned again when a watched directory changes
+        """
+        if not self.hotplug:
+            self.hotplug = HotplugWatcher()
+        if self.explicit_port:
+            logger.info (f"GPSParser | Opening GPS device on port {self.explicit_port}")
+        else:
+            logger.info ("GPSParser | Scanning for GPS device on USB Ports")
 
-        while not gps_found:
+        while self.keep_running:
+            # watch before scanning, a device appearing in between is not missed
+            for directory in self.watched_directories():
+                self.hotplug.watch(directory)
+            if self.try_open():
+                return
+            changed = self.hotplug.wait(HOTPLUG_RESCAN)
+            if changed:
+                logger.debug(f"GPSParser | Hotplug events: {changed}")
+
+    def try_open(self):
+        """opens the first candidate port that works, returns True on success"""
+        for port in self.candidate_ports():
+            try:
+                self.stream = serial.Serial(port, self.baudrate)
+            except (SerialException, OSError):
+                continue
+            self.port = port
+            self.last_port = by_id_path(port) or port
+            logger.info (f"GPSParser | Connection established to GPS device on port {port}")
+            self.connection_count += 1
+            self.ready=True
+            return True
+        return False
+
+    def watched_directories(self):
+        directories = ['/dev', BY_ID_DIR]
+        if self.explicit_port:
+            directories.append(os.path.dirname(os.path.abspath(self.explicit_port)))
+        return directories
+
+    def candidate_ports(self):
+        """explicit port, else the last known port followed by all M8Ps found on USB"""
+        if self.explicit_port:
+            ports = [self.explicit_port] if os.path.exists(self.explicit_port) else []
+        else:
+            ports = []
+            if self.last_port and os.path.exists(self.last_port):
+                ports.append(self.last_port)
             for port in serial.tools.list_ports.comports():
-                if (port.vid == 0x1546) & (port.pid == 0x01a8):
-                    self.port ='/dev/' + port.name
-                    try:
-                        self.stream = serial.Serial(self.port, 115200)
-                    except SerialException:
-                        continue
-                    logger.info (f"GPSParser | Connection established to Ublox GPS device on port {port.name}")
-                    gps_found = True
-                    self.ready=True
-            
-            time.sleep(0.1)
-        
+                if port.vid == UBLOX_VID and port.pid == M8P_PID:
+                    ports.append(port.device)
+        # ports of other receivers and ports of the wrong receiver are skipped
+        taken = set(self.excluded_ports)
+        if self.mux:
+            taken |= self.mux.claimed_ports(self)
+        return [port for port in ports if os.path.realpath(port) not in taken]
+
+    def exclude_port(self, port):
+        """never use port again, e.g. because another receiver is connected to it"""
+        self.excluded_ports.add(os.path.realpath(port))
+        self.ready = False
+        self.reconnect()
+
+    def device_removed(self):
+        """true if the port of the open stream was removed according to hotplug events"""
+        if not self.hotplug or not self.port:
+            return False
+        changed = self.hotplug.poll()
+        return bool(changed) and not os.path.exists(self.port)
+
+    def close_stream(self, reason):
+        if self.stream.isOpen():
+            logger.warning(f"GPSParser | Connection to {self.port} lost: {reason}")
+            self.metrics.inc('gpsparser_disconnects_total', 1, self.metric_labels)
+        self.stream.close()
+        self.ready=False
+
     def run(self):
 
         logger.debug(f'GPSParser | run function started')
         while (self.keep_running):
+            self.profiler.poll()
+            self.check_reconnect()
             if not self.stream.isOpen():
                 self.ready=False
                 logger.info (f"GPSParser | No Connection to GPS device")                   
                 self.open_stream_to_gps_device()
-            self.send_rx_buffer_to_stream()
-            self.fill_buffer_from_stream()
-
-            #process all messages from buffer
-            msg = self.extract_next_msg()
-            while(msg):
-                if (starts_with_UBX_Header(msg)):
-                    self.ubx_lock.acquire()
-                    self.ubx_buffer.append(UBXMSG(msg, self.last_stream_read))
-                    self.ubx_lock.release()
-
-                elif (starts_with_RTCM_Header(msg) and self.udp_stream_active):
-                    #idea: only publish after reception of rtcm 1005 (comes ~60ms late) & rtcm1230(last message of MSM4/MSM7 +code phase bias block comes within 1ms)
-                    self.buffer_and_publish_on_1230(msg)
-                
-                msg=self.extract_next_msg()
-            #if(msg):
-            #    logger.info(f"GPS Parser | {msg}")
-            #if(starts_with_NMEA_Header(msg)):
+                continue
+            if self.device_removed():
+                self.close_stream('device removed')
+                continue
+            self.service()
             time.sleep(0.01)
         
         logger.debug(f'GPSParser | run function ended ')
 
+    def check_reconnect(self):
+        if self.reconnect_requested:
+            self.reconnect_requested = False
+            logger.warning(f"GPSParser | Reopening connection to GPS device")
+            self.stream.close()
+            self.ready=False
+
+    def service(self):
+        """one pass over the open stream: write pending data, read and dispatch all complete frames"""
+        self.send_rx_buffer_to_stream()
+        self.fill_buffer_from_stream()
+
+        #process all messages from buffer
+        msg = self.extract_next_msg()
+        while(msg):
+            self.dispatch(msg)
+            msg=self.extract_next_msg()
+
+    def dispatch(self, msg):
+        """handles one complete frame read from the stream"""
+        self.metrics.inc('gpsparser_frames_total', 1, self.metric_labels + frame_labels(msg))
+        time_received = self.receive_time()
+        for listener in self.frame_listeners:
+            listener(msg, time_received)
+        if (starts_with_UBX_Header(msg)):
+            self.dispatch_ubx(msg, time_received)
+
+        elif (starts_with_RTCM_Header(msg) and self.udp_stream_active):
+            #idea: only publish after reception of rtcm 1005 (comes ~60ms late) & rtcm1230(last message of MSM4/MSM7 +code phase bias block comes within 1ms)
+            self.buffer_and_publish_on_1230(msg)
+
+    def receive_time(self):
+        """
+        system time at which the last byte of the frame just extracted arrived.
+        On a UART link the bytes still in the buffer followed it at the link
+        rate, but none of them arrived before the previous read. Frames from
+        USB get the time of the read
+        """
+        if not self.link_capacity:
+            return self.last_stream_read
+        delay = min(len(self.buffer)/self.link_capacity, self.read_monotonic-self.previous_read_monotonic)
+        return self.last_stream_read - delay
+
+    def dispatch_ubx(self, msg, time_received):
+        ubx_msg = UBXMSG(msg, time_received)
+        for listener in self.ubx_listeners:
+            listener(ubx_msg)
+        self.ubx_lock.acquire()
+        self.ubx_buffer.append(ubx_msg)
+        self.ubx_lock.release()
+        self.ubx_event.set()
+
+    def wait_for_ubx(self, timeout):
+        """blocks until UBX messages were received or timeout seconds passed"""
+        self.ubx_event.wait(timeout)
+        self.ubx_event.clear()
+
+    def add_ubx_listener(self, listener):
+        """listener(UBXMSG) is called from the reader thread for every UBX message"""
+        # replace instead of mutate, the reader thread iterates without lock
+        self.ubx_listeners = self.ubx_listeners + [listener]
+
+    def remove_ubx_listener(self, listener):
+        self.ubx_listeners = [l for l in self.ubx_listeners if l != listener]
+
+    def add_frame_listener(self, listener):
+        """listener(frame, time_received) is called from the reader thread for every complete frame of any protocol"""
+        self.frame_listeners = self.frame_listeners + [listener]
+
+    def remove_frame_listener(self, listener):
+        self.frame_listeners = [l for l in self.frame_listeners if l != listener]
+
+    def set_baudrate(self, baudrate, delay=0.0):
+        """
+        writes pending data, waits delay seconds and switches the open port to baudrate,
+        the receiver only changes its rate after its tx buffer is drained
+        """
+        self.rx_lock.acquire()
+        try:
+            self.stream.write(self.rx_buffer[:])
+            self.rx_buffer = b''
+            self.stream.flush()
+            time.sleep(delay)
+            self.stream.baudrate = baudrate
+            self.baudrate = baudrate
+        except (serial.SerialException, OSError):
+            self.metrics.inc('gpsparser_write_errors_total', 1, self.metric_labels)
+            self.close_stream('baudrate change failed')
+        finally:
+            self.rx_lock.release()
+        if self.link_capacity:
+            self.set_link_baudrate(baudrate)
+
+    def reconnect(self):
+        """close and reopen the serial connection from the reader thread"""
+        self.reconnect_requested = True
+        if self.mux:
+            self.mux.wake()
+
     def stop(self):
         logger.info (f'GPSParser | stop function started')
         self.keep_running = False
         self.join()
+        if self.hotplug:
+            self.hotplug.close()
         logger.info(f'GPSParser | stop function ended')
     
     def buffer_and_publish_on_1230(self, rtcm_msg):
@@ -131,11 +341,13 @@ class GPSParser(threading.Thread):
         for broadcast in self.udp_broadcasts:
             try:
                 self.sock.sendto(data, broadcast)
-                log_msg= f"GPSParser | len={len(data)}, content={bytes_to_str(data)}"
-                logger.debug(log_msg)
+                self.metrics.inc('gpsparser_udp_sends_total', 1, self.metric_labels)
+                self.metrics.inc('gpsparser_udp_bytes_total', len(data), self.metric_labels)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"GPSParser | len={len(data)}, content={bytes_to_str(data)}")
                 break #finish after first successful transmission
             except OSError:
-                pass
+                self.metrics.inc('gpsparser_udp_send_errors_total', 1, self.metric_labels)
             
     
     def get_next_ubx_msg(self):
@@ -216,39 +428,69 @@ class GPSParser(threading.Thread):
         self.rx_lock.acquire()
         self.rx_buffer += data
         self.rx_lock.release()
+        if self.mux:
+            self.mux.wake()
         
     def send_rx_buffer_to_stream(self):       
         self.rx_lock.acquire()
         try: 
             self.stream.write(self.rx_buffer[:])
-        except serial.SerialException:
+        except (serial.SerialException, OSError):
             logger.warning(f'GPS Parser | Write Error')
-            self.stream.close()
+            self.metrics.inc('gpsparser_write_errors_total', 1, self.metric_labels)
+            self.close_stream('write error')
         self.rx_buffer = b''
         self.rx_lock.release()
     
     def fill_buffer_from_stream(self):
-        self.last_stream_read= time.time()
         try:
-            self.buffer += self.stream.read_all()
+            data = self.stream.read_all()
+            # taken right after the read returned, see receive_time
+            self.previous_read_monotonic = self.read_monotonic
+            self.read_monotonic = time.monotonic()
+            self.last_stream_read = time.time()
+            if data:
+                self.last_data_received = self.last_stream_read
+            self.update_rx_rate(len(data))
+            self.buffer += data
+            self.metrics.inc('gpsparser_bytes_read_total', len(data), self.metric_labels)
         except OSError:
             logger.warning(f'GPS Parser |  Read Error')
-            self.stream.close()
+            self.metrics.inc('gpsparser_read_errors_total', 1, self.metric_labels)
+            self.close_stream('read error')
+
+    def update_rx_rate(self, n_bytes):
+        self.rx_window_bytes += n_bytes
+        elapsed = self.read_monotonic - self.rx_window_start
+        if elapsed >= 1.0:
+            self.rx_rate = self.rx_window_bytes/elapsed
+            self.rx_window_start = self.read_monotonic
+            self.rx_window_bytes = 0
 
     def request_mga_db(self):
-        msg = ubxhelper.UBX_MGA_DBD().serialize()
-        self.fill_buffer_from_stream()
-        self.stream.write(msg)
+        """poll the navigation database, the receiver answers with a series of MGA-DBD messages"""
+        self.send_to_gps(UBX_MGA_DBD().serialize_poll())
 
     def clear_buffer_until_next_msg_and_return_length(self):
 
         buffer = self.buffer[:]
         length = 0
+        corrupted = 0
         while len(buffer)>8:
             length = self.starts_with_message(buffer)
             if length:
+                skipped = len(self.buffer) - len(buffer)
+                if skipped:
+                    # only count once the bytes are really dropped, the same
+                    # bytes are rescanned while a message is incomplete
+                    self.metrics.inc('gpsparser_resync_bytes_total', skipped, self.metric_labels)
+                if corrupted:
+                    self.metrics.inc('gpsparser_checksum_failures_total', corrupted, self.metric_labels)
                 self.buffer = buffer
                 break
+            if len(buffer) == len(self.buffer) and is_complete_frame(buffer):
+                # frame expected at the start of the buffer is complete but invalid
+                corrupted = 1
             buffer = buffer[1:]
         return length
 
@@ -385,13 +627,26 @@ class UDPServer(threading.Thread):
 
 
 
+def frame_labels(msg):
+    """prometheus labels for protocol and type of a frame"""
+    if starts_with_UBX_Header(msg):
+        name = get_msg_by_id(msg[2:4]) or msg[2:4].hex()
+        return (('protocol', 'ubx'), ('type', name))
+    if starts_with_RTCM_Header(msg):
+        return (('protocol', 'rtcm'), ('type', str(get_rtcm_msg_type(msg))))
+    if starts_with_NMEA_Header(msg):
+        return (('protocol', 'nmea'), ('type', msg[1:6].decode(errors='replace')))
+    return (('protocol', 'unknown'), ('type', ''))
+
+
+def is_complete_frame(buffer):
+    """true if buffer starts with a UBX or RTCM header and holds the complete declared length"""
+    if starts_with_UBX_Header(buffer) and len(buffer) >= UBX_MSG_MIN_LENGTH:
+        return len(buffer) >= struct.unpack('<H', buffer[4:6])[0] + 8
+    if starts_with_RTCM_Header(buffer) and len(buffer) >= 3:
+        return len(buffer) >= (struct.unpack('>H', buffer[1:3])[0] & 1023) + 6
+    return False
+
+
 def bytes_to_str(bytestr):
-    string=""
-    for b in bytestr:
-        string+= f"{b:02x} "
-    
-    #remove last blank
-    if string.endswith(" "):
-        string=string[:-1]
-    
-    return string
+    return bytestr.hex(' ')
@@ -0,0 +1,117 @@
+#! /usr/bin/env python
+"""
+Health monitor for the link to the receiver with graded recovery.
+
+When status messages stop, recovery escalates step by step and gives the
+receiver `step_interval` seconds to recover after each step:
+
+rerequest_messages -> reapply_config -> reopen_serial -> reset
+
+If no bytes arrive at all the link itself is dead and recovery starts at
+reopen_serial. Any status message resets the ladder.
+"""
+import time
+
+from metrics import METRICS
+
+import logging
+logger = logging.getLogger(__name__)
+
+RECOVERY_STEPS = ['rerequest_messages', 'reapply_config', 'reopen_serial', 'reset']
+
+METRICS.describe("rtkstreamer_recoveries_total", "recovery actions by the health monitor")
+METRICS.describe("rtkstreamer_health_score", "health of the receiver link, 1 = healthy", 'gauge')
+METRICS.describe("rtkstreamer_recovery_level", "current step of the recovery ladder, 0 = none", 'gauge')
+
+
+class HealthMonitor():
+    def __init__(self, grace=5.0, step_interval=5.0, link_timeout=2.0, rate_alpha=0.2):
+        """
+        grace: seconds without status before recovery starts \n
+        step_interval: seconds between recovery steps \n
+        link_timeout: seconds without any byte after which the link counts as dead \n
+        rate_alpha: smoothing factor of the message rate estimates
+        """
+        self.grace = grace
+        self.step_interval = step_interval
+        self.link_timeout = link_timeout
+        self.rate_alpha = rate_alpha
+        self.level = 0
+        self.last_action = 0
+        self.last_status = time.time()
+        self.last_data = time.time()
+        self.fix_ok = False
+        self.arrivals = ArrivalRates(rate_alpha)
+
+    def note_status(self, t=None):
+        self.last_status = t or time.time()
+        if self.level:
+            logger.info(f"HealthMonitor | Recovered after {RECOVERY_STEPS[self.level-1]}")
+            self.level = 0
+
+    def note_data(self, t):
+        """t: time of the last non-empty read from the receiver"""
+        self.last_data = t
+
+    def note_fix(self, fix_ok):
+        self.fix_ok = fix_ok
+
+    def note_msg(self, msg_type, t):
+        self.arrivals.note(msg_type, t)
+
+    def message_rate(self, msg_type, now=None):
+        """smoothed rate in Hz, decays when the message stops"""
+        return self.arrivals.rate(msg_type, now)
+
+    def link_alive(self, now):
+        return now-self.last_data < self.link_timeout
+
+    def score(self, now=None):
+        """0..1 from link liveness, status age and fix state"""
+        now = now or time.time()
+        status_age = now-self.last_status
+        status_score = max(0.0, 1-status_age/(self.grace*2))
+        return 0.4*self.link_alive(now) + 0.4*status_score + 0.2*self.fix_ok
+
+    def next_action(self, now=None):
+        """returns the recovery step due now or None"""
+        now = now or time.time()
+        if now-self.last_status < self.grace:
+            return None
+        if self.level and now-self.last_action < self.step_interval:
+            return None
+        if self.level >= len(RECOVERY_STEPS):
+            return None
+        if not self.link_alive(now):
+            self.level = max(self.level, RECOVERY_STEPS.index('reopen_serial'))
+        action = RECOVERY_STEPS[self.level]
+        self.level += 1
+        self.last_action = now
+        logger.warning(f"HealthMonitor | No status for {now-self.last_status:.1f}s, link alive: {self.link_alive(now)}, recovery step: {action}")
+        return action
+
+
+class ArrivalRates():
+    """smoothed arrival rates per key, e.g. message type"""
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.arrivals = {}  # key -> (last arrival, smoothed rate in Hz)
+
+    def note(self, key, t):
+        last, rate = self.arrivals.get(key, (0, 0.0))
+        if last and t > last:
+            rate += self.alpha*(1/(t-last)-rate)
+        self.arrivals[key] = (t, rate)
+
+    def rate(self, key, now=None):
+        """rate in Hz, decays when the key stops arriving"""
+        last, rate = self.arrivals.get(key, (0, 0.0))
+        if not last:
+            return 0.0
+        now = now or time.time()
+        if rate and now-last > 1/rate:
+            return min(rate, 1/(now-last))
+        return rate
+
+    def keys(self):
+        return list(self.arrivals)
@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+"""
+Hotplug driven discovery of the GPS device.
+
+Instead of enumerating the USB ports in a loop, the directories the device
+node and its udev symlinks appear in are watched with inotify, the ports are
+only scanned again when something changes there. udev creates the node first
+and sets its permissions afterwards, so attribute changes count as well.
+
+Where inotify is not available wait() just sleeps and the caller rescans
+after the timeout.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+import logging
+logger = logging.getLogger(__name__)
+
+BY_ID_DIR = '/dev/serial/by-id'
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+WATCH_MASK = IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class HotplugWatcher():
+    def __init__(self):
+        self.fd = -1
+        self.watches = {}  # watch descriptor -> directory
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            pass
+        if self.fd < 0:
+            logger.warning("HotplugWatcher | inotify not available, falling back to periodic scans")
+
+    @property
+    def available(self):
+        return self.fd >= 0
+
+    def watch(self, directory):
+        """adds a watch for directory if it exists and is not watched yet"""
+        if not self.available or directory in self.watches.values() or not os.path.isdir(directory):
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            logger.warning(f"HotplugWatcher | Cannot watch {directory}: {os.strerror(ctypes.get_errno())}")
+            return
+        self.watches[wd] = directory
+
+    def wait(self, timeout):
+        """returns the paths that changed within timeout seconds"""
+        if not self.available:
+            select.select([], [], [], timeout)
+            return []
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        return self.read_events()
+
+    def poll(self):
+        """returns the paths that changed since the last call without blocking"""
+        if not self.available:
+            return []
+        return self.read_events()
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset+length].rstrip(b'\0')
+            offset += length
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF):
+                # the directory was removed, e.g. by-id after the last device is gone
+                del self.watches[wd]
+                paths.append(directory)
+                continue
+            paths.append(os.path.join(directory, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        if self.available:
+            os.close(self.fd)
+            self.fd = -1
+            self.watches = {}
+
+
+def by_id_path(device):
+    """stable /dev/serial/by-id symlink of a device node or None"""
+    try:
+        names = os.listdir(BY_ID_DIR)
+    except OSError:
+        return None
+    real = os.path.realpath(device)
+    for name in sorted(names):
+        path = os.path.join(BY_ID_DIR, name)
+        if os.path.realpath(path) == real:
+            return path
+    return None
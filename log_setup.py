@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+"""
+Logging off the hot path.
+
+Threads only put records into a queue (QueueHandler), a QueueListener thread
+formats them and writes the rotating log file, so disk I/O never stalls the
+reader. With a reader process the queue is a multiprocessing queue, the
+reader process installs it with log_to_queue() and both processes log into
+the same file through the listener of the controller.
+
+RateLimiter lets repetitive lines like the per second SVIN status through
+once per interval.
+"""
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import time
+
+LOG_FORMAT = '[%(levelname)8s]\t%(asctime)s: %(message)s '
+THREAD_LOG_FORMAT = '[%(levelname)8s]\t%(asctime)s %(threadName)s: %(message)s '
+
+
+def setup_logging(filename, max_bytes=10*1024*1024, backup_count=5, level=logging.INFO, log_format=LOG_FORMAT, multiprocess=False):
+    """
+    routes all logging through a queue to a rotating file,
+    returns the started QueueListener, see stop_logging \n
+    max_bytes: size at which the file is rotated, 0 = never \n
+    multiprocess: spawned processes log into the same queue, see log_to_queue
+    """
+    file_handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(logging.Formatter(log_format))
+    log_queue = multiprocessing.get_context('spawn').Queue() if multiprocess else queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def root_queue():
+    """the queue of setup_logging, to be passed to a spawned process"""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            return handler.queue
+    return None
+
+
+def log_to_queue(log_queue, level=logging.INFO):
+    """routes the logging of a spawned process into the queue of setup_logging"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+
+def stop_logging(listener):
+    """writes the queued records, later ones (e.g. from destructors at exit) are written directly"""
+    listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in listener.handlers:
+        root.addHandler(handler)
+
+
+class RateLimiter():
+    """lets a repetitive log line through at most once per interval"""
+    def __init__(self, interval=30.0):
+        self.interval = interval
+        self.last = {}
+        self.suppressed = {}
+
+    def ready(self, key=None):
+        now = time.time()
+        if now - self.last.get(key, 0) < self.interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+        self.last[key] = now
+        return True
+
+    def take_suppressed(self, key=None):
+        """number of lines suppressed since the last one let through"""
+        return self.suppressed.pop(key, 0)
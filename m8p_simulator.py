@@ -0,0 +1,560 @@
+#! /usr/bin/env python3
+"""
+Simulated ublox M8P on a Linux pseudo terminal for end-to-end load tests.
+
+The simulator acknowledges CFG-MSG/CFG-RATE/CFG-TMODE3/CFG-RST, answers polls
+of CFG-MSG/CFG-RATE/CFG-TMODE3, runs a survey-in through to TIME fix and then
+emits RTCM epochs at the configured rate.
+
+./m8p_simulator.py --rate 5 --svin_speed 20 --duration 120
+./rtk_streamer.py -p /dev/pts/N -s 60,2.0
+
+With --duration the simulator listens on the UDP port of the streamer and
+prints startup-to-first-correction time and sustained throughput as JSON.
+
+Faults for recovery tests: SIGUSR1 drops the message configuration,
+SIGUSR2 silences the output for 10 s.
+
+With --uart the simulator behaves like a UART port at that baudrate: while
+the pty is set to another speed it only sends garbage and ignores commands,
+CFG-PRT changes the rate after it is acknowledged. Its TX buffer of
+TX_BUFFER_SIZE bytes drains at the baudrate, output that does not fit is
+lost and flagged in MON-TXBUF like a real receiver does.
+
+A reset clears time and ephemerides like a cold start. With ackAiding set in
+CFG-NAVX5 MGA messages are answered with MGA-ACK, ephemerides are only used
+once the time is known, and with 4 or more ephemerides the first fix comes
+after ttff/5. After the first fix the simulator knows 12 ephemerides, a poll
+of MGA-DBD dumps them and they are restored from MGA-DBD entries.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import select
+import signal
+import socket
+import struct
+import termios
+import threading
+import time
+import tty
+
+from geodesy import llh_to_ecef
+from rtcmhelper import *
+from ubxhelper import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCATION = (49.634588306044, 8.63146814719394, 149.929389226877)
+
+# order in which the M8P sends the messages of one RTCM epoch, 1230 comes last
+RTCM_EPOCH_ORDER = [1005, 1074, 1077, 1084, 1087, 1230]
+TX_BUFFER_SIZE = 4096  # bytes of the simulated UART TX buffer
+
+
+def build_ubx(class_id, msg_id, payload):
+    msg = UBXMSG()
+    msg.class_ID = class_id
+    msg.msg_ID = msg_id
+    msg.payload = payload
+    return msg.serialize()
+
+
+class M8PSimulator(threading.Thread):
+    def __init__(self, rate=0, msm4_size=160, msm7_size=380, svin_speed=1.0, ttff=2.0, location=DEFAULT_LOCATION, position_noise=0.3, uart_baudrate=0, unique_id='0123456789'):
+        """
+        rate: output rate in Hz, 0 = follow CFG-RATE \n
+        msm4_size / msm7_size: RTCM payload bytes per MSM message \n
+        svin_speed: simulated survey-in seconds per real second \n
+        ttff: seconds from (re)start until the first 3D fix \n
+        position_noise: standard deviation in m of the NAV-HPPOSLLH positions \n
+        uart_baudrate: emulate a UART port at this rate, 0 = USB 
+
+        unique_id: 5 byte chip id as hex string reported by SEC-UNIQID
+        """
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        os.set_blocking(self.master_fd, False)
+        self.port = os.ttyname(self.slave_fd)
+
+        self.fixed_rate = rate
+        self.rate_ms = 1000
+        self.msm_sizes = {1074: msm4_size, 1084: msm4_size, 1077: msm7_size, 1087: msm7_size, 1005: 19, 1230: 8}
+        self.svin_speed = svin_speed
+        self.ttff = ttff
+        self.lat, self.lon, self.height = location
+        self.ecef = llh_to_ecef(*location)
+        self.position_noise = position_noise
+
+        self.enabled_msgs = {}  # msg id -> output rate in epochs
+        self.epochs = 0
+        self.tmode = 0
+        self.tmode3_payload = bytes(40)
+        self.svin_start = 0
+        self.svin_min_dur = 0
+        self.svin_acc_limit = 0
+        self.svin_valid = 0
+        self.start_time = time.time()
+        self.silent_until = 0
+        self.uart_baudrate = uart_baudrate
+        self.next_baudrate = 0
+        self.unique_id = bytes.fromhex(unique_id)
+        self.mga_ack = False
+        self.time_known = False
+        self.ephemerides = set()
+
+        self.buffer = b''
+        self.keep_running = True
+        self.bytes_sent = 0
+        self.bytes_dropped = 0
+        self.tx_pending = 0.0
+        self.tx_peak = 0
+        self.tx_drained = time.time()
+        self.tx_errors = 0
+        self.rtcm_epochs = 0
+        self.random = random.Random(1)
+        threading.Thread.__init__(self)
+
+    def run(self):
+        logger.info(f"M8PSimulator | Simulating M8P on {self.port}")
+        next_epoch = time.time()
+        while self.keep_running:
+            timeout = max(0.0, next_epoch-time.time())
+            readable, _, _ = select.select([self.master_fd], [], [], timeout)
+            if readable:
+                self.read_commands()
+            now = time.time()
+            if now >= next_epoch:
+                self.send_epoch(now)
+                next_epoch += self.epoch_interval()
+                if next_epoch < now:
+                    next_epoch = now + self.epoch_interval()
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def stop(self):
+        self.keep_running = False
+        self.join()
+
+    def epoch_interval(self):
+        if self.fixed_rate:
+            return 1.0/self.fixed_rate
+        return self.rate_ms/1000
+
+    def drop_config(self, signum=None, frame=None):
+        logger.info("M8PSimulator | Dropping message configuration")
+        self.enabled_msgs = {}
+
+    def silence(self, signum=None, frame=None, seconds=10):
+        logger.info(f"M8PSimulator | Silent for {seconds}s")
+        self.silent_until = time.time() + seconds
+
+    def link_matches(self):
+        """true for USB or if the pty runs at the UART baudrate"""
+        if not self.uart_baudrate:
+            return True
+        speed = termios.tcgetattr(self.slave_fd)[4]
+        return speed == getattr(termios, f'B{self.uart_baudrate}')
+
+    def write(self, data):
+        if time.time() < self.silent_until:
+            return
+        if not self.link_matches():
+            data = os.urandom(len(data))
+        if self.uart_baudrate and not self.tx_buffer_accepts(len(data)):
+            self.bytes_dropped += len(data)
+            return
+        try:
+            self.bytes_sent += os.write(self.master_fd, data)
+        except BlockingIOError:
+            self.bytes_dropped += len(data)
+
+    def tx_buffer_accepts(self, length):
+        now = time.time()
+        self.tx_pending = max(0.0, self.tx_pending - (now-self.tx_drained)*self.uart_baudrate/10)
+        self.tx_drained = now
+        if self.tx_pending + length > TX_BUFFER_SIZE:
+            self.tx_errors |= 1 << 1 | UBX_MON_TXBUF.ERROR_ALLOC  # limit of UART1
+            return False
+        self.tx_pending += length
+        self.tx_peak = max(self.tx_peak, int(self.tx_pending))
+        return True
+
+    def read_commands(self):
+        try:
+            self.buffer += os.read(self.master_fd, 4096)
+        except (BlockingIOError, OSError):
+            return
+        if not self.link_matches():
+            self.buffer = b''
+            return
+        while len(self.buffer) >= UBX_MSG_MIN_LENGTH:
+            if not starts_with_UBX_Header(self.buffer):
+                self.buffer = self.buffer[1:]
+                continue
+            length = starts_with_UBX_Message(self.buffer)
+            if not length:
+                payload_length = struct.unpack('<H', self.buffer[4:6])[0]
+                if len(self.buffer) < payload_length+8:
+                    break  # incomplete
+                self.buffer = self.buffer[1:]
+                continue
+            self.handle_command(UBXMSG(self.buffer[:length]))
+            self.buffer = self.buffer[length:]
+
+    def handle_command(self, msg: UBXMSG):
+        identifier = msg.class_ID + msg.msg_ID
+        if self.handle_poll(msg):
+            pass
+        elif identifier == b'\x06\x01':
+            self.handle_cfg_msg(msg)
+        elif identifier == b'\x06\x08':
+            self.rate_ms = struct.unpack('<H', msg.payload[0:2])[0]
+        elif identifier == b'\x06\x71':
+            self.handle_cfg_tmode3(msg)
+        elif identifier == b'\x06\x04':
+            self.handle_reset()
+        elif identifier == b'\x06\x23' and len(msg.payload) == 40:
+            self.mga_ack = bool(msg.payload[17])
+        elif msg.class_ID == b'\x13':
+            self.handle_mga(msg)
+        elif identifier == b'\x06\x00' and len(msg.payload) == 20 and self.uart_baudrate:
+            self.next_baudrate = UBX_CFG_PRT(msg.buffer).baudrate
+        if msg.class_ID == b'\x06':
+            ack = UBX_ACK_ACK()
+            ack.encode(msg.class_ID, msg.msg_ID)
+            self.write(ack.serialize())
+        if self.next_baudrate:
+            logger.info(f"M8PSimulator | Baudrate {self.uart_baudrate} -> {self.next_baudrate}")
+            self.uart_baudrate = self.next_baudrate
+            self.next_baudrate = 0
+
+    def handle_poll(self, msg: UBXMSG):
+        """answers CFG, SEC-UNIQID, MON buffer and NAV-PVT/NAV-SVIN polls, returns False if msg is no poll"""
+        identifier = msg.class_ID + msg.msg_ID
+        if identifier in (b'\x01\x07', b'\x01\x3B') and not msg.payload:
+            now = time.time()
+            itow = int((now % 604800)*1000)
+            if identifier == b'\x01\x07':
+                self.write(self.encode_nav_pvt(now, itow, self.in_time_mode(now)))
+            else:
+                self.write(self.encode_nav_svin(now, itow))
+            return True
+        if identifier == b'\x06\x01' and len(msg.payload) == 2:
+            rate = self.enabled_msgs.get(msg.payload, 0)
+            response = msg.payload + bytes((0, 0, 0, rate, 0, 0))
+        elif identifier == b'\x06\x08' and not msg.payload:
+            response = struct.pack('<HHH', self.rate_ms, 1, 1)
+        elif identifier == b'\x06\x71' and not msg.payload:
+            response = self.tmode3_payload
+        elif identifier == b'\x06\x00' and len(msg.payload) <= 1:
+            port_id = UBX_CFG_PRT.PORT_UART1 if self.uart_baudrate else UBX_CFG_PRT.PORT_USB
+            response = struct.pack('<BBHIIHHHH', port_id, 0, 0, UBX_CFG_PRT.MODE_8N1, self.uart_baudrate, 0x07, 0x23, 0, 0)
+        elif identifier == b'\x27\x03' and not msg.payload:
+            response = bytes((1, 0, 0, 0)) + self.unique_id
+        elif identifier == b'\x0A\x08' and not msg.payload:
+            response = self.encode_mon_txbuf()
+        elif identifier == b'\x0A\x07' and not msg.payload:
+            response = bytes(24)
+        elif identifier == b'\x0A\x02' and not msg.payload:
+            target = 1 if self.uart_baudrate else 3
+            response = b''.join(UBX_MON_IO.BLOCK.pack(0, self.bytes_sent if i == target else 0, 0, 0, 0, 0, 0, 0, 0) for i in range(6))
+        else:
+            return False
+        self.write(build_ubx(msg.class_ID, msg.msg_ID, response))
+        return True
+
+    def handle_cfg_msg(self, msg: UBXMSG):
+        target = msg.payload[0:2]
+        if len(msg.payload) == 8:
+            rate = msg.payload[2+3]  # USB is port 3
+        elif len(msg.payload) == 3:
+            rate = msg.payload[2]
+        else:
+            return
+        if rate:
+            self.enabled_msgs[target] = rate
+        else:
+            self.enabled_msgs.pop(target, None)
+
+    def handle_cfg_tmode3(self, msg: UBXMSG):
+        self.tmode3_payload = msg.payload
+        self.tmode = msg.payload[2]
+        self.svin_valid = 0
+        if self.tmode == 1:
+            self.svin_start = time.time()
+            self.svin_min_dur = struct.unpack('<I', msg.payload[24:28])[0]
+            self.svin_acc_limit = struct.unpack('<I', msg.payload[28:32])[0]
+            logger.info(f"M8PSimulator | Survey-in started dur:{self.svin_min_dur}s acc:{self.svin_acc_limit/1e4:.3f}m")
+
+    def handle_mga(self, msg: UBXMSG):
+        if not msg.payload:
+            # polls are answered (MGA-DBD) or ignored, never acknowledged
+            if msg.msg_ID == b'\x80':
+                self.handle_mga_dbd(msg)
+            return
+        info_code = 0
+        if msg.msg_ID == b'\x40' and msg.payload[0] == 0x10:
+            self.time_known = True
+        elif msg.msg_ID == b'\x80':
+            self.handle_mga_dbd(msg)
+        elif msg.msg_ID == b'\x00' and msg.payload[0] == 0x01:
+            if self.time_known:
+                self.ephemerides.add(msg.payload[2])
+            else:
+                info_code = 1  # no time
+        if self.mga_ack:
+            used = 0 if info_code else 1
+            payload = bytes((used, 0, info_code, msg.msg_ID[0])) + msg.payload[:4]
+            self.write(build_ubx(b'\x13', b'\x60', payload))
+
+    def handle_mga_dbd(self, msg: UBXMSG):
+        if not msg.payload:
+            for sv in sorted(self.ephemerides):
+                self.write(build_ubx(b'\x13', b'\x80', bytes(12) + bytes((0x01, sv)) + bytes(62)))
+        elif len(msg.payload) > 13 and msg.payload[12] == 0x01:
+            self.ephemerides.add(msg.payload[13])
+
+    def handle_reset(self):
+        logger.info("M8PSimulator | Reset")
+        self.start_time = time.time()
+        self.time_known = False
+        self.ephemerides = set()
+        if self.tmode == 1:
+            self.svin_start = self.start_time
+            self.svin_valid = 0
+
+    def has_fix(self, now):
+        ttff = self.ttff/5 if len(self.ephemerides) >= 4 else self.ttff
+        return now-self.start_time >= ttff
+
+    def svin_state(self, now):
+        """returns (duration, mean accuracy in 0.1mm, observations)"""
+        dur = int((now-self.svin_start)*self.svin_speed)
+        mean_acc = int(200000/math.sqrt(dur+1))
+        if dur >= self.svin_min_dur and mean_acc <= self.svin_acc_limit:
+            self.svin_valid = 1
+        return dur, mean_acc, dur
+
+    def in_time_mode(self, now):
+        if not self.has_fix(now):
+            return False
+        if self.tmode == 2:
+            return True
+        if self.tmode == 1:
+            self.svin_state(now)
+            return bool(self.svin_valid)
+        return False
+
+    def send_epoch(self, now):
+        itow = int((now % 604800)*1000)
+        time_mode = self.in_time_mode(now)
+        self.epochs += 1
+        if self.has_fix(now):
+            self.ephemerides.update(range(1, 13))
+        if b'\x01\x3B' in self.enabled_msgs:
+            self.write(self.encode_nav_svin(now, itow))
+        if b'\x01\x03' in self.enabled_msgs:
+            self.write(self.encode_nav_status(now, itow, time_mode))
+        if b'\x01\x07' in self.enabled_msgs:
+            self.write(self.encode_nav_pvt(now, itow, time_mode))
+        if b'\x01\x14' in self.enabled_msgs:
+            self.write(self.encode_nav_hpposllh(now, itow))
+        rate = self.enabled_msgs.get(b'\x01\x35')
+        if rate and self.epochs % rate == 0:
+            self.write(self.encode_nav_sat(now, itow))
+        if time_mode:
+            self.send_rtcm_epoch()
+
+    def send_rtcm_epoch(self):
+        sent = False
+        for msg_type in RTCM_EPOCH_ORDER:
+            ubx_id = get_id_by_msg(f"RTCM3.3-{msg_type}")
+            rate = self.enabled_msgs.get(ubx_id)
+            if rate and self.epochs % rate == 0:
+                payload = bytes(self.random.getrandbits(8) for _ in range(self.msm_sizes[msg_type]))
+                self.write(build_rtcm_msg(msg_type, payload))
+                sent = True
+        if sent:
+            self.rtcm_epochs += 1
+
+    def encode_mon_txbuf(self):
+        """usage of the UART1 TX buffer, the error flags are cleared by the poll"""
+        self.tx_buffer_accepts(0)
+        pending = [0]*6
+        usage = [0]*6
+        peak = [0]*6
+        if self.uart_baudrate:
+            pending[1] = int(self.tx_pending)
+            usage[1] = pending[1]*100//TX_BUFFER_SIZE
+            peak[1] = self.tx_peak*100//TX_BUFFER_SIZE
+        errors, self.tx_errors = self.tx_errors, 0
+        return struct.pack('<6H6B6BBBBB', *pending, *usage, *peak, max(usage), max(peak), errors, 0)
+
+    def encode_nav_svin(self, now, itow):
+        payload = bytearray(40)
+        payload[4:8] = struct.pack('<I', itow)
+        if self.tmode == 1:
+            dur, mean_acc, obs = self.svin_state(now)
+            x, y, z = self.ecef
+            payload[8:12] = struct.pack('<I', dur)
+            payload[12:24] = struct.pack('<iii', int(x*100), int(y*100), int(z*100))
+            payload[28:36] = struct.pack('<II', mean_acc, obs)
+            payload[36] = self.svin_valid
+            payload[37] = 0 if self.svin_valid else 1
+        return build_ubx(b'\x01', b'\x3B', bytes(payload))
+
+    def encode_nav_status(self, now, itow, time_mode):
+        payload = bytearray(16)
+        payload[0:4] = struct.pack('<I', itow)
+        if time_mode:
+            payload[4] = UBX_TIME_FIX
+        elif self.has_fix(now):
+            payload[4] = UBX_3D_FIX
+        payload[5] = 0x01 if self.has_fix(now) else 0x00
+        payload[8:12] = struct.pack('<I', int(self.ttff*1000))
+        payload[12:16] = struct.pack('<I', int((now-self.start_time)*1000) & 0xffffffff)
+        return build_ubx(b'\x01', b'\x03', bytes(payload))
+
+    def encode_nav_sat(self, now, itow):
+        """8 GPS and 6 GLONASS satellites whose elevation and C/N0 change slowly"""
+        fix = self.has_fix(now)
+        blocks = b''
+        for i, (gnss_id, sv_id) in enumerate([(0, sv) for sv in (2, 5, 7, 12, 15, 20, 25, 29)] + [(6, sv) for sv in (1, 3, 8, 14, 17, 22)]):
+            elev = int(45 + 40*math.sin(now/600 + i))
+            cno = max(0, min(50, int(20 + elev/3 + self.random.gauss(0, 2))))
+            used = fix and elev > 10 and cno >= 30
+            flags = 0x04 | (UBX_NAV_SAT.FLAG_USED if used else 0)
+            blocks += struct.pack('<BBBbhhI', gnss_id, sv_id, cno, elev, (i*47) % 360, 0, flags)
+        return build_ubx(b'\x01', b'\x35', struct.pack('<IBB2x', itow, 1, len(blocks)//12) + blocks)
+
+    def encode_nav_pvt(self, now, itow, time_mode):
+        t = time.gmtime(now)
+        payload = bytearray(92)
+        payload[0:6] = struct.pack('<IH', itow, t.tm_year)
+        payload[6:11] = bytes((t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec))
+        fix = self.has_fix(now)
+        payload[11] = 0x07 if fix else 0x00
+        payload[12:20] = struct.pack('<Ii', 50, int((now % 1)*1e9))
+        if time_mode:
+            payload[20] = UBX_TIME_FIX
+        elif fix:
+            payload[20] = UBX_3D_FIX
+        payload[21] = 0x01 if fix else 0x00
+        payload[23] = 12 if fix else 0
+        payload[24:48] = struct.pack('<iiiiII', int(self.lon*1e7), int(self.lat*1e7), int(self.height*1e3), int(self.height*1e3), 1500, 2500)
+        payload[76:80] = struct.pack('<HH', 120, 0 if fix else 1)
+        return build_ubx(b'\x01', b'\x07', bytes(payload))
+
+    def encode_nav_hpposllh(self, now, itow):
+        payload = bytearray(36)
+        payload[3] = 0 if self.has_fix(now) else 1
+        payload[4:8] = struct.pack('<I', itow)
+        noise = [self.random.gauss(0, self.position_noise) for _ in range(3)]
+        lat = self.lat + noise[0]/111320
+        lon = self.lon + noise[1]/(111320*math.cos(math.radians(self.lat)))
+        lon_e9 = int(round(lon*1e9))
+        lat_e9 = int(round(lat*1e9))
+        height_e4 = int(round((self.height+noise[2])*1e4))
+        lon_e7, lat_e7, height_e3 = lon_e9//100, lat_e9//100, height_e4//10
+        payload[8:36] = struct.pack('<iiiibbbbII', lon_e7, lat_e7, height_e3, height_e3, lon_e9-lon_e7*100, lat_e9-lat_e7*100, height_e4-height_e3*10, height_e4-height_e3*10, 150, 250)
+        return build_ubx(b'\x01', b'\x14', bytes(payload))
+
+
+class CorrectionMonitor(threading.Thread):
+    """listens for the UDP broadcasts of the streamer and measures timing and throughput"""
+    def __init__(self, udp_port=10777):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.sock.bind(('', udp_port))
+        self.sock.settimeout(0.2)
+        self.start_time = time.time()
+        self.first_correction = 0
+        self.last_correction = 0
+        self.datagrams = 0
+        self.bytes_received = 0
+        self.keep_running = True
+        threading.Thread.__init__(self)
+
+    def run(self):
+        while self.keep_running:
+            try:
+                data, _ = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            now = time.time()
+            if not self.first_correction:
+                self.first_correction = now
+            self.last_correction = now
+            self.datagrams += 1
+            self.bytes_received += len(data)
+        self.sock.close()
+
+    def stop(self):
+        self.keep_running = False
+        self.join()
+
+    def report(self):
+        result = {
+            "startup_to_first_correction_s": None,
+            "datagrams": self.datagrams,
+            "bytes": self.bytes_received,
+            "datagrams_per_s": 0.0,
+            "bytes_per_s": 0.0,
+        }
+        if self.first_correction:
+            result["startup_to_first_correction_s"] = self.first_correction-self.start_time
+            streaming_time = self.last_correction-self.first_correction
+            if streaming_time > 0:
+                # the first datagram opens the window, it is not part of the rate
+                result["datagrams_per_s"] = (self.datagrams-1)/streaming_time
+                result["bytes_per_s"] = self.bytes_received/streaming_time
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simulate a ublox M8P on a pseudo terminal")
+    parser.add_argument("-r", "--rate", help="RTCM epoch rate in Hz, default follows CFG-RATE", type=float, default=0)
+    parser.add_argument("--msm4_size", help="payload bytes of MSM4 messages", type=int, default=160)
+    parser.add_argument("--msm7_size", help="payload bytes of MSM7 messages", type=int, default=380)
+    parser.add_argument("--svin_speed", help="simulated survey-in seconds per real second", type=float, default=1.0)
+    parser.add_argument("--ttff", help="seconds until first fix after start or reset", type=float, default=2.0)
+    parser.add_argument("-d", "--duration", help="run for N seconds and report the received corrections as JSON", type=float)
+    parser.add_argument("--uart", help="emulate a UART port at this baudrate instead of USB", type=int, default=0)
+    parser.add_argument("-u", "--udp_port", help="UDP port of the streamer", type=int, default=10777)
+    parser.add_argument("--unique_id", help="chip id reported by SEC-UNIQID, 10 hex digits", default="0123456789")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(levelname)8s]\t%(asctime)s: %(message)s ', level=logging.INFO)
+    sim = M8PSimulator(args.rate, args.msm4_size, args.msm7_size, args.svin_speed, args.ttff, uart_baudrate=args.uart, unique_id=args.unique_id)
+    print(sim.port, flush=True)
+    signal.signal(signal.SIGUSR1, sim.drop_config)
+    signal.signal(signal.SIGUSR2, sim.silence)
+
+    monitor = None
+    if args.duration:
+        monitor = CorrectionMonitor(args.udp_port)
+        monitor.start()
+    sim.start()
+    try:
+        if args.duration:
+            time.sleep(args.duration)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+    if monitor:
+        monitor.stop()
+        result = monitor.report()
+        result.update({"rate": args.rate, "rtcm_epochs": sim.rtcm_epochs, "bytes_sent": sim.bytes_sent, "bytes_dropped": sim.bytes_dropped})
+        print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#! /usr/bin/env python3
+"""
+Runtime counters in Prometheus text format and a signal triggered profiler.
+
+Counters are bumped from several threads (reader, controller, multiplexer,
+tap), a read-modify-write of the dict is not atomic, so updates take a lock
+that is hardly ever contended. Gauges are callbacks evaluated only when the metrics are
+scraped. The same server answers /status with a JSON snapshot of the
+registered status callbacks, e.g. the state of each RTKStreamer.
+"""
+import cProfile
+import http.server
+import json
+import os
+import socketserver
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Metrics():
+    def __init__(self):
+        self.counters = {}
+        self.counter_lock = threading.Lock()
+        self.gauges = {}
+        self.descriptions = {}
+        self.status_callbacks = {}
+
+    def describe(self, name, description, metric_type='counter'):
+        self.descriptions[name] = (description, metric_type)
+
+    def inc(self, name, value=1, labels=()):
+        """labels: tuple of (key, value) pairs"""
+        key = (name, labels)
+        with self.counter_lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get(self, name, labels=()):
+        return self.counters.get((name, labels), 0)
+
+    def counter_values(self):
+        """copy of all counters"""
+        with self.counter_lock:
+            return dict(self.counters)
+
+    def set_counters(self, counters, clear=False):
+        """takes over counters kept elsewhere, e.g. by the reader process"""
+        with self.counter_lock:
+            if clear:
+                self.counters.clear()
+            self.counters.update(counters)
+
+    def register_gauge(self, name, callback, labels=()):
+        self.gauges[(name, labels)] = callback
+
+    def register_status(self, name, callback):
+        """callback() returns a JSON serialisable snapshot, shown under name in /status"""
+        self.status_callbacks[name] = callback
+
+    def status(self):
+        status = {'time': time.time()}
+        for name, callback in self.status_callbacks.copy().items():
+            try:
+                status[name] = callback()
+            except Exception as e:
+                logger.debug(f"Metrics | status {name} failed: {e}")
+        return status
+
+    def unregister_gauges(self, labels):
+        for key in list(self.gauges):
+            if key[1] == labels:
+                del self.gauges[key]
+
+    def render(self):
+        """returns all metrics in Prometheus text exposition format"""
+        samples = {}
+        for (name, labels), value in self.counter_values().items():
+            samples.setdefault(name, []).append((labels, value))
+        for (name, labels), callback in self.gauges.copy().items():
+            try:
+                value = callback()
+            except Exception as e:
+                logger.debug(f"Metrics | gauge {name} failed: {e}")
+                continue
+            samples.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(samples):
+            if name in self.descriptions:
+                description, metric_type = self.descriptions[name]
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in sorted(samples[name]):
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    content = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels)
+    return "{" + content + "}"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = Metrics()
+METRICS.describe("gpsparser_bytes_read_total", "bytes read from the GPS device")
+METRICS.describe("gpsparser_frames_total", "frames extracted per protocol and type")
+METRICS.describe("gpsparser_checksum_failures_total", "complete frames dropped because of a wrong checksum or CRC")
+METRICS.describe("gpsparser_resync_bytes_total", "bytes skipped while searching for the next frame")
+METRICS.describe("gpsparser_read_errors_total", "read errors on the serial stream")
+METRICS.describe("gpsparser_write_errors_total", "write errors on the serial stream")
+METRICS.describe("gpsparser_disconnects_total", "connections to the GPS device lost")
+METRICS.describe("gpsparser_udp_sends_total", "successful UDP datagrams")
+METRICS.describe("gpsparser_udp_send_errors_total", "failed UDP send attempts")
+METRICS.describe("gpsparser_udp_bytes_total", "bytes published via UDP")
+METRICS.describe("gpsparser_queue_depth", "entries or bytes waiting in the internal buffers", 'gauge')
+METRICS.describe("gpsparser_link_bytes_per_second", "bytes per second received from the GPS device", 'gauge')
+METRICS.describe("gpsparser_link_utilisation", "received bytes per second against the capacity of a UART link, 0 for USB", 'gauge')
+METRICS.describe("rtkstreamer_epoch_delay_seconds", "receive time of the last NAV-PVT minus its GNSS time", 'gauge')
+METRICS.describe("rtkstreamer_latency_seconds", "latency subtracted from the receive time for the time difference output", 'gauge')
+METRICS.describe("rtkstreamer_status_changes_total", "status transitions of the RTK Streamer")
+METRICS.describe("rtkstreamer_resets_total", "resets sent to the GPS device")
+METRICS.describe("rtkstreamer_ubx_messages_total", "UBX messages processed by the controller")
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    metrics = METRICS
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/status':
+            body = json.dumps(self.metrics.status(), indent=1).encode()
+            content_type = "application/json"
+        elif path in ('/', '/metrics'):
+            body = self.metrics.render().encode()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # client_address is a path for unix sockets
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug(f"MetricsServer | {self.address_string()} {format % args}")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+class MetricsServer(threading.Thread):
+    """
+    serves the metrics over HTTP
+    address: "host:port" for TCP or a path starting with / for a unix socket
+    """
+    def __init__(self, address="127.0.0.1:9108", handler=MetricsRequestHandler):
+        self.address = address
+        if address.startswith('/'):
+            self.server = ThreadingUnixHTTPServer(address, handler)
+        else:
+            host, port = address.rsplit(':', 1)
+            self.server = http.server.ThreadingHTTPServer((host, int(port)), handler)
+        threading.Thread.__init__(self, daemon=True)
+
+    def run(self):
+        logger.info(f"MetricsServer | Serving metrics on {self.address}")
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.address.startswith('/'):
+            try:
+                os.unlink(self.address)
+            except FileNotFoundError:
+                pass
+        logger.info("MetricsServer | Stopped")
+
+
+class ThreadProfiler():
+    """
+    cProfile capture toggled from a signal handler.
+    cProfile only sees the thread that enables it, so the profiled thread has
+    to call poll() regularly, e.g. once per reader loop.
+    """
+    def __init__(self, name='reader', output_dir='.'):
+        self.name = name
+        self.output_dir = output_dir
+        self.requested = False
+        self.profile = None
+
+    def toggle(self, signum=None, frame=None):
+        self.requested = not self.requested
+
+    def poll(self):
+        if self.requested and not self.profile:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            logger.info(f"ThreadProfiler | Started profiling {self.name} thread")
+        elif self.profile and not self.requested:
+            self.profile.disable()
+            filename = os.path.join(self.output_dir, f"{self.name}_{time.strftime('%Y%m%d_%H%M%S')}.prof")
+            self.profile.dump_stats(filename)
+            self.profile = None
+            logger.info(f"ThreadProfiler | Profile of {self.name} thread written to {filename}")
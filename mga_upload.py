@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+"""
+Upload of assistance data (MGA messages) into the receiver.
+
+With ackAiding enabled in CFG-NAVX5 the receiver answers every MGA message
+with an MGA-ACK that tells whether the message was used. The upload keeps up
+to `window` messages in flight like a ConfigTransaction, so the receiver's
+input buffer does not overflow. MGA-ACK carries the message ID and the first
+4 payload bytes, which is enough to identify the message, e.g. the satellite
+of an ephemeris.
+
+Time (and position if known) are injected first with MGA-INI, most
+assistance data is rejected until the receiver knows the time.
+"""
+from metrics import METRICS
+from ubxconfig import ConfigTransaction
+from ubxhelper import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+METRICS.describe("mga_messages_total", "assistance messages sent to the receiver by result")
+
+# answers after which sending the message again may succeed
+RETRY_INFO_CODES = (1, 5)  # no time, not ready
+
+
+class MGAUpload(ConfigTransaction):
+    metric = 'mga_messages_total'
+    success = 'used'
+    outcome = 'used by the receiver'
+
+    def __init__(self, gpsp, window=8, timeout=1.0, retries=2):
+        super().__init__(gpsp, window, timeout, retries)
+
+    def add_data(self, data):
+        """adds all MGA messages of a byte string as delivered by the AssistNow service"""
+        while data:
+            length = starts_with_UBX_Message(data)
+            if not length:
+                data = data[1:]
+                continue
+            msg = UBXMSG(data[:length])
+            if msg.class_ID == b'\x13':
+                self.add(msg)
+            data = data[length:]
+        return self
+
+    def on_ubx_msg(self, msg: UBXMSG):
+        """listener called by the GPSParser reader thread"""
+        if msg.class_ID + msg.msg_ID != b'\x13\x60':
+            return
+        with self.condition:
+            self.acks.append(msg.specify())
+            self.condition.notify()
+
+    def handle(self, ack, in_flight):
+        frame = self.match(ack, in_flight)
+        if not frame:
+            return
+        in_flight.remove(frame)
+        if ack.type == UBX_MGA_ACK.TYPE_USED:
+            frame.result = 'used'
+        elif ack.infoCode in RETRY_INFO_CODES and frame.attempts <= self.retries:
+            self.queue.append(frame)
+        else:
+            frame.result = 'rejected'
+            frame.reason = ack.reason()
+
+    def match(self, ack, in_flight):
+        for frame in in_flight:
+            if ack.refers_to_data_msg(frame.msg):
+                return frame
+        return None
+
+    def used(self):
+        return len([frame for frame in self.frames if frame.result == 'used'])
+
+
+def enable_mga_ack(gpsp):
+    """receiver answers MGA messages with MGA-ACK, returns True if confirmed"""
+    msg = UBX_CFG_NAVX5()
+    msg.enable_mga_ack()
+    return ConfigTransaction(gpsp).add(msg).commit()
+
+
+def inject_assistance(gpsp, data, location=None, latency=0.0):
+    """
+    uploads time, position and the MGA messages in data,
+    location (lat, lon, height, acc) is used if valid. Returns (used, sent)
+    """
+    if not enable_mga_ack(gpsp):
+        logger.warning("MGAUpload | Receiver did not confirm MGA acknowledgements")
+        return (0, 0)
+
+    init = MGAUpload(gpsp, window=1, retries=5)
+    time_msg = UBX_MGA_INI_TIME_UTC()
+    time_msg.encode(latency)
+    init.add(time_msg)
+    if location and all(location):
+        position_msg = UBX_MGA_INI_POS_LLH()
+        position_msg.encode(*location)
+        init.add(position_msg)
+    init.commit()
+
+    upload = MGAUpload(gpsp).add_data(data)
+    upload.commit()
+    used = init.used() + upload.used()
+    sent = len(init.frames) + len(upload.frames)
+    logger.info(f"MGAUpload | Receiver used {used} of {sent} assistance messages")
+    return (used, sent)
@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+"""
+One I/O thread for several receivers.
+
+Instead of one reader thread per GPSParser, a DeviceMultiplexer waits with a
+selector on the serial ports of all parsers, the hotplug events and a wakeup
+pipe. A readable port is serviced by its parser (GPSParser.service), data
+queued with send_to_gps wakes the selector so it is written at once.
+
+Disconnected parsers are opened again on hotplug events or every
+HOTPLUG_RESCAN seconds. A port that is open for one parser is not offered to
+the others, so several M8Ps found by USB scan end up on different parsers.
+"""
+import os
+import selectors
+import threading
+import time
+
+from gpsparser import HOTPLUG_RESCAN
+from hotplug import HotplugWatcher
+from metrics import ThreadProfiler
+
+import logging
+logger = logging.getLogger(__name__)
+
+WAKEUP = 'wakeup'
+HOTPLUG = 'hotplug'
+
+
+class DeviceMultiplexer(threading.Thread):
+    def __init__(self, parsers=()):
+        self.parsers = []
+        self.keep_running = True
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, WAKEUP)
+        self.hotplug = HotplugWatcher()
+        if self.hotplug.available:
+            self.selector.register(self.hotplug.fd, selectors.EVENT_READ, HOTPLUG)
+        self.registered = {}  # GPSParser -> fd
+        self.next_scan = 0
+        self.profiler = ThreadProfiler('reader')
+        for gpsp in parsers:
+            self.add(gpsp)
+        threading.Thread.__init__(self, name='multiplexer')
+
+    def add(self, gpsp):
+        gpsp.mux = self
+        self.parsers.append(gpsp)
+
+    def claimed_ports(self, gpsp):
+        """real paths of the ports other parsers have open"""
+        return {os.path.realpath(p.port) for p in self.parsers if p is not gpsp and p.port and p.stream.isOpen()}
+
+    def wake(self):
+        try:
+            os.write(self.wakeup_w, b'\0')
+        except BlockingIOError:
+            pass  # a wakeup is pending anyway
+
+    def run(self):
+        logger.info(f"DeviceMultiplexer | Servicing {len(self.parsers)} receivers")
+        while self.keep_running:
+            self.profiler.poll()
+            self.connect_parsers()
+            for key, _ in self.selector.select(HOTPLUG_RESCAN):
+                if key.data == WAKEUP:
+                    self.drain_wakeups()
+                elif key.data == HOTPLUG:
+                    self.hotplug.poll()
+                    self.check_removed()
+                    self.next_scan = 0
+                elif key.data.stream.isOpen():
+                    key.data.service()
+            for gpsp in self.parsers:
+                gpsp.check_reconnect()
+                if gpsp.stream.isOpen() and gpsp.rx_buffer:
+                    gpsp.send_rx_buffer_to_stream()
+                if not gpsp.stream.isOpen():
+                    self.unregister(gpsp)
+        self.close()
+
+    def drain_wakeups(self):
+        try:
+            while os.read(self.wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def check_removed(self):
+        for gpsp in self.parsers:
+            if gpsp.stream.isOpen() and gpsp.port and not os.path.exists(gpsp.port):
+                gpsp.close_stream('device removed')
+                self.unregister(gpsp)
+
+    def connect_parsers(self):
+        """tries to open the ports of disconnected parsers after hotplug events or every HOTPLUG_RESCAN seconds"""
+        now = time.time()
+        if now < self.next_scan:
+            return
+        disconnected = [gpsp for gpsp in self.parsers if not gpsp.stream.isOpen()]
+        for gpsp in disconnected:
+            for directory in gpsp.watched_directories():
+                self.hotplug.watch(directory)
+            if gpsp.try_open():
+                self.register(gpsp)
+        if any(not gpsp.stream.isOpen() for gpsp in self.parsers):
+            self.next_scan = now + HOTPLUG_RESCAN
+        else:
+            self.next_scan = float('inf')  # until a parser disconnects
+
+    def register(self, gpsp):
+        fd = gpsp.stream.fileno()
+        self.selector.register(fd, selectors.EVENT_READ, gpsp)
+        self.registered[gpsp] = fd
+
+    def unregister(self, gpsp):
+        if gpsp not in self.registered:
+            return
+        # the fd may already be closed, the selector only forgets it
+        try:
+            self.selector.unregister(self.registered.pop(gpsp))
+        except (KeyError, ValueError):
+            pass
+        gpsp.ready = False
+        self.next_scan = 0
+        logger.info(f"DeviceMultiplexer | No Connection to GPS device {gpsp.receiver_name or gpsp.port}")
+
+    def stop(self):
+        logger.info('DeviceMultiplexer | stop function started')
+        self.keep_running = False
+        self.wake()
+        self.join()
+        logger.info('DeviceMultiplexer | stop function ended')
+
+    def close(self):
+        for gpsp in self.parsers:
+            self.unregister(gpsp)
+            gpsp.stream.close()
+        self.selector.close()
+        self.hotplug.close()
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
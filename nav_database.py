@@ -0,0 +1,134 @@
+#! /usr/bin/env python
+"""
+Dump and restore of the receiver's navigation database (MGA-DBD).
+
+The database holds ephemerides, almanac, ionosphere and position of the last
+fix. A poll of MGA-DBD is answered with a series of MGA-DBD messages without
+end marker, the dump is complete when no entry arrived for `quiet` seconds.
+The entries are collected by a listener in the reader thread, so the
+controller is not blocked while the receiver sends them.
+
+File format: MAGIC, dump time and number of entries ('<dI'), followed by the
+zlib compressed UBX frames exactly as sent by the receiver. Restoring means
+sending these frames back, see mga_upload.
+"""
+import struct
+import threading
+import time
+import zlib
+
+from metrics import METRICS
+from time_output import write_file_atomic
+from ubxhelper import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MGADBD1\n'
+HEADER = struct.Struct('<dI')
+
+METRICS.describe("nav_database_dumps_total", "navigation database dumps by result")
+
+
+class NavDatabase():
+    def __init__(self, filename, interval=1800, first_delay=300, quiet=1.0, timeout=30.0, max_age=14*86400):
+        """
+        filename: file the database is stored in \n
+        interval: seconds between dumps \n
+        first_delay: seconds of running receiver before the first dump \n
+        quiet: seconds without entry after which a dump is complete \n
+        timeout: maximum seconds of a dump \n
+        max_age: stored databases older than this are not restored
+        """
+        self.filename = filename
+        self.interval = interval
+        self.first_delay = first_delay
+        self.quiet = quiet
+        self.timeout = timeout
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = []
+        self.collecting = False
+        self.dump_start = 0
+        self.last_entry = 0
+        self.next_dump = 0
+
+    def poll(self, gpsp, receiver_ready):
+        """
+        called regularly by the controller, starts a dump when one is due and
+        stores it once complete. receiver_ready: the receiver has a fix
+        """
+        now = time.time()
+        if self.collecting:
+            if now-max(self.last_entry, self.dump_start) >= self.quiet or now-self.dump_start >= self.timeout:
+                self.finish_dump(gpsp)
+            return
+        if not receiver_ready:
+            # after a (re)start the database is still being filled
+            self.next_dump = 0
+            return
+        if not self.next_dump:
+            self.next_dump = now + self.first_delay
+        if now >= self.next_dump:
+            self.start_dump(gpsp)
+
+    def start_dump(self, gpsp):
+        with self.lock:
+            self.entries = []
+        self.collecting = True
+        self.dump_start = time.time()
+        self.last_entry = 0
+        gpsp.add_ubx_listener(self.on_ubx_msg)
+        gpsp.request_mga_db()
+
+    def on_ubx_msg(self, msg: UBXMSG):
+        """listener called by the GPSParser reader thread"""
+        if msg.class_ID + msg.msg_ID != b'\x13\x80' or not msg.payload:
+            return
+        with self.lock:
+            self.entries.append(msg.buffer)
+        self.last_entry = time.time()
+
+    def finish_dump(self, gpsp):
+        gpsp.remove_ubx_listener(self.on_ubx_msg)
+        self.collecting = False
+        self.next_dump = time.time() + self.interval
+        with self.lock:
+            entries = self.entries
+            self.entries = []
+        if not entries:
+            # keep the last good database
+            METRICS.inc('nav_database_dumps_total', 1, gpsp.metric_labels + (('result', 'empty'),))
+            logger.warning("NavDatabase | Receiver sent no database entries")
+            return
+        self.store(entries)
+        METRICS.inc('nav_database_dumps_total', 1, gpsp.metric_labels + (('result', 'ok'),))
+
+    def store(self, entries):
+        raw = b''.join(entries)
+        content = MAGIC + HEADER.pack(time.time(), len(entries)) + zlib.compress(raw, 9)
+        write_file_atomic(self.filename, content)
+        logger.info(f"NavDatabase | Stored {len(entries)} entries, {len(raw)} bytes as {len(content)} bytes in {self.filename}")
+
+    def load(self):
+        """UBX frames of the stored database, b'' if there is none or it is too old"""
+        try:
+            with open(self.filename, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return b''
+        if not content.startswith(MAGIC) or len(content) < len(MAGIC)+HEADER.size:
+            logger.warning(f"NavDatabase | {self.filename} is no navigation database")
+            return b''
+        dump_time, n_entries = HEADER.unpack_from(content, len(MAGIC))
+        age = time.time()-dump_time
+        if age > self.max_age:
+            logger.info(f"NavDatabase | Stored database is {age/86400:.1f} days old, not restoring")
+            return b''
+        try:
+            raw = zlib.decompress(content[len(MAGIC)+HEADER.size:])
+        except zlib.error as e:
+            logger.warning(f"NavDatabase | {self.filename} is corrupted: {e}")
+            return b''
+        logger.info(f"NavDatabase | Restoring {n_entries} entries dumped {age/60:.0f} minutes ago")
+        return raw
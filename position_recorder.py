@@ -0,0 +1,175 @@
+#! /usr/bin/env python3
+"""
+Buffered position sink for the output_positions mode.
+
+Records are collected in memory and written with one syscall per flush.
+If a write fails (disk full, storage unmounted) the data is kept, up to
+max_pending bytes with the oldest records dropped first, and written by the
+next flush. Files are rotated by size and/or age. Besides CSV a fixed width binary format
+is supported, it has no header so files can be appended to and opened with
+
+numpy.memmap(filename, dtype=BINARY_DTYPE, mode='r')
+"""
+import os
+import struct
+import time
+
+from log_setup import RateLimiter
+
+import logging
+logger = logging.getLogger(__name__)
+
+# time_received, lat, lon, height, hMSL, hAcc, vAcc, itow, invalid
+BINARY_RECORD = struct.Struct('<dddddffII')
+BINARY_DTYPE = [('time', '<f8'), ('lat', '<f8'), ('lon', '<f8'), ('height', '<f8'), ('hMSL', '<f8'),
+                ('hAcc', '<f4'), ('vAcc', '<f4'), ('itow', '<u4'), ('invalid', '<u4')]
+
+
+class PositionRecorder():
+    def __init__(self, filename, fmt='csv', flush_interval=1.0, buffer_records=100, fsync_interval=60.0, max_bytes=0, rotate_interval=0, max_pending=8*1024*1024):
+        """
+        fmt: csv or bin \n
+        flush_interval: max seconds a record stays in memory \n
+        buffer_records: flush when this many records are buffered \n
+        fsync_interval: seconds between fsync calls, 0 = leave it to the OS \n
+        max_bytes: rotate when file exceeds this size, 0 = never \n
+        rotate_interval: rotate after this many seconds, 0 = never \n
+        max_pending: bytes kept for the retry while writing fails
+        """
+        if fmt not in ('csv', 'bin'):
+            raise ValueError(f"unknown position format {fmt}")
+        self.filename = filename
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.buffer_records = buffer_records
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.records = []
+        self.pending = b''  # data of failed writes, written first by the next flush
+        self.max_pending = max_pending
+        self.dropped = 0  # bytes dropped because max_pending was exceeded
+        self.errors = RateLimiter(60)
+        self.file = None
+        self.file_size = 0
+        self.opened = 0
+        self.last_flush = time.time()
+        self.last_fsync = time.time()
+
+    def open(self):
+        self.file = open(self.filename, 'ab', buffering=0)
+        self.file_size = self.file.seek(0, os.SEEK_END)
+        if self.fmt == 'bin' and self.file_size % BINARY_RECORD.size:
+            # cut a partial record of an interrupted write, keeps the file mappable
+            self.file_size -= self.file_size % BINARY_RECORD.size
+            self.file.truncate(self.file_size)
+        self.opened = time.time()
+
+    def write(self, msg):
+        """msg: UBX_NAV_HPPOSLLH"""
+        if self.fmt == 'bin':
+            record = BINARY_RECORD.pack(msg.time_received, msg.lat, msg.lon, msg.height, msg.hMSL, msg.hAcc, msg.vAcc, msg.itow, msg.invalid)
+        else:
+            record = f"{msg.time_received}, {msg.lat:0.9f}, {msg.lon:.9f}, {msg.height:0.4f}\n".encode()
+        self.records.append(record)
+        if len(self.records) >= self.buffer_records:
+            self.flush()
+        else:
+            self.poll()
+
+    def poll(self):
+        """flush if the oldest buffered record is due, call regularly"""
+        if (self.records or self.pending) and time.time()-self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        now = time.time()
+        self.last_flush = now
+        if not self.records and not self.pending:
+            return
+        data = self.pending + b''.join(self.records)
+        self.records = []
+        try:
+            if not self.file:
+                self.open()
+            written = self.file.write(data)
+        except OSError as e:
+            self.keep_pending(data, e)
+            return
+        self.file_size += written
+        if written < len(data):
+            if self.fmt == 'bin':
+                written -= written % BINARY_RECORD.size  # open() cuts the partial record
+            self.keep_pending(data[written:], "partial write")
+            return
+        if self.pending:
+            logger.info(f"PositionRecorder | Wrote {len(self.pending)} pending bytes to {self.filename}, {self.dropped} bytes were dropped")
+            self.pending = b''
+            self.dropped = 0
+        try:
+            if self.fsync_interval and now-self.last_fsync >= self.fsync_interval:
+                os.fsync(self.file.fileno())
+                self.last_fsync = now
+            if self.rotation_due(now):
+                self.rotate()
+        except OSError as e:
+            logger.error(f"PositionRecorder | Syncing or rotating {self.filename} failed: {e}")
+
+    def keep_pending(self, data, error):
+        """keeps the unwritten data for the next flush, the oldest records beyond max_pending are dropped"""
+        excess = len(data) - self.max_pending
+        if excess > 0:
+            if self.fmt == 'bin':
+                excess += -excess % BINARY_RECORD.size
+            else:
+                excess = data.find(b'\n', excess-1) + 1 or len(data)
+            data = data[excess:]
+            self.dropped += excess
+        self.pending = data
+        # the handle may be stale (storage unmounted), open again on the next flush
+        if self.file:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+        if self.errors.ready():
+            logger.error(f"PositionRecorder | Writing to {self.filename} failed: {error}, keeping {len(self.pending)} bytes for the retry, {self.dropped} dropped")
+
+    def rotation_due(self, now):
+        if self.max_bytes and self.file_size >= self.max_bytes:
+            return True
+        if self.rotate_interval and now-self.opened >= self.rotate_interval:
+            return True
+        return False
+
+    def rotate(self):
+        self.close_file()
+        base, ext = os.path.splitext(self.filename)
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        rotated = f"{base}_{stamp}{ext}"
+        index = 1
+        while os.path.exists(rotated):
+            rotated = f"{base}_{stamp}_{index}{ext}"
+            index += 1
+        os.rename(self.filename, rotated)
+        logger.info(f"PositionRecorder | Rotated {self.filename} to {rotated}")
+
+    def close_file(self):
+        if self.file:
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+            self.last_fsync = time.time()
+
+    def close(self):
+        self.flush()
+        if self.pending:
+            logger.error(f"PositionRecorder | {len(self.pending)} bytes could not be written to {self.filename}")
+        self.close_file()
+
+
+def load_binary(filename):
+    """memory map a binary position file, requires numpy"""
+    import numpy as np
+    return np.memmap(filename, dtype=np.dtype(BINARY_DTYPE), mode='r')
@@ -0,0 +1,258 @@
+#! /usr/bin/env python
+"""
+Serial reading and framing in a separate process.
+
+The ReaderProcess runs an ordinary GPSParser: it reads and frames the
+stream, follows hotplug events and publishes RTCM via UDP itself, so
+forwarding does not wait for the GIL of the controller process. Every
+validated frame is also put into a FrameRing in shared memory.
+
+In the controller process a RingParser stands in for the GPSParser. It takes
+the UBX frames from the ring and hands them to listeners and the message
+buffer as usual. It sleeps until the reader process rings a doorbell, one
+byte on a pipe after every read that put frames into the ring. Commands go to the reader process over a pipe as tagged
+bytes, the reader process reports its connection state and counters about
+once per second or whenever the connection changes.
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import struct
+import time
+
+from frame_ring import FrameRing
+from gpsparser import GPSParser
+from log_setup import log_to_queue, root_queue
+from metrics import METRICS
+from ubxhelper import starts_with_UBX_Header
+
+import logging
+logger = logging.getLogger(__name__)
+
+METRICS.describe("frame_ring_lost_frames_total", "frames overwritten in the shared memory ring before the controller read them")
+
+REPORT_INTERVAL = 1.0
+
+# command tags of the pipe to the reader process
+SEND = b'T'
+RECONNECT = b'R'
+EXCLUDE = b'X'
+BAUDRATE = b'B'
+UDP_STREAM = b'U'
+QUIT = b'Q'
+
+# a forked child could inherit a lock (logging, metrics) held by one of the
+# controller's threads and block on it forever, spawn starts a clean process
+CONTEXT = multiprocessing.get_context('spawn')
+
+
+class RingWriter(GPSParser):
+    """GPSParser of the reader process, puts every frame into the ring"""
+    def __init__(self, ring: FrameRing, doorbell, **kwargs):
+        self.ring = ring
+        self.doorbell = doorbell
+        os.set_blocking(doorbell.fileno(), False)
+        super().__init__(**kwargs)
+
+    def service(self):
+        published = self.ring.write_seq
+        super().service()
+        if self.ring.write_seq != published:
+            try:
+                os.write(self.doorbell.fileno(), b'\x00')
+            except BlockingIOError:
+                pass  # the pipe is full, the controller is woken anyway
+
+    def dispatch(self, msg):
+        self.ring.put(msg, self.receive_time())
+        super().dispatch(msg)
+
+    def dispatch_ubx(self, msg, time_received):
+        pass  # read from the ring by the controller process
+
+
+class ReaderProcess(CONTEXT.Process):
+    def __init__(self, ring, commands, reports, doorbell, port=None, baudrate=115200, name=None, udp_port=10777):
+        self.ring = ring
+        self.commands = commands
+        self.reports = reports
+        self.doorbell = doorbell
+        self.parser_args = dict(port=port, baudrate=baudrate, name=name, udp_port=udp_port)
+        self.reconnects = 0
+        self.parent_pid = os.getpid()
+        self.log_queue = root_queue()
+        self.log_level = logging.getLogger().level
+        super().__init__(name=f"reader-{name}" if name else 'reader', daemon=True)
+
+    def run(self):
+        # the controller stops this process, kill -USR1 <pid of this process> profiles its reader thread
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if self.log_queue is not None:
+            log_to_queue(self.log_queue, self.log_level)
+        gpsp = RingWriter(self.ring, self.doorbell, **self.parser_args)
+        signal.signal(signal.SIGUSR1, gpsp.profiler.toggle)
+        gpsp.start()
+        logger.info(f"ReaderProcess | Writing frames to shared memory {self.ring.name}")
+        state = None
+        last_report = 0
+        try:
+            while os.getppid() == self.parent_pid:
+                if self.commands.poll(0.05):
+                    if not self.execute(gpsp, self.commands.recv_bytes()):
+                        break
+                current = (gpsp.ready, gpsp.connection_count, gpsp.port, self.reconnects)
+                if current != state or time.time()-last_report >= REPORT_INTERVAL:
+                    state = current
+                    last_report = time.time()
+                    self.report(gpsp)
+        except (EOFError, BrokenPipeError):
+            pass  # the controller process is gone
+        gpsp.stop()
+        self.ring.shm.close()
+
+    def execute(self, gpsp, command):
+        tag, data = command[:1], command[1:]
+        if tag == SEND:
+            gpsp.send_to_gps(data)
+        elif tag == BAUDRATE:
+            baudrate, delay = struct.unpack('<Id', data)
+            gpsp.set_baudrate(baudrate, delay)
+        elif tag == UDP_STREAM:
+            gpsp.udp_stream_active = bool(data[0])
+        elif tag in (RECONNECT, EXCLUDE):
+            self.reconnects = struct.unpack('<I', data[:4])[0]
+            if tag == EXCLUDE:
+                gpsp.exclude_port(data[4:].decode())
+            else:
+                gpsp.reconnect()
+            gpsp.ready = False
+        elif tag == QUIT:
+            return False
+        return True
+
+    def report(self, gpsp):
+        self.reports.send({
+            'ready': gpsp.ready,
+            'connection_count': gpsp.connection_count,
+            'port': gpsp.port,
+            'last_port': gpsp.last_port,
+            'baudrate': gpsp.baudrate,
+            'last_data_received': gpsp.last_data_received,
+            'rx_rate': gpsp.rx_rate,
+            'reconnects': self.reconnects,
+            'counters': METRICS.counter_values(),
+        })
+
+
+class RingParser(GPSParser):
+    """
+    stands in for a GPSParser in the controller process, the serial port is
+    read by a ReaderProcess and the UBX frames are taken from shared memory
+    """
+    def __init__(self, port=None, baudrate=115200, name=None, udp_port=10777, slots=4096, capacity=1 << 20):
+        self.ring = FrameRing(slots=slots, capacity=capacity)
+        commands_r, self.commands = CONTEXT.Pipe(duplex=False)
+        self.reports, reports_w = CONTEXT.Pipe(duplex=False)
+        self.doorbell, doorbell_w = CONTEXT.Pipe(duplex=False)
+        self.reconnects = 0
+        self._udp_stream_active = False
+        self.process = ReaderProcess(self.ring, commands_r, reports_w, doorbell_w, port, baudrate, name, udp_port)
+        super().__init__(port, baudrate, name, udp_port)
+        self.frames = self.ring.reader()
+
+    @property
+    def udp_stream_active(self):
+        return self._udp_stream_active
+
+    @udp_stream_active.setter
+    def udp_stream_active(self, active):
+        if active != self._udp_stream_active:
+            self._udp_stream_active = active
+            self.command(UDP_STREAM + bytes((active,)))
+
+    def start(self):
+        self.process.start()
+        # the ends of the reader process, closing them here lets EOF report its end
+        self.process.commands.close()
+        self.process.reports.close()
+        self.process.doorbell.close()
+        os.set_blocking(self.doorbell.fileno(), False)
+        logger.info(f"RingParser | Reader process {self.process.pid} started")
+        super().start()
+
+    def run(self):
+        logger.debug(f'RingParser | run function started')
+        while self.keep_running:
+            self.profiler.poll()
+            # woken by a report (at least once per REPORT_INTERVAL) or new frames
+            ready = multiprocessing.connection.wait([self.reports, self.doorbell])
+            try:
+                if self.reports in ready:
+                    self.update_state(self.reports.recv())
+                if self.doorbell in ready and not os.read(self.doorbell.fileno(), 4096):
+                    raise EOFError
+            except EOFError:
+                if self.keep_running:
+                    logger.error("RingParser | Reader process terminated")
+                self.ready = False
+                break
+            lost = self.frames.lost
+            for frame, time_received in self.frames.read():
+                for listener in self.frame_listeners:
+                    listener(frame, time_received)
+                if starts_with_UBX_Header(frame):
+                    self.dispatch_ubx(frame, time_received)
+            if self.frames.lost != lost:
+                self.metrics.inc('frame_ring_lost_frames_total', self.frames.lost-lost, self.metric_labels)
+        logger.debug(f'RingParser | run function ended ')
+
+    def update_state(self, report):
+        # a report sent before the last reconnect still shows the old connection as ready
+        self.ready = report['ready'] and report['reconnects'] == self.reconnects
+        self.connection_count = report['connection_count']
+        self.port = report['port']
+        self.last_port = report['last_port']
+        self.last_data_received = report['last_data_received']
+        self.rx_rate = report['rx_rate']
+        self.metrics.set_counters(report['counters'])
+
+    def command(self, data):
+        if not self.process.is_alive():
+            return
+        with self.rx_lock:
+            try:
+                self.commands.send_bytes(data)
+            except (BrokenPipeError, OSError):
+                logger.warning("RingParser | Reader process does not accept commands")
+
+    def send_to_gps(self, data):
+        self.command(SEND + data)
+
+    def set_baudrate(self, baudrate, delay=0.0):
+        # executed by the reader process in order with the data sent before
+        self.command(BAUDRATE + struct.pack('<Id', baudrate, delay))
+        self.baudrate = baudrate
+        if self.link_capacity:
+            self.set_link_baudrate(baudrate)
+
+    def reconnect(self):
+        self.reconnects += 1
+        self.ready = False
+        self.command(RECONNECT + struct.pack('<I', self.reconnects))
+
+    def exclude_port(self, port):
+        self.reconnects += 1
+        self.ready = False
+        self.command(EXCLUDE + struct.pack('<I', self.reconnects) + port.encode())
+
+    def stop(self):
+        logger.info(f'RingParser | stop function started')
+        self.keep_running = False
+        self.command(QUIT)
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.join()
+        self.ring.close()
+        logger.info(f'RingParser | stop function ended')
@@ -0,0 +1,176 @@
+#! /usr/bin/env python
+"""
+Monitoring of the receiver's own port buffers.
+
+At high RTCM rates the receiver itself can become the bottleneck: the TX
+buffer of its output port fills up and messages are lost before they reach
+the host. ReceiverMonitor polls MON-TXBUF, MON-RXBUF and MON-IO (MON-COMMS on
+receivers that know it) every `interval` seconds. The answers are collected
+by a listener in the reader thread, the controller never waits for them.
+
+A poll counts as overloaded when the receiver flags a TX buffer limit or
+allocation error or a TX buffer is `high_usage` % full. After
+`overload_polls` overloaded polls in a row the controller is asked to step
+the output down, once the usage stayed below half of high_usage for
+`calm_time` seconds to step it up again. With max_level 0 overloads are only
+logged.
+"""
+import collections
+import time
+
+from log_setup import RateLimiter
+from metrics import METRICS
+from ubxhelper import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+METRICS.describe("receiver_tx_buffer_usage", "usage of the receiver's TX buffer per port in % at the last poll", 'gauge')
+METRICS.describe("receiver_tx_buffer_peak_usage", "highest TX buffer usage per port in % seen by the monitor", 'gauge')
+METRICS.describe("receiver_rx_buffer_usage", "usage of the receiver's RX buffer per port in % at the last poll", 'gauge')
+METRICS.describe("receiver_io_overrun_errors", "RX overrun errors per port counted by the receiver since startup", 'gauge')
+METRICS.describe("receiver_tx_buffer_overflows_total", "polls in which the receiver reported a full TX buffer, by port")
+METRICS.describe("receiver_output_step_down", "step down level of the RTCM output, 0 = full rate", 'gauge')
+
+MON_MSG_TYPES = ('MON-TXBUF', 'MON-RXBUF', 'MON-IO', 'MON-COMMS')
+MON_MSG_IDS = tuple(UBX_MSG_IDS[msg_type] for msg_type in MON_MSG_TYPES)
+HISTORY = 60  # polls kept for the status API
+
+
+class ReceiverMonitor():
+    def __init__(self, interval=10.0, high_usage=80, overload_polls=2, calm_time=600.0, max_level=0):
+        """
+        interval: seconds between polls \n
+        high_usage: TX buffer usage in % that counts as overload \n
+        overload_polls: overloaded polls in a row before stepping down \n
+        calm_time: seconds of low usage before stepping up again \n
+        max_level: highest step down level, 0 = only warn
+        """
+        self.interval = interval
+        self.high_usage = high_usage
+        self.overload_polls = overload_polls
+        self.calm_time = calm_time
+        self.max_level = max_level
+        self.level = 0
+        self.gpsp = None
+        self.next_poll = 0
+        self.latest = {}  # msg type -> last answer, written by the reader thread
+        self.evaluated = 0  # time_received of the last evaluated TX buffer report
+        self.ports = {}  # port name -> state of the last poll
+        self.peak_usage = {}  # port name -> highest TX usage seen
+        self.history = collections.deque(maxlen=HISTORY)  # (time, {port: TX usage})
+        self.errors = 0  # memory or allocation error flags of the last poll
+        self.full_ports = []  # ports whose TX buffer limit was reached at the last poll
+        self.overloaded = 0  # overloaded polls in a row
+        self.calm_since = None
+        self.warnings = RateLimiter(60)
+
+    def poll(self, gpsp, streaming):
+        """
+        called regularly by the controller, sends the polls when due and
+        evaluates the answers. streaming: the RTCM output is active \n
+        returns 'step_down', 'step_up' or None
+        """
+        if gpsp is not self.gpsp:
+            self.attach(gpsp)
+        now = time.time()
+        action = None
+        report = self.latest.get('MON-COMMS') or self.latest.get('MON-TXBUF')
+        if report and report.time_received > self.evaluated:
+            self.evaluated = report.time_received
+            self.update_ports(report)
+            action = self.evaluate(now, streaming)
+        if now >= self.next_poll:
+            self.next_poll = now + self.interval
+            for msg_type in MON_MSG_TYPES:
+                gpsp.send_to_gps(poll_request(msg_type).serialize_poll())
+        return action
+
+    def attach(self, gpsp):
+        if self.gpsp:
+            self.gpsp.remove_ubx_listener(self.on_ubx_msg)
+        self.gpsp = gpsp
+        gpsp.add_ubx_listener(self.on_ubx_msg)
+        METRICS.register_gauge('receiver_output_step_down', lambda: self.level, gpsp.metric_labels)
+
+    def on_ubx_msg(self, msg: UBXMSG):
+        """listener called by the GPSParser reader thread"""
+        if msg.class_ID + msg.msg_ID not in MON_MSG_IDS or not msg.payload:
+            return
+        msg = msg.specify()
+        if hasattr(msg, 'usage') or hasattr(msg, 'ports'):  # decoded
+            self.latest[msg.msg_type] = msg
+
+    def update_ports(self, report):
+        """merges the last answers into one state per port"""
+        ports = {}
+        if report.msg_type == 'MON-COMMS':
+            for port in report.ports:
+                ports[port['port']] = {key: value for key, value in port.items() if key != 'port'}
+            self.errors = report.tx_errors
+            self.full_ports = []
+        else:
+            rxbuf = self.latest.get('MON-RXBUF')
+            io = self.latest.get('MON-IO')
+            for target, name in enumerate(UBX_MON_PORTS):
+                port = {'tx_pending': report.pending[target], 'tx_usage': report.usage[target], 'tx_peak_usage': report.peak_usage[target]}
+                if rxbuf:
+                    port.update({'rx_pending': rxbuf.pending[target], 'rx_usage': rxbuf.usage[target], 'rx_peak_usage': rxbuf.peak_usage[target]})
+                if io and target < len(io.ports):
+                    port.update(io.ports[target])
+                ports[name] = port
+            self.errors = report.errors & (UBX_MON_TXBUF.ERROR_MEM | UBX_MON_TXBUF.ERROR_ALLOC)
+            self.full_ports = [name for target, name in enumerate(UBX_MON_PORTS) if report.limit_reached(target)]
+        for name, port in ports.items():
+            if not any(port.get(key) for key in ('tx_usage', 'tx_peak_usage', 'rx_usage', 'tx_bytes', 'rx_bytes')):
+                continue  # unused port
+            if name not in self.ports:
+                self.register_port(name)
+            self.ports[name] = port
+            self.peak_usage[name] = max(self.peak_usage.get(name, 0), port['tx_usage'])
+
+    def register_port(self, name):
+        labels = self.gpsp.metric_labels + (('port', name),)
+        METRICS.register_gauge('receiver_tx_buffer_usage', lambda: self.ports[name]['tx_usage'], labels)
+        METRICS.register_gauge('receiver_tx_buffer_peak_usage', lambda: self.peak_usage[name], labels)
+        METRICS.register_gauge('receiver_rx_buffer_usage', lambda: self.ports[name].get('rx_usage', 0), labels)
+        METRICS.register_gauge('receiver_io_overrun_errors', lambda: self.ports[name].get('overrun_errors', 0), labels)
+
+    def evaluate(self, now, streaming):
+        usage = {name: port['tx_usage'] for name, port in self.ports.items()}
+        self.history.append((round(now, 1), usage))
+        for name in self.full_ports:
+            METRICS.inc('receiver_tx_buffer_overflows_total', 1, self.gpsp.metric_labels + (('port', name),))
+        max_usage = max(usage.values(), default=0)
+        if self.full_ports or self.errors or max_usage >= self.high_usage:
+            self.overloaded += 1
+            self.calm_since = None
+            if self.warnings.ready('overload'):
+                logger.warning(f"ReceiverMonitor | Receiver output is the bottleneck: TX buffer usage {usage}, full: {self.full_ports}, errors: {self.errors:#04x}, step down level {self.level}")
+        else:
+            self.overloaded = 0
+            if max_usage >= self.high_usage/2:
+                self.calm_since = None
+            elif self.calm_since is None:
+                self.calm_since = now
+        if not streaming:
+            return None
+        if self.overloaded >= self.overload_polls and self.level < self.max_level:
+            self.level += 1
+            self.overloaded = 0
+            logger.warning(f"ReceiverMonitor | Stepping RTCM output down to level {self.level}")
+            return 'step_down'
+        if self.level and self.calm_since is not None and now-self.calm_since >= self.calm_time:
+            self.level -= 1
+            self.calm_since = now
+            logger.info(f"ReceiverMonitor | TX buffer usage low for {self.calm_time:.0f}s, stepping RTCM output up to level {self.level}")
+            return 'step_up'
+        return None
+
+    def snapshot(self):
+        """state for the status API"""
+        return {
+            'step_down_level': self.level,
+            'ports': {name: dict(port, tx_peak_usage_seen=self.peak_usage[name]) for name, port in self.ports.items()},
+            'tx_usage_history': [[t, usage] for t, usage in self.history],
+        }
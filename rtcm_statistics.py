@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+"""
+Rates of the RTCM messages coming from the receiver for the status API.
+
+RTCMStatistics is a frame listener of the GPSParser, it only updates a few
+numbers per frame. The snapshot is built when /status is requested.
+"""
+import time
+
+from health import ArrivalRates
+from rtcmhelper import starts_with_RTCM_Header, get_rtcm_msg_type
+
+
+class RTCMStatistics():
+    def __init__(self, window=5.0):
+        """window: seconds over which the byte rate is measured"""
+        self.window = window
+        self.rates = ArrivalRates()
+        self.counts = {}  # msg type -> messages received
+        self.window_start = time.time()
+        self.window_bytes = 0
+        self.bytes_per_second = 0.0
+
+    def on_frame(self, frame, time_received):
+        """listener called by the reader thread"""
+        if not starts_with_RTCM_Header(frame):
+            return
+        msg_type = get_rtcm_msg_type(frame)
+        self.rates.note(msg_type, time_received)
+        self.counts[msg_type] = self.counts.get(msg_type, 0) + 1
+        self.window_bytes += len(frame)
+        elapsed = time_received - self.window_start
+        if elapsed >= self.window:
+            self.bytes_per_second = self.window_bytes/elapsed
+            self.window_start = time_received
+            self.window_bytes = 0
+
+    def snapshot(self, now=None):
+        """active message types with their rate in Hz and the RTCM byte rate"""
+        now = now or time.time()
+        types = {}
+        for msg_type in sorted(self.rates.keys()):
+            rate = self.rates.rate(msg_type, now)
+            if rate >= 0.01:
+                types[str(msg_type)] = {'rate_hz': round(rate, 3), 'count': self.counts[msg_type]}
+        # the window is only closed by arriving frames
+        bytes_per_second = self.bytes_per_second if now - self.window_start < 2*self.window else 0.0
+        return {'types': types, 'bytes_per_second': round(bytes_per_second, 1)}
@@ -41,6 +41,17 @@ def crc24q(buf, startvalue=0):
 
 def get_rtcm_msg_type(rtcm_message):
     return rtcm_message[3]<<4 | rtcm_message[4]>>4
+
+def build_rtcm_msg(msg_type, payload):
+    """
+    frame payload as RTCM3 message, the first 12 bits of the payload are
+    overwritten with msg_type
+    """
+    payload = bytearray(payload)
+    payload[0] = msg_type >> 4
+    payload[1] = ((msg_type & 0x0f) << 4) | (payload[1] & 0x0f)
+    frame = RTCM_HEADER + struct.pack('>H', len(payload) & 1023) + bytes(payload)
+    return frame + crc24q(frame).to_bytes(3,'big')
     
 
 crc24qtab = [
@@ -9,29 +9,91 @@ from ubxhelper import *
 import threading
 import os
 import argparse
-import csv
 import urllib.request as req
 from UBXAssistOnline import UBXAssistOnline
+from metrics import METRICS, MetricsServer
+from position_recorder import PositionRecorder
+from time_output import TimeDifferenceOutput, LatencyCalibration
+from survey_estimator import SurveyEstimator
+from ubxconfig import ConfigTransaction, poll, poll_msg_rates, negotiate_baudrate, query
+from health import HealthMonitor
+from mga_upload import inject_assistance
+from nav_database import NavDatabase
+from multiplexer import DeviceMultiplexer
+from reader_process import RingParser
+from frame_tap import FrameTap
+from rtcm_statistics import RTCMStatistics
+from receiver_monitor import ReceiverMonitor
+from sky_view import SkyView
+from survey_store import SurveyStore
+from antenna_catalog import load_catalog
+from geodesy import ecef_to_llh
+from log_setup import setup_logging, stop_logging, RateLimiter, THREAD_LOG_FORMAT, LOG_FORMAT
+import signal
 import calendar
+import configparser
 import datetime
 
 
-logging.basicConfig(format='[%(levelname)8s]\t%(asctime)s: %(message)s ', filename='rtkstreamer.log', filemode='a', level=logging.INFO)
 logger = logging.getLogger(__name__)
-logger.level =logging.INFO
 
 ANTENNA_FILE = "Antennas.loc"
 ASSISTANCE_FILE="assistance_data.ubx"
 ASSISTANCE_FILE=os.path.expanduser(ASSISTANCE_FILE)
 LOCATION_FILE="HP_Antenna_Cypress.csv"
 TIMEDIFFERENCE_FILE="timedifference.txt"
-LATENCY= 0.093
+NAV_DATABASE_FILE="nav_database.bin"
+LOG_FILE="rtkstreamer.log"
+LATENCY= 0.093  # unless given or calibrated
+LATENCY_FILE="latency_calibration.txt"
+SURVEY_FILE="surveyed_position.json"
+FIX_TIMEOUT = 30  # seconds to wait for the navigation fix that selects the antenna
+PROFILE_MODES = ('time', 'output_positions')  # end states worth saving, svin only leads to time
+# options whose files belong to one receiver -> their default file
+RECEIVER_FILES = {
+    'output_positions': LOCATION_FILE,
+    'time_difference': TIMEDIFFERENCE_FILE,
+    'nav_database': NAV_DATABASE_FILE,
+    'persist_survey': SURVEY_FILE,
+    'calibrate_latency': LATENCY_FILE,
+}
+TIME_MODE_TIMEOUT = 30  # seconds to wait for the time fix (fixed mode) or the first NAV-PVT (output_positions) before resetting again
+# output rates in epochs of RTCM messages per step down level, while the receiver's TX buffer overflows
+RTCM_STEP_DOWN = [
+    {},
+    {b"\xF5\x05": 10, b"\xF5\xE6": 10},  # station position and GLONASS biases hardly change
+    {b"\xF5\x05": 10, b"\xF5\xE6": 10, b"\xF5\x54": 2},  # GLONASS observations every second epoch
+]
 
 
 class RTKStreamer():
     """RTK Streamer controls ublox GPS device via GPS Parser"""
-    def __init__(self, gpsparser : GPSParser, mode='survey_in', survey_in="200,2.0", time_difference = 0, assistance_file = 0, location=(0,0,0,0)):
+    def __init__(self, gpsparser : GPSParser, mode='survey_in', survey_in="200,2.0", time_difference = 0, assistance_file = 0, location=(0,0,0,0), position_recorder=None, ntp_shm_unit=None, time_difference_interval=1.0, survey_estimator=None, save_config='bbr', baudrates=(), nav_database=None, unique_id=None, assist=None, tap=None, svin_log_interval=30.0, receiver_monitor=None, sky_view=None, latency=None, survey_store=None, antenna_catalog=None, antenna_tolerance=10.0):
         self.gpsp = gpsparser
+        self.survey_store = survey_store  # the result of a survey is stored and used by later starts
+        self.survey_stored = False
+        self.antenna_catalog = antenna_catalog  # registered antennas, the nearest one within antenna_tolerance m is used
+        self.antenna_tolerance = antenna_tolerance
+        self.antenna_name = None
+        self.restore_connection = 0
+        self.sky_view = sky_view
+        self.receiver_monitor = receiver_monitor
+        self.svin_log = RateLimiter(svin_log_interval)
+        self.svin_state = None
+        self.last_svin = None
+        self.status_changed = time.time()
+        self.tap = tap
+        self.unique_id = unique_id  # SEC-UNIQID the receiver must have, other receivers are skipped
+        self.receiver_id = None
+        self.nav_database = nav_database
+        self.baudrates = baudrates  # UART rates to negotiate, highest first
+        self.save_config = save_config
+        self.msg_rates = {}  # msg id -> USB rate as last confirmed by the receiver
+        self.saved_profiles = {}  # receiver id -> profile last saved to (or found in) the receiver
+        self.config_connection = 0
+        self.time_mode_sent = 0
+        self.survey_estimator = survey_estimator
+        self.position_recorder = position_recorder
         self.status = 'undefined'
         self.fix_status = 'undefined'
         self.last_status=time.time()
@@ -48,18 +110,49 @@ class RTKStreamer():
         self.mode = mode
         logger.info(f'RTK Streamer | Starting in Mode {mode}')
         self.time_difference = time_difference
+        self.time_output = None
+        if time_difference or ntp_shm_unit is not None:
+            self.time_output = TimeDifferenceOutput(time_difference or None, ntp_shm_unit, time_difference_interval)
+        self.latency = latency or LatencyCalibration(None, LATENCY)
         self.assistance_file= assistance_file
         self.ublox_token=''
         self.keep_running = True
-        self.t_assist = UBXAssistOnline(location, assistance_file) 
-        self.time_differences=[]
-        if self.assistance_file:
+        # several streamers share one download thread
+        self.own_assist = assist is None
+        self.t_assist = assist or UBXAssistOnline(location, assistance_file) 
+        self.metrics = METRICS
+        self.metric_labels = gpsparser.metric_labels
+        self.health = HealthMonitor()
+        self.metrics.register_gauge('rtkstreamer_health_score', self.health.score, self.metric_labels)
+        self.metrics.register_gauge('rtkstreamer_recovery_level', lambda: self.health.level, self.metric_labels)
+        self.rtcm_statistics = RTCMStatistics()
+        self.gpsp.add_frame_listener(self.rtcm_statistics.on_frame)
+        self.metrics.register_status(gpsparser.receiver_name or 'receiver', self.status_snapshot)
+        if self.sky_view:
+            self.sky_view.register_metrics(self.metric_labels)
+        if self.time_output:
+            self.metrics.register_gauge('rtkstreamer_epoch_delay_seconds', lambda: self.latency.last_delay, self.metric_labels)
+            self.metrics.register_gauge('rtkstreamer_latency_seconds', lambda: self.latency.value, self.metric_labels)
+        if self.assistance_file and self.own_assist:
             self.t_assist.start()
+        if self.tap:
+            self.tap.start()
             
     def run(self):
-        self.gpsp.start()
+        if not self.gpsp.mux:
+            self.gpsp.start()
         while(self.keep_running):
             self.wait_for_gps_ready()
+            if not self.gpsp.ready:
+                continue
+            if self.config_connection != self.gpsp.connection_count:
+                # (re)connected, the receiver may have been power cycled or be another one
+                if not self.sync_receiver_config():
+                    continue
+
+            if self.mode == 'survey_in' and self.status == 'undefined' and (self.survey_store or self.antenna_catalog) and self.restore_connection != self.gpsp.connection_count:
+                self.restore_connection = self.gpsp.connection_count
+                self.restore_location()
 
             if self.mode == 'survey_in':
                 if self.status == 'undefined':
@@ -76,11 +169,14 @@ class RTKStreamer():
                 elif self.status == 'surveying':
                     self.gpsp.udp_stream_active = False
                 elif self.status == 'time':
+                    if self.survey_store and not self.survey_stored:
+                        self.store_survey()
                     self.set_rate(1000)
                     self.set_messages('time')
                     self.gpsp.udp_stream_active = True
             if self.mode=='fixed':
-                if self.status == 'undefined':
+                if self.status == 'undefined' and time.time()-self.time_mode_sent > TIME_MODE_TIMEOUT:
+                    self.time_mode_sent = time.time()
                     self.reset_gps('hot')
                     self.msg_mode=''
                     self.rate=0
@@ -98,14 +194,81 @@ class RTKStreamer():
                 elif self.status=='acquiring':
                     if self.fix_status=='ok':
                         self.set_messages('output_positions')
-                else:
+                elif time.time()-self.time_mode_sent > TIME_MODE_TIMEOUT:
+                    self.time_mode_sent = time.time()
                     self.reset_gps('hot')
                     self.msg_mode=''
                     self.stop_time_mode()
                     self.set_rate(1000)
                     self.set_messages('status')
                   
+            if self.nav_database:
+                self.nav_database.poll(self.gpsp, self.status in ('surveying', 'time'))
+            if self.receiver_monitor and self.receiver_monitor.poll(self.gpsp, self.status == 'time'):
+                # step down level changed, apply the RTCM rates of the new level
+                mode = self.msg_mode
+                self.msg_mode = ''
+                self.set_messages(mode)
+            self.gpsp.wait_for_ubx(0.1)
+            self.process_ubx_messages()
+
+    def sync_receiver_config(self):
+        """
+        poll rate and time mode of the receiver and wait for its status, so a
+        receiver that is already configured is used without reset.
+        Returns False if the connected receiver is not the configured one
+        """
+        self.config_connection = self.gpsp.connection_count
+        self.time_mode_sent = 0
+        self.survey_stored = False  # the receiver may have surveyed again or be another one
+        if self.baudrates:
+            negotiate_baudrate(self.gpsp, self.baudrates)
+        if not self.check_identity():
+            return False
+        self.msg_rates = {}
+        self.msg_mode = ''
+        rate, tmode3 = poll(self.gpsp, UBX_CFG_RATE(), UBX_CFG_TMODE3())
+        self.rate = rate.measurement_rate if rate else 0
+        if not tmode3:
+            return True
+        logger.info(f"RTK Streamer | Receiver config: rate {self.rate}ms, TMODE3 mode {tmode3.mode} {tmode3.lat:.9f}, {tmode3.lon:.9f}, {tmode3.alt:.4f}")
+        if not self.time_mode_matches(tmode3):
+            logger.info(f"RTK Streamer | Receiver time mode does not match mode {self.mode}, reconfiguring")
+            return True
+
+        if self.status != 'undefined':
+            return True
+        deadline = time.time() + 3
+        while self.status == 'undefined' and time.time() < deadline and self.keep_running:
             self.process_ubx_messages()
+            time.sleep(0.1)
+        if self.status != 'undefined':
+            logger.info(f"RTK Streamer | Receiver already running with status {self.status}, skipping reset")
+        return True
+
+    def check_identity(self):
+        """logs the identity of the connected receiver, gives the port up if it is not the configured one"""
+        uniqid = query(self.gpsp, UBX_SEC_UNIQID())
+        self.receiver_id = uniqid.unique_id if uniqid else None
+        logger.info(f"RTK Streamer | Receiver {self.receiver_id or 'without unique id'} on {self.gpsp.last_port}")
+        if not self.unique_id or self.receiver_id == self.unique_id.lower():
+            return True
+        if not self.receiver_id:
+            logger.warning(f"RTK Streamer | Receiver on {self.gpsp.port} did not send its unique id, reconnecting")
+            self.gpsp.reconnect()
+            return False
+        logger.warning(f"RTK Streamer | Receiver {self.receiver_id} on {self.gpsp.port} is not {self.unique_id}, skipping port")
+        self.gpsp.exclude_port(self.gpsp.port)
+        return False
+
+    def time_mode_matches(self, tmode3):
+        if self.mode == 'survey_in':
+            return tmode3.mode == UBX_CFG_TMODE3.MODE_SURVEY_IN
+        if self.mode == 'fixed':
+            lat, lon, alt, acc = self.location
+            return (tmode3.mode == UBX_CFG_TMODE3.MODE_FIXED and abs(tmode3.lat-lat) < 1e-8
+                and abs(tmode3.lon-lon) < 1e-8 and abs(tmode3.alt-alt) < 1e-3)
+        return tmode3.mode == UBX_CFG_TMODE3.MODE_DISABLED
 
     def set_status(self, status):
         if self.status == status:
@@ -113,22 +276,44 @@ class RTKStreamer():
         else:
             logger.info(f"RTK Streamer | Changing Status from {self.status} to {status}")
             self.status=status
+            self.status_changed = time.time()
+            self.metrics.inc('rtkstreamer_status_changes_total', 1, self.metric_labels + (('status', status),))
+            if status == 'surveying':
+                self.survey_stored = False  # a new survey, store its result too
         self.last_status = time.time()
+        if status != 'undefined':
+            self.health.note_status(self.last_status)
     
     def process_ubx_messages(self):
         msg = self.gpsp.get_next_ubx_msg()
         while(msg):
             msg=msg.specify()
+            self.metrics.inc('rtkstreamer_ubx_messages_total', 1, self.metric_labels)
+            self.health.note_msg(msg.msg_type, msg.time_received)
 
             if msg.msg_type == 'NAV-HPPOSLLH':
                 if self.mode == 'output_positions':
                     self.set_status('streaming')
-                    line=f"{msg.time_received}, {msg.lat:0.9f}, {msg.lon:.9f}, {msg.height:0.4f}\n"
-                    with open(LOCATION_FILE,'a') as f:
-                        f.write(line)
+                    self.position_recorder.write(msg)
+                elif self.survey_estimator and self.mode == 'survey_in' and self.status == 'surveying':
+                    self.survey_estimator.consume(msg)
+                    if self.survey_estimator.converged():
+                        self.finish_own_survey()
+
+            if msg.msg_type in ('NAV-SAT', 'NAV-SIG') and self.sky_view:
+                self.sky_view.consume(msg)
 
             if msg.msg_type == 'NAV-SVIN':
-                logger.info(f"RTK Streamer | SVIN Status Dur: {msg.dur}s, Acc: {msg.mean_acc/10000:01.3f}m  Valid: {msg.valid}  Obs: {msg.num_obs}  In progress: {msg.in_progress}  itow: {msg.itow}, t_recv: {msg.time_received} ")
+                self.last_svin = msg
+                # once per svin_log interval and whenever the survey state changes
+                # the state is checked first, ready() counts the line as suppressed otherwise
+                state_changed = (msg.valid, msg.in_progress) != self.svin_state
+                if state_changed or self.svin_log.ready():
+                    self.svin_state = (msg.valid, msg.in_progress)
+                    suppressed = self.svin_log.take_suppressed()
+                    logger.info(f"RTK Streamer | SVIN Status Dur: {msg.dur}s, Acc: {msg.mean_acc/10000:01.3f}m  Valid: {msg.valid}  Obs: {msg.num_obs}  In progress: {msg.in_progress}  itow: {msg.itow}, t_recv: {msg.time_received}, {suppressed} not logged")
+                    if self.survey_estimator:
+                        logger.info(f"RTK Streamer | Own Survey {self.survey_estimator.status()}")
                 if msg.in_progress==1:
                     self.set_status('surveying')
                     
@@ -137,57 +322,124 @@ class RTKStreamer():
                     self.set_status('time')
                     
             if msg.msg_type == 'NAV-PVT':
-                logger.debug(f"NAV-PVT | {msg.year}-{msg.month}-{msg.day} {msg.hour}:{msg.min}:{msg.sec+msg.nano*1e-9:11.9f} ")
-                logger.debug(f"NAV-PVT | Validity Time-Date-fullyR-Mag {msg.validTime}-{msg.validDate}-{msg.fullyResolved}-{msg.validMag}")
-                logger.debug(f"NAV-PVT | {msg.lat:.7f},{msg.lon:.7f},{msg.height:.3f} hAcc{msg.hAcc} vAcc:{msg.vAcc}")
-                logger.debug(f"NAV-PVT | FixType: {msg.fixType} fixOk:{msg.gnssFixOk} invalidLLH:{msg.invalidLLH} ")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"NAV-PVT | {msg.year}-{msg.month}-{msg.day} {msg.hour}:{msg.min}:{msg.sec+msg.nano*1e-9:11.9f} ")
+                    logger.debug(f"NAV-PVT | Validity Time-Date-fullyR-Mag {msg.validTime}-{msg.validDate}-{msg.fullyResolved}-{msg.validMag}")
+                    logger.debug(f"NAV-PVT | {msg.lat:.7f},{msg.lon:.7f},{msg.height:.3f} hAcc{msg.hAcc} vAcc:{msg.vAcc}")
+                    logger.debug(f"NAV-PVT | FixType: {msg.fixType} fixOk:{msg.gnssFixOk} invalidLLH:{msg.invalidLLH} ")
                 
                 fix_ok= msg.gnssFixOk & msg.validTime & msg.validDate &msg.fullyResolved
                 if fix_ok:
                     self.fix_status='ok'
+                    if self.mode == 'output_positions' and self.status == 'undefined':
+                        self.set_status('acquiring')
                     if self.assistance_file:
                         #update location for fix data
                         location=(msg.lat, msg.lon,msg.height, msg.hAcc)
                         self.t_assist.update_location(location)
-                    if self.time_difference:
+                    if self.time_output:
                         self.update_time_difference(msg)
                 else:
                     self.fix_status='not ok'
                     if self.mode == 'output_positions':
                         self.set_status('acquiring')
                 self.last_fix_status = time.time()
+                self.health.note_fix(self.fix_status == 'ok')
 
                 if msg.fixType == 5:
                     self.set_status('time')
 
 
             msg = self.gpsp.get_next_ubx_msg()
+
+        if self.position_recorder:
+            self.position_recorder.poll()
             
-        time_since_last_status = time.time() - self.last_status
         time_since_last_fix_status = time.time() - self.last_fix_status
 
-        if time_since_last_status > 5:
-            self.set_status('undefined')
+        if self.status != 'undefined':
+            self.check_health()
             
         if time_since_last_fix_status > 5:
             self.fix_status = 'undefined'
+            self.health.note_fix(False)
+
+    def status_snapshot(self):
+        """state for the status API, built on request from what the controller keeps anyway"""
+        now = time.time()
+        svin = self.last_svin
+        survey_in = None
+        if svin:
+            survey_in = {'dur': svin.dur, 'mean_acc_m': svin.mean_acc/10000, 'obs': svin.num_obs, 'valid': bool(svin.valid),
+                'in_progress': bool(svin.in_progress), 'age_s': round(now-svin.time_received, 1)}
+        return {
+            'mode': self.mode,
+            'status': self.status,
+            'status_since_s': round(now-self.status_changed, 1),
+            'fix_status': self.fix_status,
+            'receiver': {'connected': self.gpsp.ready, 'port': self.gpsp.last_port, 'unique_id': self.receiver_id},
+            'antenna': self.antenna_name,
+            'health': {'score': round(self.health.score(now), 3), 'recovery_level': self.health.level},
+            'survey_in': survey_in,
+            'link': {'bytes_per_second': round(self.gpsp.rx_rate, 1), 'utilisation': round(self.gpsp.link_utilisation(), 4)},
+            'rtcm': self.rtcm_statistics.snapshot(now),
+            'clients': {
+                'udp_stream_active': self.gpsp.udp_stream_active,
+                'udp_destinations': [f"{ip}:{port}" for ip, port in self.gpsp.udp_broadcasts],
+                'tap_consumers': len(self.tap.consumers) if self.tap else 0,
+            },
+            'receiver_buffers': self.receiver_monitor.snapshot() if self.receiver_monitor else None,
+            'sky': self.sky_view.snapshot(now) if self.sky_view else None,
+            'latency': {'latency_ms': round(self.latency.value*1000, 3), 'calibrated': self.latency.calibrated,
+                'epoch_delay_ms': round(self.latency.last_delay*1000, 3)} if self.time_output else None,
+        }
+
+    def check_health(self):
+        """graded recovery instead of an immediate reset when status messages stop"""
+        self.health.note_data(self.gpsp.last_data_received)
+        action = self.health.next_action()
+        if not action:
+            return
+        self.metrics.inc('rtkstreamer_recoveries_total', 1, self.metric_labels + (('action', action),))
+        if action == 'rerequest_messages':
+            mode = self.msg_mode
+            self.msg_rates = {}
+            self.msg_mode = ''
+            self.set_messages(mode)
+        elif action == 'reapply_config':
+            self.reapply_config()
+        elif action == 'reopen_serial':
+            self.gpsp.reconnect()
+        elif action == 'reset':
+            # config is polled again before it is diffed
+            self.msg_rates = {}
+            self.set_status('undefined')
+
+    def reapply_config(self):
+        rate = self.rate
+        self.rate = 0
+        self.set_rate(rate or 1000)
+        tmode3, = poll(self.gpsp, UBX_CFG_TMODE3())
+        if tmode3 and self.time_mode_matches(tmode3):
+            return
+        logger.warning(f"RTK Streamer | Receiver lost time mode configuration")
+        if self.mode == 'survey_in':
+            self.start_SVIN()
+        elif self.mode == 'fixed':
+            self.start_time_mode(self.location)
+        else:
+            self.stop_time_mode()
         
 
     def update_time_difference(self, msg:UBX_NAV_PVT):
         timestamp_system=msg.time_received
         timestamp_gnss=calendar.timegm((msg.year,msg.month,msg.day,msg.hour,msg.min,msg.sec))+msg.nano*1e-9
-        dt = int(((timestamp_gnss-timestamp_system)+LATENCY)*1e6)
-        self.time_differences.append(dt)
-        self.time_differences=self.time_differences[-20:]    
-        dt_avg=sum(self.time_differences)/len(self.time_differences)*1e-6
-        #line = f"{datetime.datetime.isoformat(datetime.datetime.now())}, {dt_avg:.6f}\n"
-        line = f"{dt_avg:.6f}\n"
-        
-        with open(self.time_difference,'w') as f:
-            f.write(line)
+        # the message of the epoch arrives the calibrated latency after the epoch itself
+        self.latency.add(timestamp_system-timestamp_gnss)
+        self.time_output.update(timestamp_gnss, timestamp_system-self.latency.value)
 
     def wait_for_gps_ready(self):
-        while not self.gpsp.ready:
+        while not self.gpsp.ready and self.keep_running:
             time.sleep(0.2)
             
     def get_status(self):
@@ -210,7 +462,79 @@ class RTKStreamer():
         survey_acc = float(survey_acc)
         msg.encode_survey_in(survey_duration,survey_acc)
         logger.info(f"RTK Streamer | Sending Survey-in start command to GPS min Duration:{survey_duration} target Acc:{survey_acc:.3f}")
-        self.gpsp.send_to_gps(msg.serialize())
+        if not self.configure(msg):
+            logger.warning("RTK Streamer | Survey-in start not confirmed by GPS")
+        if self.survey_estimator:
+            self.survey_estimator.reset()
+
+    def restore_location(self):
+        """continues in fixed mode at the nearest registered antenna or the stored survey position if the navigation fix confirms it"""
+        stored = self.survey_store.usable(self.receiver_id) if self.survey_store else None
+        if not stored and not self.antenna_catalog:
+            return
+        # in time mode the receiver reports the fixed position, the check needs a navigation fix
+        self.stop_time_mode()
+        fix = self.wait_for_fix(self.survey_store.verify_timeout if self.survey_store else FIX_TIMEOUT)
+        location = self.nearest_antenna(fix) if self.antenna_catalog and fix else None
+        if not location and stored and self.survey_store.verify(stored, fix):
+            location = stored
+            lat, lon, height, acc = location
+            logger.info(f"RTK Streamer | Using stored survey position {lat:.9f}, {lon:.9f}, {height:.4f}, continuing in fixed mode")
+        if not location:
+            return
+        self.location = location
+        self.location_valid = 1
+        self.mode = 'fixed'
+
+    def nearest_antenna(self, fix):
+        """location of the registered antenna nearest to the navigation fix within antenna_tolerance m or None"""
+        # a standalone fix cannot tell antennas apart that are closer than its uncertainty
+        uncertainty = 3*max(fix.hAcc, fix.vAcc)
+        found = self.antenna_catalog.within(fix.lat, fix.lon, fix.height, self.antenna_tolerance + uncertainty)
+        if not found or found[0][0] > self.antenna_tolerance:
+            logger.info(f"RTK Streamer | No registered antenna within {self.antenna_tolerance:.1f}m of {fix.lat:.7f}, {fix.lon:.7f}, {fix.height:.1f} (hAcc {fix.hAcc:.1f}m)")
+            return None
+        distance, name, location = found[0]
+        if len(found) > 1 and (found[1][0] <= self.antenna_tolerance or found[1][0]-distance <= uncertainty):
+            logger.warning(f"RTK Streamer | Registered antennas {name} at {distance:.1f}m and {found[1][1]} at {found[1][0]:.1f}m cannot be told apart by a fix with hAcc {fix.hAcc:.1f}m, vAcc {fix.vAcc:.1f}m, not selecting one")
+            return None
+        logger.info(f"RTK Streamer | Navigation fix {distance:.1f}m from registered antenna {name} (hAcc {fix.hAcc:.1f}m), continuing in fixed mode")
+        self.antenna_name = name
+        return location
+
+    def wait_for_fix(self, timeout):
+        """polls NAV-PVT until the receiver has a 3D fix, returns it or None after timeout seconds"""
+        deadline = time.time() + timeout
+        while time.time() < deadline and self.keep_running:
+            pvt = query(self.gpsp, poll_request('NAV-PVT'))
+            if pvt and pvt.gnssFixOk and pvt.fixType in (UBX_3D_FIX, UBX_3D_DR_FIX):
+                return pvt
+            time.sleep(1)
+        return None
+
+    def store_survey(self):
+        """stores the result of the receiver's completed survey-in"""
+        self.survey_stored = True
+        svin = self.last_svin
+        if not (svin and svin.valid and not svin.in_progress):
+            svin = query(self.gpsp, poll_request('NAV-SVIN'))
+        if not (svin and svin.valid):
+            logger.warning("RTK Streamer | Receiver reports no valid survey-in result to store")
+            return
+        lat, lon, height = ecef_to_llh(*svin.mean_ecef)
+        self.survey_store.store((lat, lon, height, svin.mean_acc/10000), self.receiver_id, svin.dur, 'survey_in')
+
+    def finish_own_survey(self):
+        """fix the receiver at the position of the own survey and continue in fixed mode"""
+        self.location = self.survey_estimator.result()
+        self.location_valid = 1
+        lat, lon, height, acc = self.location
+        logger.info(f"RTK Streamer | Own survey converged {self.survey_estimator.status()} -> {lat:.9f}, {lon:.9f}, {height:.4f}")
+        self.mode = 'fixed'
+        self.set_rate(1000)
+        self.start_time_mode(self.location)
+        if self.survey_store:
+            self.survey_store.store(self.location, self.receiver_id, self.survey_estimator.duration(), 'own_survey')
 
     
     def start_time_mode(self, location):
@@ -218,13 +542,15 @@ class RTKStreamer():
         (lat,lon, alt, acc)= location
         msg.encode_fixed(lat, lon, alt, acc)
         logger.info(f"RTK Streamer | Sending Start Time Mode -FIXED- command to GPS")
-        self.gpsp.send_to_gps(msg.serialize())
+        if not self.configure(msg):
+            logger.warning("RTK Streamer | Time Mode -FIXED- not confirmed by GPS")
     
     def stop_time_mode(self):
         msg=UBX_CFG_TMODE3()
         msg.encode_time_mode_off()
         logger.info(f"RTK Streamer | Sending TIME Mode OFF to GPS")
-        self.gpsp.send_to_gps(msg.serialize())
+        if not self.configure(msg):
+            logger.warning("RTK Streamer | TIME Mode OFF not confirmed by GPS")
 
 
     def reset_gps(self, mode='cold'):
@@ -237,15 +563,36 @@ class RTKStreamer():
 
         data = msg.serialize()
         logger.info(f"RTK Streamer | Sending RESET {mode} to GNS")
+        self.metrics.inc('rtkstreamer_resets_total', 1, self.metric_labels + (('mode', mode),))
         self.gpsp.send_to_gps(data)
+        if self.assistance_file or self.nav_database:
+            self.upload_assistance()
+
+    def upload_assistance(self):
+        """
+        inject time, position, the stored navigation database and the downloaded
+        assistance data to shorten the time to first fix
+        """
+        data = b''
+        if self.nav_database:
+            data += self.nav_database.load()
+        if self.assistance_file:
+            data += self.t_assist.get_data() or b''
+        if not data:
+            logger.info("RTK Streamer | No assistance data available")
+            return
+        location = self.location if self.location_valid else self.t_assist.location()
+        inject_assistance(self.gpsp, data, location)
     
     def set_rate(self, rate):
 
         if rate != self.rate:
-            self.rate = rate
             msg =UBX_CFG_RATE()
             msg.encode(rate)
-            self.gpsp.send_to_gps(msg.serialize())
+            if self.configure(msg):
+                self.rate = rate
+            else:
+                logger.warning(f"RTK Streamer | Rate {rate}ms not confirmed by GPS")
 
     def set_messages(self, mode):
 
@@ -369,13 +716,18 @@ class RTKStreamer():
         }
 
 
-        if self.time_difference or self.assistance_file:
+        if self.survey_estimator and mode == 'svin':
+            obsolete_msgs.pop('NAV-HPPOSLLH', None)
+            required_msgs['NAV-HPPOSLLH'] = b"\x01\x14"
+
+        if self.time_output or self.assistance_file:
             try:
                 obsolete_msgs.pop('NAV-PVT')
             except KeyError:
                 pass
             required_msgs['NAV-PVT']=b"\x01\x07"
-        else:
+        elif mode != 'status':
+            # status mode needs NAV-PVT to leave 'undefined'
             try:
                 required_msgs.pop('NAV-PVT')
             except KeyError:
@@ -386,86 +738,134 @@ class RTKStreamer():
 
             
 
-        all_confirmed=0
-        while not all_confirmed:
-            for msg in obsolete_msgs:
-                self.send_msg_deactivation_request(obsolete_msgs[msg])
-            all_confirmed =1
-        time.sleep(1)
-        logger.info("RTK Streamer | Sending msg activation requests")
-
-        all_confirmed=0
-        while not all_confirmed:
-            for msg in required_msgs:
-                self.send_msg_activation_request(required_msgs[msg])
-            all_confirmed =1
-                
+        wanted = {msgid: 0 for msgid in obsolete_msgs.values()}
+        wanted.update({msgid: 1 for msgid in required_msgs.values()})
+        if self.receiver_monitor:
+            for msgid, rate in RTCM_STEP_DOWN[self.receiver_monitor.level].items():
+                if wanted.get(msgid):
+                    wanted[msgid] = rate
+        if self.sky_view:
+            wanted[b"\x01\x35"] = self.sky_view.rate
+        unknown = [msgid for msgid in wanted if msgid not in self.msg_rates]
+        if unknown:
+            self.msg_rates.update(poll_msg_rates(self.gpsp, unknown))
+        changes = [msgid for msgid in wanted if self.msg_rates.get(msgid) != wanted[msgid]]
+        profile = self.profile(mode, wanted)
+        # reduced RTCM rates are transient, a restart has to come up at full rate
+        stepped_down = self.receiver_monitor and self.receiver_monitor.level
+        if not changes:
+            logger.info(f"RTK Streamer | Messages for mode {mode} already set")
+            if mode in PROFILE_MODES and not stepped_down:
+                # the receiver came up configured, i.e. from its saved profile
+                self.saved_profiles.setdefault(self.receiver_id, profile)
+            return
 
-    def send_msg_deactivation_request(self,msgid):
+        logger.info(f"RTK Streamer | Setting {len(changes)} messages for mode {mode}")
+        transaction = ConfigTransaction(self.gpsp)
+        for msgid in changes:
+            if wanted[msgid]:
+                transaction.add(self.msg_activation_request(msgid, wanted[msgid]))
+            else:
+                transaction.add(self.msg_deactivation_request(msgid))
+        confirmed = transaction.commit()
+        for frame in transaction.frames:
+            if frame.result == 'ack':
+                self.msg_rates[frame.msg.payload[0:2]] = wanted[frame.msg.payload[0:2]]
+            else:
+                self.msg_rates.pop(frame.msg.payload[0:2], None)
+        if not confirmed:
+            logger.warning(f"RTK Streamer | Message configuration {mode} not confirmed, retrying")
+            self.msg_mode = ''
+        elif mode in PROFILE_MODES and not stepped_down:
+            self.save_profile(mode, profile)
+
+    def profile(self, mode, wanted):
+        """what a saved configuration depends on, to save only when it changed"""
+        location = self.location if self.mode == 'fixed' else None
+        return (mode, location, tuple(sorted(wanted.items())))
+
+    def save_profile(self, mode, profile):
+        """store the current receiver configuration so a restart comes up in this mode"""
+        if self.save_config == 'none' or self.saved_profiles.get(self.receiver_id) == profile:
+            return
+        device_mask = UBX_CFG_CFG.DEVICE_BBR
+        if self.save_config == 'flash':
+            device_mask |= UBX_CFG_CFG.DEVICE_FLASH
+        msg = UBX_CFG_CFG()
+        msg.encode_save(device_mask)
+        logger.info(f"RTK Streamer | Saving {mode} profile to {self.save_config}")
+        if not self.configure(msg):
+            logger.warning(f"RTK Streamer | Saving {mode} profile not confirmed by GPS")
+            return
+        self.saved_profiles[self.receiver_id] = profile
+
+    def configure(self, *msgs):
+        """sends CFG messages and waits for their acknowledgement, returns True on success"""
+        transaction = ConfigTransaction(self.gpsp)
+        for msg in msgs:
+            transaction.add(msg)
+        return transaction.commit()
+
+    def msg_deactivation_request(self,msgid):
         msg=UBX_CFG_MSG()
         msg.encode(msgid, UBX_PORT_NONE)
-        self.gpsp.send_to_gps(msg.serialize())
+        return msg
     
-    def send_msg_activation_request(self,msgid):
+    def msg_activation_request(self,msgid, rate=1):
+        """rate: output every rate-th epoch"""
         msg=UBX_CFG_MSG()
-        msg.encode(msgid, UBX_PORT_USB_ONLY)
-        self.gpsp.send_to_gps(msg.serialize())
+        msg.encode(msgid, UBX_PORT_USB_ONLY[:3] + bytes((rate,)) + UBX_PORT_USB_ONLY[4:])
+        return msg
+
+    def send_msg_deactivation_request(self,msgid):
+        self.gpsp.send_to_gps(self.msg_deactivation_request(msgid).serialize())
+    
+    def send_msg_activation_request(self,msgid):
+        self.gpsp.send_to_gps(self.msg_activation_request(msgid).serialize())
     
     def stop(self):
         self.keep_running=False
-        if self.t_assist.is_alive():
+        if self.position_recorder:
+            self.position_recorder.close()
+        if self.own_assist and self.t_assist.is_alive():
             self.t_assist.stop()
+        if self.tap:
+            self.tap.stop()
         if self.gpsp.is_alive():
             self.gpsp.stop()
 
     def __del__(self):
-        self.gpsp.stop()
+        if self.gpsp.is_alive():
+            self.gpsp.stop()
 
 def get_location_from_file(location_name):
-    with open (ANTENNA_FILE, 'r') as f:
-        reader = csv.reader(f,delimiter=',')
-        location=None
-        for row in reader:
-            if row[0] == location_name:
-                lat= float(row[1])
-                lon=float(row[2])
-                height = float(row[3])
-                acc=float(row[4])
-                location =(lat,lon,height,acc)
-                break
+    location = load_catalog(ANTENNA_FILE).get(location_name)
     if not location:
         raise RuntimeError(f"Antenna location with name {location_name} not found in {ANTENNA_FILE}")
     return location
         
-def main():
-    global LOCATION_FILE
-    global ASSISTANCE_FILE
-    global TIMEDIFFERENCE_FILE
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-o", "--output_positions", help="output positions", nargs="?", const=LOCATION_FILE)
-    parser.add_argument("-a", "--assistance_file", help="regulary update online assistance data", nargs="?", const=ASSISTANCE_FILE)
-    parser.add_argument("-t", "--time_difference", help="regulary store difference to local time in file", nargs="?", const=TIMEDIFFERENCE_FILE)
-    parser.add_argument("-s", "--survey_in", help="use position surveying, default mode",  nargs="?", const="200,2.0", default="180,2.0")
-    parser.add_argument("-l", "--location", help="use fixed location for time mode and assistance data")
-    #args=parser.parse_args(["-o","-l", "49.634584546, 8.631469629, 148.6396,1.000"])
-    #args=parser.parse_args(["-a", "-l" , "HP","-t"])
-    args=parser.parse_args()
+def receiver_file(args, option, name):
+    """file of a RECEIVER_FILES option, with several receivers the default file is prefixed with the receiver name"""
+    filename = getattr(args, option)
+    if name and filename == RECEIVER_FILES[option]:
+        return f"{name}_{filename}"
+    return filename
+
+
+def create_streamer(args, name=None, assist=None):
+    """RTKStreamer with its own GPSParser as configured by the command line options in args"""
+    parser_class = RingParser if args.reader_process else GPSParser
+    gpsp = parser_class(port=args.port, baudrate=args.baudrate, name=name, udp_port=args.udp_port)
 
-    gpsp = GPSParser()
-    
     streamer_mode='survey_in'
         
+    position_recorder = None
     if args.output_positions:
-        LOCATION_FILE = args.output_positions
         streamer_mode='output_positions'
+        position_recorder = PositionRecorder(receiver_file(args, 'output_positions', name), args.position_format, flush_interval=args.position_flush, fsync_interval=args.position_fsync,
+            max_bytes=int(args.position_rotate_mb*1e6), rotate_interval=args.position_rotate_hours*3600)
     
     streamer_location=(0,0,0,0)
-    
-    if args.time_difference:
-        TIMEDIFFERENCE_FILE=args.time_difference
-    
-    if args.assistance_file:
-        ASSISTANCE_FILE=args.assistance_file
 
     if args.location:
         if len(args.location.split(","))==4:
@@ -477,19 +877,196 @@ def main():
             streamer_location = (lat,lon,height,acc)
             streamer_mode="fixed"
         else :
-            try:
-                streamer_location = get_location_from_file(args.location)
-                streamer_mode="fixed"
-            except RuntimeError as e:
-                print(e)
-                return
-
-    rtk_streamer= RTKStreamer(gpsp, mode=streamer_mode, survey_in=args.survey_in, time_difference=args.time_difference, assistance_file=args.assistance_file, location=streamer_location)
-    try: 
-        rtk_streamer.run()
+            streamer_location = get_location_from_file(args.location)
+            streamer_mode="fixed"
+
+    antenna_catalog = None
+    if args.nearest_antenna and streamer_mode == 'survey_in':
+        antenna_catalog = load_catalog(ANTENNA_FILE)
+
+    tap = FrameTap(gpsp, args.tap) if args.tap else None
+    survey_estimator = None
+    nav_database = None
+    if args.nav_database:
+        nav_database = NavDatabase(receiver_file(args, 'nav_database', name), args.nav_database_interval, first_delay=min(300, args.nav_database_interval))
+
+    receiver_monitor = None
+    if args.receiver_monitor:
+        receiver_monitor = ReceiverMonitor(args.receiver_monitor, max_level=len(RTCM_STEP_DOWN)-1 if args.step_down else 0)
+
+    sky_view = SkyView(args.sky_view, args.sky_history) if args.sky_view else None
+    survey_store = None
+    if args.persist_survey:
+        survey_store = SurveyStore(receiver_file(args, 'persist_survey', name), args.survey_max_age*86400)
+
+    latency = LatencyCalibration(None, args.latency)
+    if args.calibrate_latency:
+        if args.ntp_shm is not None:
+            # the samples would contain the offset of the clock that the SHM unit disciplines
+            logger.warning(f"RTK Streamer | Not calibrating the latency while --ntp_shm is active, using {args.latency*1000:.1f}ms")
+        else:
+            latency = LatencyCalibration(receiver_file(args, 'calibrate_latency', name), args.latency)
+
+    baudrates = ()
+    if args.link_speed != 'off':
+        baudrates = sorted((int(b) for b in args.link_speed.split(",")), reverse=True)
+
+    if args.own_survey:
+        survey_duration, survey_acc = args.survey_in.split(",")
+        survey_estimator = SurveyEstimator(int(survey_duration), float(survey_acc))
+
+    return RTKStreamer(gpsp, mode=streamer_mode, survey_in=args.survey_in, time_difference=receiver_file(args, 'time_difference', name), assistance_file=args.assistance_file, location=streamer_location, position_recorder=position_recorder, ntp_shm_unit=args.ntp_shm, time_difference_interval=args.time_difference_interval, survey_estimator=survey_estimator, save_config=args.save_config, baudrates=baudrates, nav_database=nav_database, unique_id=args.unique_id, assist=assist, tap=tap, svin_log_interval=args.svin_log_interval, receiver_monitor=receiver_monitor, sky_view=sky_view, latency=latency, survey_store=survey_store, antenna_catalog=antenna_catalog, antenna_tolerance=args.nearest_antenna or 10.0)
+
+
+def receiver_options(parser, section):
+    """command line options of a receiver section, keys are long option names, flags take true/yes/on"""
+    flags = {option for action in parser._actions if action.nargs == 0 for option in action.option_strings}
+    options = []
+    for key, value in section.items():
+        option = f"--{key}"
+        if option in flags:
+            if value and value.lower() in ('true', 'yes', 'on', '1'):
+                options.append(option)
+        elif value is None or value == '':
+            options.append(option)
+        else:
+            options += [option, value]
+    return options
+
+
+def check_receiver_resources(receivers):
+    """
+    receivers: name -> parsed options. Raises RuntimeError if several receivers
+    would broadcast to the same UDP port, serve the same tap socket or write
+    the same file, rovers would get the corrections of both bases interleaved
+    """
+    owners = {}
+    for name, args in receivers.items():
+        resources = [('UDP port', args.udp_port), ('tap socket', args.tap)]
+        resources += [(f"--{option} file", receiver_file(args, option, name)) for option in RECEIVER_FILES]
+        for kind, value in resources:
+            if value is None:
+                continue
+            key = os.path.abspath(value) if kind != 'UDP port' else value
+            if key in owners:
+                raise RuntimeError(f"{kind} {value} is used by receivers {owners[key]} and {name}, set it in each section of the receivers file")
+            owners[key] = name
+
+
+def run_receivers(parser, args):
+    """
+    one streamer per section of the receivers file, their serial ports are
+    serviced by one DeviceMultiplexer thread
+    """
+    config = configparser.ConfigParser(allow_no_value=True)
+    if not config.read(args.receivers) or not config.sections():
+        raise RuntimeError(f"No receivers found in {args.receivers}")
+
+    # the download thread is shared, every receiver updates its location
+    assist = UBXAssistOnline((0,0,0,0), args.assistance_file) if args.assistance_file else None
+    # the global options apply to every receiver, the section overrides them
+    receivers = {name: parser.parse_args(sys.argv[1:] + receiver_options(parser, config[name])) for name in config.sections()}
+    check_receiver_resources(receivers)
+    streamers = {name: create_streamer(receiver_args, name, assist) for name, receiver_args in receivers.items()}
+
+    # receivers with an own reader process are not multiplexed
+    mux = None
+    parsers = [streamer.gpsp for streamer in streamers.values() if not isinstance(streamer.gpsp, RingParser)]
+    if parsers:
+        mux = DeviceMultiplexer(parsers)
+        # kill -USR1 <pid> starts / stops a cProfile capture of the multiplexer thread
+        signal.signal(signal.SIGUSR1, mux.profiler.toggle)
+        mux.start()
+    if assist:
+        assist.start()
+    threads = [threading.Thread(target=streamer.run, name=name) for name, streamer in streamers.items()]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
     except KeyboardInterrupt:
-        rtk_streamer.stop()
+        pass
+    for streamer in streamers.values():
+        streamer.stop()
+    for thread in threads:
+        thread.join()
+    if mux:
+        mux.stop()
+    if assist and assist.is_alive():
+        assist.stop()
 
 
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output_positions", help="output positions", nargs="?", const=LOCATION_FILE)
+    parser.add_argument("--position_format", help="record format of output positions", choices=["csv", "bin"], default="csv")
+    parser.add_argument("--position_flush", help="seconds positions are buffered before writing", type=float, default=1.0)
+    parser.add_argument("--position_fsync", help="seconds between fsync of the position file, 0 = never", type=float, default=60.0)
+    parser.add_argument("--position_rotate_mb", help="rotate position file at this size in MB, 0 = never", type=float, default=0)
+    parser.add_argument("--position_rotate_hours", help="rotate position file after this many hours, 0 = never", type=float, default=0)
+    parser.add_argument("-a", "--assistance_file", help="regulary update online assistance data", nargs="?", const=ASSISTANCE_FILE)
+    parser.add_argument("--nav_database", help="regulary dump the navigation database of the receiver to file and restore it after resets", nargs="?", const=NAV_DATABASE_FILE)
+    parser.add_argument("--nav_database_interval", help="seconds between dumps of the navigation database", type=float, default=1800)
+    parser.add_argument("-t", "--time_difference", help="regulary store difference to local time in file", nargs="?", const=TIMEDIFFERENCE_FILE)
+    parser.add_argument("--time_difference_interval", help="minimum seconds between updates of the time difference file", type=float, default=1.0)
+    parser.add_argument("--latency", help="seconds from a GNSS epoch to the arrival of its NAV-PVT", type=float, default=LATENCY)
+    parser.add_argument("--calibrate_latency", help=f"calibrate the latency against the system clock (synchronized by another source) and store it in file, default {LATENCY_FILE}", nargs="?", const=LATENCY_FILE)
+    parser.add_argument("--ntp_shm", help="write GNSS time samples to NTP SHM unit for chrony/ntpd", nargs="?", type=int, const=2)
+    parser.add_argument("-s", "--survey_in", help="use position surveying, default mode",  nargs="?", const="200,2.0", default="180,2.0")
+    parser.add_argument("--persist_survey", help="store the result of a survey-in and start later runs in fixed mode at it if receiver and antenna are unchanged", nargs="?", const=SURVEY_FILE)
+    parser.add_argument("--survey_max_age", help="days a stored survey position is used", type=float, default=30)
+    parser.add_argument("--own_survey", help="run an own survey-in on NAV-HPPOSLLH with the -s parameters and switch to fixed mode once it converges", action="store_true")
+    parser.add_argument("--save_config", help="store confirmed receiver profiles in battery backed RAM and/or flash", choices=["none", "bbr", "flash"], default="bbr")
+    parser.add_argument("--nearest_antenna", help=f"use the registered antenna of {ANTENNA_FILE} nearest to the first navigation fix within N m (default 10) for fixed mode, survey-in if there is none", nargs="?", type=float, const=10.0)
+    parser.add_argument("-l", "--location", help="use fixed location for time mode and assistance data")
+    parser.add_argument("-p", "--port", help="serial port of the GPS device instead of scanning USB for a ublox M8P")
+    parser.add_argument("-b", "--baudrate", help="initial baudrate of a UART connected receiver", type=int, default=115200)
+    parser.add_argument("--link_speed", help="raise the baudrate of a UART link to the highest of these rates that works, off = keep", default="921600,460800,230400")
+    parser.add_argument("--unique_id", help="only use the receiver with this UBX-SEC-UNIQID (hex), others are skipped")
+    parser.add_argument("--udp_port", help="UDP port the RTCM data is broadcast to", type=int, default=10777)
+    parser.add_argument("--reader_process", help="read and frame the serial port in a separate process that forwards RTCM itself, frames reach the controller via shared memory", action="store_true")
+    parser.add_argument("--tap", help="serve the receiver's frames to local consumers on this unix socket, they subscribe with a line of protocols / message types")
+    parser.add_argument("--receivers", help="run several receivers in one process, ini file with one section of long options per receiver")
+    parser.add_argument("--receiver_monitor", help="seconds between polls of the receiver's port buffers (MON-TXBUF/RXBUF/IO/COMMS), 0 = off", type=float, default=10)
+    parser.add_argument("--step_down", help="lower the rates of RTCM messages while the receiver's TX buffer overflows instead of only warning", action="store_true")
+    parser.add_argument("--sky_view", help="request NAV-SAT every N epochs and track C/N0, elevation and use per satellite", nargs="?", type=int, const=1, default=0)
+    parser.add_argument("--sky_history", help="epochs of C/N0 kept per satellite", type=int, default=600)
+    parser.add_argument("--log_file", help="log file, rotated at --log_max_mb", default=LOG_FILE)
+    parser.add_argument("--log_max_mb", help="rotate the log file at this size in MB, 0 = never", type=float, default=10)
+    parser.add_argument("--log_backups", help="number of rotated log files kept", type=int, default=5)
+    parser.add_argument("--svin_log_interval", help="seconds between logged SVIN status lines, state changes are always logged", type=float, default=30.0)
+    parser.add_argument("-m", "--metrics", help="serve Prometheus metrics on host:port or a unix socket path", nargs="?", const="127.0.0.1:9108")
+    #args=parser.parse_args(["-o","-l", "49.634584546, 8.631469629, 148.6396,1.000"])
+    #args=parser.parse_args(["-a", "-l" , "HP","-t"])
+    args=parser.parse_args()
+
+    # in the receivers mode the log lines carry the receiver as thread name
+    log_listener = setup_logging(args.log_file, int(args.log_max_mb*1024*1024), args.log_backups,
+        log_format=THREAD_LOG_FORMAT if args.receivers else LOG_FORMAT, multiprocess=args.reader_process)
+
+    metrics_server = None
+    if args.metrics:
+        metrics_server = MetricsServer(args.metrics)
+        metrics_server.start()
+
+    try:
+        if args.receivers:
+            run_receivers(parser, args)
+        else:
+            rtk_streamer = create_streamer(args)
+            # kill -USR1 <pid> starts / stops a cProfile capture of the reader thread
+            signal.signal(signal.SIGUSR1, rtk_streamer.gpsp.profiler.toggle)
+            try: 
+                rtk_streamer.run()
+            except KeyboardInterrupt:
+                rtk_streamer.stop()
+    except RuntimeError as e:
+        print(e)
+    if metrics_server:
+        metrics_server.stop()
+    stop_logging(log_listener)
+
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
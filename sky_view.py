@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+"""
+Signal quality per satellite at the base from NAV-SAT (and NAV-SIG where the
+receiver sends it).
+
+Every satellite keeps the C/N0 of its last `history` epochs in a preallocated
+ring (array of bytes), an epoch only writes into these rings and keeps the
+decoded arrays of the message. Summaries are computed when the status is
+requested, so tracking stays cheap at 1 Hz over weeks: the number of
+satellites is bounded by the constellations and nothing grows with time.
+"""
+import time
+from array import array
+
+from metrics import METRICS
+from ubxhelper import UBX_NAV_SAT, UBX_NAV_SIG
+
+import logging
+logger = logging.getLogger(__name__)
+
+METRICS.describe("sky_satellites_tracked", "satellites with a signal in the last NAV-SAT", 'gauge')
+METRICS.describe("sky_satellites_used", "satellites used in the navigation solution of the last NAV-SAT", 'gauge')
+METRICS.describe("sky_cno_mean_used", "mean C/N0 in dBHz of the used satellites", 'gauge')
+
+GNSS_NAMES = {0: 'GPS', 1: 'SBAS', 2: 'Galileo', 3: 'BeiDou', 4: 'IMES', 5: 'QZSS', 6: 'GLONASS'}
+GNSS_PREFIXES = {0: 'G', 1: 'S', 2: 'E', 3: 'C', 4: 'I', 5: 'J', 6: 'R'}
+CURRENT = 60  # seconds a satellite stays in the status after it was last seen
+
+
+class SatelliteTrack():
+    __slots__ = ('cno', 'pos', 'count', 'used_epochs', 'last_seen', 'elev', 'azim', 'used')
+
+    def __init__(self, history):
+        self.cno = array('B', bytes(history))
+        self.pos = 0
+        self.count = 0  # epochs seen
+        self.used_epochs = 0
+        self.last_seen = 0
+        self.elev = 0
+        self.azim = 0
+        self.used = 0
+
+    def note(self, cno, elev, azim, used, t):
+        self.cno[self.pos] = cno
+        self.pos += 1
+        if self.pos == len(self.cno):
+            self.pos = 0
+        self.count += 1
+        self.used_epochs += used
+        self.last_seen = t
+        self.elev = elev
+        self.azim = azim
+        self.used = used
+
+    def history(self):
+        """C/N0 values of the ring, oldest first"""
+        if self.count < len(self.cno):
+            return self.cno[:self.pos]
+        return self.cno[self.pos:] + self.cno[:self.pos]
+
+
+class SkyView():
+    def __init__(self, rate=1, history=600):
+        """
+        rate: NAV-SAT is requested every rate-th epoch \n
+        history: epochs of C/N0 kept per satellite
+        """
+        self.rate = rate
+        self.history = history
+        self.satellites = {}  # (gnss id, sv id) -> SatelliteTrack
+        self.last_sat = None  # last NAV-SAT
+        self.last_sig = None  # last NAV-SIG
+
+    def consume(self, msg):
+        """NAV-SAT or NAV-SIG from the controller"""
+        if isinstance(msg, UBX_NAV_SAT) and hasattr(msg, 'cno'):
+            t = msg.time_received
+            satellites = self.satellites
+            for i in range(msg.num_svs):
+                key = (msg.gnss_id[i], msg.sv_id[i])
+                track = satellites.get(key)
+                if track is None:
+                    track = satellites[key] = SatelliteTrack(self.history)
+                track.note(msg.cno[i], msg.elev[i], msg.azim[i], msg.used[i], t)
+            self.last_sat = msg
+        elif isinstance(msg, UBX_NAV_SIG) and hasattr(msg, 'cno'):
+            self.last_sig = msg
+
+    def tracked(self):
+        msg = self.last_sat
+        return sum(1 for cno in msg.cno if cno) if msg else 0
+
+    def used(self):
+        msg = self.last_sat
+        return sum(msg.used) if msg else 0
+
+    def cno_mean_used(self):
+        msg = self.last_sat
+        if not msg:
+            return 0.0
+        used = [cno for cno, used in zip(msg.cno, msg.used) if used]
+        return sum(used)/len(used) if used else 0.0
+
+    def register_metrics(self, labels):
+        METRICS.register_gauge('sky_satellites_tracked', self.tracked, labels)
+        METRICS.register_gauge('sky_satellites_used', self.used, labels)
+        METRICS.register_gauge('sky_cno_mean_used', self.cno_mean_used, labels)
+
+    def snapshot(self, now=None):
+        """summary per constellation and per current satellite for the status API"""
+        now = now or time.time()
+        msg = self.last_sat
+        if not msg:
+            return None
+        by_gnss = {}
+        for gnss_id, cno, used in zip(msg.gnss_id, msg.cno, msg.used):
+            if not cno:
+                continue
+            gnss = by_gnss.setdefault(GNSS_NAMES.get(gnss_id, str(gnss_id)), {'tracked': 0, 'used': 0, 'cno_sum': 0})
+            gnss['tracked'] += 1
+            gnss['used'] += used
+            gnss['cno_sum'] += cno
+        for gnss in by_gnss.values():
+            gnss['cno_mean'] = round(gnss.pop('cno_sum')/gnss['tracked'], 1)
+        satellites = {}
+        for (gnss_id, sv_id), track in list(self.satellites.items()):
+            if now-track.last_seen > CURRENT:
+                continue
+            cno = track.history()
+            seen = [value for value in cno if value]
+            satellites[f"{GNSS_PREFIXES.get(gnss_id, '?')}{sv_id:02d}"] = {
+                'cno': cno[-1] if cno else 0, 'elev': track.elev, 'azim': track.azim, 'used': bool(track.used),
+                'cno_mean': round(sum(seen)/len(seen), 1) if seen else 0, 'cno_min': min(seen, default=0),
+                'used_ratio': round(track.used_epochs/track.count, 3), 'epochs': track.count,
+            }
+        result = {
+            'age_s': round(now-msg.time_received, 1),
+            'tracked': self.tracked(),
+            'used': self.used(),
+            'cno_mean_used': round(self.cno_mean_used(), 1),
+            'gnss': by_gnss,
+            'satellites': satellites,
+        }
+        sig = self.last_sig
+        if sig and now-sig.time_received <= CURRENT:
+            result['signals'] = [
+                {'sv': f"{GNSS_PREFIXES.get(sig.gnss_id[i], '?')}{sig.sv_id[i]:02d}", 'sig_id': sig.sig_id[i], 'cno': sig.cno[i],
+                    'quality': sig.quality[i], 'used': bool(sig.used[i])}
+                for i in range(sig.num_sigs) if sig.cno[i]]
+        return result
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+"""
+In-process survey-in from high precision position fixes.
+
+Mean and covariance are updated with Welford's online algorithm in ECEF,
+relative to the first accepted fix to keep full float precision, so memory
+stays constant however long the survey runs.
+
+GNSS position errors are correlated over minutes, the accuracy of the mean is
+therefore computed from the number of independent samples
+duration/correlation_time and not from the number of fixes.
+"""
+import math
+
+from geodesy import ecef_to_llh, llh_to_ecef
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SurveyEstimator():
+    def __init__(self, min_duration=180, target_acc=2.0, max_fix_acc=5.0, outlier_sigma=5.0, min_outlier_dist=0.5, correlation_time=60.0, warmup=30):
+        """
+        min_duration: seconds of accepted fixes before convergence is possible \n
+        target_acc: required 3D accuracy of the mean in m \n
+        max_fix_acc: fixes with a worse reported accuracy in m are ignored \n
+        outlier_sigma / min_outlier_dist: fixes further than max(sigma*outlier_sigma, min_outlier_dist) from the mean are rejected \n
+        correlation_time: seconds after which fixes are treated as independent \n
+        warmup: number of fixes before outliers are rejected
+        """
+        self.min_duration = min_duration
+        self.target_acc = target_acc
+        self.max_fix_acc = max_fix_acc
+        self.outlier_sigma = outlier_sigma
+        self.min_outlier_dist = min_outlier_dist
+        self.correlation_time = correlation_time
+        self.warmup = warmup
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.rejected = 0
+        self.reference = None
+        self.mean = [0.0, 0.0, 0.0]
+        self.m2 = [[0.0]*3 for _ in range(3)]
+        self.first_time = 0
+        self.last_time = 0
+
+    def consume(self, msg):
+        """msg: UBX_NAV_HPPOSLLH or UBX_NAV_HPPOSECEF, returns True if the fix was accepted"""
+        if msg.invalid:
+            return False
+        if msg.msg_type == 'NAV-HPPOSECEF':
+            ecef = (msg.x, msg.y, msg.z)
+            acc = msg.pAcc
+        else:
+            ecef = llh_to_ecef(msg.lat, msg.lon, msg.height)
+            acc = math.hypot(msg.hAcc, msg.vAcc)
+        if acc > self.max_fix_acc:
+            self.rejected += 1
+            return False
+        return self.add(ecef, msg.time_received)
+
+    def add(self, ecef, t):
+        if self.reference is None:
+            self.reference = ecef
+            self.first_time = t
+        x = [ecef[i]-self.reference[i] for i in range(3)]
+
+        if self.n >= self.warmup:
+            dist = math.sqrt(sum((x[i]-self.mean[i])**2 for i in range(3)))
+            if dist > max(self.outlier_sigma*self.sigma(), self.min_outlier_dist):
+                self.rejected += 1
+                return False
+
+        self.n += 1
+        delta = [x[i]-self.mean[i] for i in range(3)]
+        for i in range(3):
+            self.mean[i] += delta[i]/self.n
+        delta2 = [x[i]-self.mean[i] for i in range(3)]
+        for i in range(3):
+            for j in range(3):
+                self.m2[i][j] += delta[i]*delta2[j]
+        self.last_time = t
+        return True
+
+    def covariance(self):
+        """sample covariance of the fixes in m^2, ECEF axes"""
+        if self.n < 2:
+            return [[0.0]*3 for _ in range(3)]
+        return [[self.m2[i][j]/(self.n-1) for j in range(3)] for i in range(3)]
+
+    def sigma(self):
+        """3D standard deviation of a single fix in m"""
+        cov = self.covariance()
+        return math.sqrt(cov[0][0]+cov[1][1]+cov[2][2])
+
+    def duration(self):
+        return self.last_time-self.first_time
+
+    def mean_acc(self):
+        """3D accuracy of the mean in m"""
+        if self.n < 2:
+            return float('inf')
+        independent = max(1.0, min(self.n, self.duration()/self.correlation_time))
+        return self.sigma()/math.sqrt(independent)
+
+    def converged(self):
+        return self.duration() >= self.min_duration and self.mean_acc() <= self.target_acc
+
+    def mean_ecef(self):
+        return tuple(self.reference[i]+self.mean[i] for i in range(3))
+
+    def result(self):
+        """location tuple (lat, lon, height, acc) as used by RTKStreamer.start_time_mode"""
+        lat, lon, height = ecef_to_llh(*self.mean_ecef())
+        return (lat, lon, height, self.mean_acc())
+
+    def status(self):
+        return f"Dur: {self.duration():.0f}s, Acc: {self.mean_acc():.3f}m, Fixes: {self.n}, Rejected: {self.rejected}, Converged: {int(self.converged())}"
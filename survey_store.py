@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+"""
+Surveyed antenna position kept across restarts.
+
+When a survey-in completes, its mean position is stored with the unique id of
+the receiver, the accuracy and the time. On the next start in survey_in mode
+the position is used for fixed mode right away if
+
+- it was surveyed by the same receiver (SEC-UNIQID),
+- it is not older than max_age and
+- the antenna did not move: a navigation fix of the receiver lies within
+  max(tolerance, 3 * its accuracy) of the stored position.
+
+Otherwise the receiver surveys again and the new result replaces the old.
+The file is JSON and replaced atomically.
+"""
+import json
+import time
+
+from geodesy import ecef_distance, llh_to_ecef
+from time_output import write_file_atomic
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SurveyStore():
+    def __init__(self, filename, max_age=30*86400, tolerance=5.0, verify_timeout=30.0):
+        """
+        filename: JSON file of the stored position \n
+        max_age: seconds a surveyed position is used \n
+        tolerance: m a navigation fix may differ from the stored position at least \n
+        verify_timeout: seconds to wait for the navigation fix that confirms the antenna position
+        """
+        self.filename = filename
+        self.max_age = max_age
+        self.tolerance = tolerance
+        self.verify_timeout = verify_timeout
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            logger.warning(f"SurveyStore | {self.filename} is not readable: {e}")
+            return None
+
+    def store(self, location, receiver_id, duration, source):
+        """location: (lat, lon, height, acc), duration: seconds the survey took"""
+        lat, lon, height, acc = location
+        content = {'lat': lat, 'lon': lon, 'height': height, 'acc': acc, 'unique_id': receiver_id,
+            'surveyed': time.time(), 'duration': duration, 'source': source}
+        write_file_atomic(self.filename, json.dumps(content, indent=1) + "\n")
+        logger.info(f"SurveyStore | Stored {lat:.9f}, {lon:.9f}, {height:.4f} acc {acc:.3f}m of receiver {receiver_id} in {self.filename}")
+
+    def usable(self, receiver_id):
+        """stored location (lat, lon, height, acc) if it belongs to this receiver and is recent enough, else None"""
+        stored = self.load()
+        if not stored:
+            return None
+        if not receiver_id or stored.get('unique_id') != receiver_id:
+            logger.info(f"SurveyStore | Stored position belongs to receiver {stored.get('unique_id')}, not to {receiver_id}")
+            return None
+        age = time.time()-stored['surveyed']
+        if age > self.max_age:
+            logger.info(f"SurveyStore | Stored position is {age/86400:.1f} days old, surveying again")
+            return None
+        return (stored['lat'], stored['lon'], stored['height'], stored['acc'])
+
+    def verify(self, location, fix):
+        """fix: UBX_NAV_PVT with a 3D fix or None, True if the antenna is still at location"""
+        if not fix:
+            logger.info(f"SurveyStore | No navigation fix within {self.verify_timeout:.0f}s to confirm the antenna position")
+            return False
+        lat, lon, height, acc = location
+        distance = ecef_distance(llh_to_ecef(lat, lon, height), llh_to_ecef(fix.lat, fix.lon, fix.height))
+        limit = max(self.tolerance, 3*max(fix.hAcc, fix.vAcc))
+        if distance > limit:
+            logger.warning(f"SurveyStore | Navigation fix is {distance:.1f}m from the stored position (limit {limit:.1f}m), antenna moved")
+            return False
+        logger.info(f"SurveyStore | Navigation fix {distance:.1f}m from the stored position (limit {limit:.1f}m), antenna unchanged")
+        return True
@@ -0,0 +1,261 @@
+#! /usr/bin/env python
+"""
+Tests of the assistance data cache and its download thread against a local
+HTTP stub server. Run with python -m pytest or python -m unittest.
+"""
+import http.server
+import os
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+from assistance_cache import AssistanceCache, WEEK, GPS_EPOCH, GPS_LEAP_SECONDS, ephemeris_validity, gps_time_of_week
+from UBXAssistOnline import UBXAssistOnline
+from ubxhelper import UBXMSG, UBX_MGA_GPS_EPH
+
+DAY = 86400
+
+
+def mga_gps_eph(sv_id, toe_time, health=0):
+    """MGA-GPS-EPH frame with toe at the unix time toe_time (4 h fit interval)"""
+    payload = bytearray(68)
+    payload[0] = 0x01
+    payload[2] = sv_id
+    payload[6] = health
+    payload[40:42] = struct.pack('<H', int(gps_time_of_week(toe_time)//16))
+    msg = UBXMSG()
+    msg.class_ID = UBX_MGA_GPS_EPH.class_ID
+    msg.msg_ID = UBX_MGA_GPS_EPH.msg_ID
+    msg.payload = bytes(payload)
+    return msg.serialize()
+
+
+def download(toe_time, sv_ids=range(1, 13)):
+    return b''.join(mga_gps_eph(sv_id, toe_time) for sv_id in sv_ids)
+
+
+class AssistanceCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "assistance_data.ubx")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_file(self, data, mtime):
+        with open(self.filename, 'wb') as f:
+            f.write(data)
+        os.utime(self.filename, (mtime, mtime))
+
+    def test_fresh_file_is_used(self):
+        now = time.time()
+        self.write_file(download(now-1800), now-3600)
+        cache = AssistanceCache(self.filename)
+        cache.load()
+        self.assertEqual(len(cache.valid_satellites(now)), 12)
+        valid_from, valid_until, _ = cache.ephemerides[1]
+        self.assertAlmostEqual(valid_until, now-1800+2*3600, delta=16)
+
+    def test_stale_file_is_dropped_and_replaced(self):
+        now = time.time()
+        # 5 days old: resolved against the current time toe would lie ~2 days in the future
+        self.write_file(download(now-5*DAY), now-5*DAY)
+        cache = AssistanceCache(self.filename)
+        cache.load()
+        self.assertEqual(cache.ephemerides, {})
+        self.assertEqual(cache.next_fetch(now), now)
+        self.assertEqual(cache.update(download(now-600), now=now), 12)
+        self.assertEqual(len(cache.valid_satellites(now)), 12)
+
+    def test_future_ephemeris_is_not_cached(self):
+        now = time.time()
+        cache = AssistanceCache(self.filename)
+        # old data resolved against the current time puts toe about 2 days ahead
+        self.assertEqual(cache.update(download(now-5*DAY), now, now), 0)
+        self.assertEqual(cache.ephemerides, {})
+
+    def test_same_toe_is_replaced_by_newer_download(self):
+        now = time.time()
+        cache = AssistanceCache(self.filename)
+        self.assertEqual(cache.update(download(now), now=now), 12)
+        frame = mga_gps_eph(1, now)
+        self.assertEqual(cache.update(frame, now=now), 0)
+        self.assertEqual(cache.ephemerides[1][2], frame)
+
+    def test_gps_week_rollover(self):
+        week_start = GPS_EPOCH - GPS_LEAP_SECONDS + 2200*WEEK
+        # downloaded 5 min into the new week, toe 1 h before the week ended
+        now = week_start + 300
+        toe_time = week_start - 3600
+        eph = UBX_MGA_GPS_EPH(mga_gps_eph(5, toe_time))
+        self.assertGreater(eph.toe, WEEK - 2*3600)
+        valid_from, valid_until = ephemeris_validity(eph, now)
+        self.assertAlmostEqual(valid_from, toe_time-2*3600, delta=16)
+        self.assertAlmostEqual(valid_until, toe_time+2*3600, delta=16)
+
+        cache = AssistanceCache(self.filename)
+        self.assertEqual(cache.update(download(toe_time), now, now), 12)
+        self.assertEqual(len(cache.valid_satellites(now)), 12)
+        reloaded = AssistanceCache(self.filename)
+        with unittest.mock.patch('time.time', return_value=now):
+            cache.save()
+            os.utime(self.filename, (now, now))
+            reloaded.load()
+        self.assertEqual(reloaded.ephemerides.keys(), cache.ephemerides.keys())
+        self.assertAlmostEqual(reloaded.ephemerides[5][1], toe_time+2*3600, delta=16)
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        if server.on_request:
+            server.on_request()
+        if server.status != 200:
+            self.send_error(server.status)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UBXAssistOnlineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "assistance_data.ubx")
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.server.status = 200
+        self.server.body = b''
+        self.server.on_request = None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/GetOnlineData.ashx"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def assist(self, min_interval=600):
+        return UBXAssistOnline((0, 0, 0, 0), self.filename, service_url=self.url, timeout=5, min_interval=min_interval)
+
+    def run_thread(self, assist, *locations, requests=1, timeout=2):
+        """runs the download thread until requests downloads were made or timeout"""
+        assist.keep_running = True  # no token file here
+        assist.start()
+        for location in locations:
+            assist.update_location(location)
+        deadline = time.time() + timeout
+        while len(self.server.requests) < requests and time.time() < deadline:
+            time.sleep(0.05)
+        assist.stop()
+        assist.join(5)
+
+    def test_download_is_cached_and_scheduled(self):
+        now = time.time()
+        self.server.body = download(now-600)
+        assist = self.assist()
+        assist.update_assistance_data()
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(assist.cache.valid_satellites()), 12)
+        self.assertGreaterEqual(assist.next_fetch, now + assist.min_interval)
+        self.assertEqual(os.path.getsize(self.filename), len(self.server.body))
+
+    def test_stale_file_does_not_block_download(self):
+        now = time.time()
+        self.write_stale_file(now)
+        self.server.body = download(now-600)
+        assist = self.assist()
+        self.assertEqual(assist.cache.ephemerides, {})
+        assist.update_assistance_data()
+        self.assertEqual(len(assist.cache.valid_satellites()), 12)
+
+    def write_cached_file(self, now, location=None):
+        with open(self.filename, 'wb') as f:
+            f.write(download(now-1800))
+        os.utime(self.filename, (now-1800, now-1800))
+        if location:
+            with open(f"{self.filename}.location", 'w') as f:
+                f.write("{},{},{}".format(*location))
+
+    def test_fresh_file_is_used_after_restart(self):
+        now = time.time()
+        self.write_cached_file(now, (49.6, 8.6, 150.0))
+        self.server.body = download(now-600)
+        assist = self.assist()
+        self.assertAlmostEqual(assist.next_fetch, assist.cache.next_fetch(), delta=1)
+        self.assertGreater(assist.next_fetch, now + 3000)
+        # a fix near the location of the cached download does not trigger one
+        self.run_thread(assist, (49.61, 8.61, 150.0, 10.0), timeout=1)
+        self.assertEqual(self.server.requests, [])
+
+    def test_location_far_from_cached_download_triggers_download(self):
+        now = time.time()
+        self.write_cached_file(now, (49.6, 8.6, 150.0))
+        self.server.body = download(now-600)
+        self.run_thread(self.assist(), (52.5, 13.4, 40.0, 10.0))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertIn("lat=52.500000", self.server.requests[0])
+        with open(f"{self.filename}.location") as f:
+            self.assertEqual(f.read(), "52.500000,13.400000,40.000\n")
+
+    def test_cached_download_without_position_triggers_download(self):
+        now = time.time()
+        self.write_cached_file(now)
+        self.server.body = download(now-600)
+        self.run_thread(self.assist(), (49.6, 8.6, 150.0, 10.0))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_location_change_waits_for_min_interval(self):
+        now = time.time()
+        self.server.body = download(now-600)
+        assist = self.assist()
+        assist.update_assistance_data()
+        self.run_thread(assist, (52.5, 13.4, 40.0, 10.0), requests=2, timeout=1)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def write_stale_file(self, now):
+        with open(self.filename, 'wb') as f:
+            f.write(download(now-5*DAY))
+        os.utime(self.filename, (now-5*DAY, now-5*DAY))
+
+    def test_failure_backs_off_and_keeps_cache(self):
+        now = time.time()
+        self.server.body = download(now-600)
+        assist = self.assist()
+        assist.update_assistance_data()
+        self.server.status = 503
+        assist.update_assistance_data()
+        assist.update_assistance_data()
+        self.assertEqual(assist.failures, 2)
+        self.assertGreater(assist.next_fetch, time.time() + 0.8*2*assist.retry_interval - 1)
+        self.assertEqual(len(assist.cache.valid_satellites()), 12)
+
+    def test_location_change_during_download_is_not_lost(self):
+        now = time.time()
+        self.server.body = download(now-600)
+        assist = self.assist(min_interval=0)
+        assist.keep_running = True  # no token file here
+        assist.update_location((49.6, 8.6, 150.0, 10.0))
+        moved = (52.5, 13.4, 40.0, 10.0)
+        # the controller reports a new location while the first download runs
+        self.server.on_request = lambda: len(self.server.requests) == 1 and assist.update_location(moved)
+        assist.start()
+        deadline = time.time() + 5
+        while len(self.server.requests) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assist.stop()
+        assist.join(5)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn("lat=52.500000", self.server.requests[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
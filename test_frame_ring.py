@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+"""
+Tests of the shared memory frame ring. Run with python -m pytest or
+python -m unittest.
+"""
+import pickle
+import unittest
+
+from frame_ring import FrameRing
+
+
+def frame(n, length=100):
+    return n.to_bytes(4, 'little') + bytes(length-4)
+
+
+class FrameRingTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = FrameRing(slots=8, capacity=1000)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_frames_are_read_in_order(self):
+        reader = self.ring.reader()
+        for n in range(5):
+            self.ring.put(frame(n), 1000.0+n)
+        self.assertEqual(reader.read(), [(frame(n), 1000.0+n) for n in range(5)])
+        self.assertEqual(reader.read(), [])
+        self.assertEqual(reader.lost, 0)
+
+    def test_data_wraps_around_without_splitting_a_frame(self):
+        reader = self.ring.reader()
+        frames = []
+        # 9 frames of 300 bytes do not fit 3 per 1000 bytes, each round skips the last 100
+        for n in range(9):
+            frames.append(frame(n, 300))
+            self.ring.put(frames[-1], n)
+            self.assertEqual(reader.read(), [(frames[-1], n)])
+        self.assertEqual(self.ring.write_pos, 2*1000 + 3*300)
+        self.assertEqual(reader.lost, 0)
+
+    def test_lagging_reader_loses_overwritten_slots(self):
+        reader = self.ring.reader()
+        for n in range(20):
+            self.ring.put(frame(n, 50), n)
+        # of 8 slots the oldest may be rewritten by the next put, 7 frames are left
+        self.assertEqual([time for _, time in reader.read()], list(range(13, 20)))
+        self.assertEqual(reader.lost, 13)
+
+    def test_lagging_reader_loses_overwritten_data(self):
+        reader = self.ring.reader()
+        for n in range(5):
+            self.ring.put(frame(n, 400), n)
+        # the slots are still there but 1000 bytes only hold the data of the last 2 frames
+        frames = reader.read()
+        self.assertEqual([time for _, time in frames], [3, 4])
+        self.assertEqual(frames[0][0], frame(3, 400))
+        self.assertEqual(reader.lost, 3)
+
+    def test_reader_starts_with_the_next_frame(self):
+        self.ring.put(frame(0), 0)
+        reader = self.ring.reader()
+        self.ring.put(frame(1), 1)
+        self.assertEqual(reader.read(), [(frame(1), 1)])
+
+    def test_oversized_frame_is_refused(self):
+        self.assertFalse(self.ring.put(bytes(1001), 0))
+
+    def test_pickled_ring_attaches_by_name(self):
+        reader = self.ring.reader()
+        self.ring.put(frame(0), 0)
+        attached = pickle.loads(pickle.dumps(self.ring))
+        try:
+            self.assertFalse(attached.owner)
+            self.assertEqual((attached.slots, attached.capacity), (8, 1000))
+            # the attached writer continues after the frames published so far
+            attached.put(frame(1), 1)
+            self.assertEqual(reader.read(), [(frame(0), 0), (frame(1), 1)])
+        finally:
+            attached.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+"""
+Tests of the buffered position sink: rotation, the binary record layout and
+keeping records of failed writes. Run with python -m pytest or
+python -m unittest, the binary tests need numpy.
+"""
+import glob
+import os
+import tempfile
+import time
+import types
+import unittest
+import unittest.mock
+
+from position_recorder import BINARY_RECORD, PositionRecorder, load_binary
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def position(n):
+    """stands in for an UBX_NAV_HPPOSLLH"""
+    return types.SimpleNamespace(time_received=1700000000.0+n, lat=49.6+n*1e-7, lon=8.6+n*1e-7, height=150.0+n*0.001,
+                                 hMSL=100.0+n*0.001, hAcc=0.014, vAcc=0.02, itow=1000*n, invalid=n % 2)
+
+
+def csv_line(n):
+    msg = position(n)
+    return f"{msg.time_received}, {msg.lat:0.9f}, {msg.lon:.9f}, {msg.height:0.4f}\n"
+
+
+class ShortFile():
+    """file whose writes only take limit bytes"""
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = b''
+
+    def write(self, data):
+        self.data += data[:self.limit]
+        return min(len(data), self.limit)
+
+    def fileno(self):
+        raise OSError("no descriptor")
+
+    def close(self):
+        pass
+
+
+class PositionRecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "positions.csv")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, filename=None):
+        with open(filename or self.filename, 'r') as f:
+            return f.read()
+
+    def all_files(self):
+        """content of the rotated files and the current one, oldest first"""
+        base, ext = os.path.splitext(self.filename)
+        files = sorted(glob.glob(f"{base}_*{ext}"), key=os.path.getmtime) + [self.filename]
+        return [self.read(filename) for filename in files if os.path.exists(filename)]
+
+    def test_records_are_buffered_until_flush(self):
+        recorder = PositionRecorder(self.filename, buffer_records=3, flush_interval=60)
+        recorder.write(position(0))
+        recorder.write(position(1))
+        self.assertFalse(os.path.exists(self.filename))
+        recorder.write(position(2))
+        self.assertEqual(self.read(), ''.join(csv_line(n) for n in range(3)))
+        recorder.close()
+
+    def test_rotation_by_size(self):
+        line = len(csv_line(0))
+        recorder = PositionRecorder(self.filename, buffer_records=2, max_bytes=3*line)
+        for n in range(10):
+            recorder.write(position(n))
+            time.sleep(0.01)  # orders the rotated files by mtime
+        recorder.close()
+        files = self.all_files()
+        # a file is rotated by the flush that reaches max_bytes
+        self.assertEqual([len(content) for content in files], [4*line, 4*line, 2*line])
+        self.assertEqual(''.join(files), ''.join(csv_line(n) for n in range(10)))
+
+    def test_rotation_by_time(self):
+        now = time.time()
+        with unittest.mock.patch('time.time', return_value=now):
+            recorder = PositionRecorder(self.filename, buffer_records=1, rotate_interval=3600)
+            recorder.write(position(0))
+        with unittest.mock.patch('time.time', return_value=now+1800):
+            recorder.write(position(1))
+        self.assertEqual(len(self.all_files()), 1)
+        with unittest.mock.patch('time.time', return_value=now+3600):
+            recorder.write(position(2))
+            recorder.write(position(3))
+        recorder.close()
+        self.assertEqual(self.all_files(), [csv_line(0)+csv_line(1)+csv_line(2), csv_line(3)])
+
+    @unittest.skipUnless(numpy, "numpy is not installed")
+    def test_binary_records_are_read_back_with_memmap(self):
+        self.filename = os.path.join(self.directory.name, "positions.bin")
+        recorder = PositionRecorder(self.filename, fmt='bin', buffer_records=4)
+        for n in range(6):
+            recorder.write(position(n))
+        recorder.close()
+        self.assertEqual(os.path.getsize(self.filename), 6*BINARY_RECORD.size)
+        records = load_binary(self.filename)
+        self.assertEqual(len(records), 6)
+        for n, record in enumerate(records):
+            msg = position(n)
+            for field in ('time', 'lat', 'lon', 'height', 'hMSL'):
+                self.assertEqual(record[field], getattr(msg, 'time_received' if field == 'time' else field))
+            self.assertAlmostEqual(float(record['hAcc']), msg.hAcc, places=6)
+            self.assertAlmostEqual(float(record['vAcc']), msg.vAcc, places=6)
+            self.assertEqual((record['itow'], record['invalid']), (msg.itow, msg.invalid))
+
+    @unittest.skipUnless(numpy, "numpy is not installed")
+    def test_partial_binary_record_is_cut_on_open(self):
+        self.filename = os.path.join(self.directory.name, "positions.bin")
+        with open(self.filename, 'wb') as f:
+            f.write(BINARY_RECORD.pack(0, 1, 2, 3, 4, 5, 6, 7, 0) + b'\x00'*10)
+        recorder = PositionRecorder(self.filename, fmt='bin', buffer_records=1)
+        recorder.write(position(1))
+        recorder.close()
+        self.assertEqual(list(load_binary(self.filename)['itow']), [7, 1000])
+
+    def test_failed_write_is_kept_and_retried(self):
+        recorder = PositionRecorder(self.filename, buffer_records=1)
+        with unittest.mock.patch('position_recorder.open', side_effect=OSError(28, "No space left on device"), create=True):
+            recorder.write(position(0))
+            recorder.write(position(1))
+        self.assertEqual(recorder.pending, (csv_line(0)+csv_line(1)).encode())
+        recorder.write(position(2))
+        recorder.close()
+        self.assertEqual(self.read(), ''.join(csv_line(n) for n in range(3)))
+
+    def test_pending_data_drops_the_oldest_whole_records(self):
+        line = len(csv_line(0))
+        recorder = PositionRecorder(self.filename, buffer_records=1, max_pending=int(2.5*line))
+        with unittest.mock.patch('position_recorder.open', side_effect=OSError(5, "Input/output error"), create=True):
+            for n in range(4):
+                recorder.write(position(n))
+        self.assertEqual(recorder.pending, (csv_line(2)+csv_line(3)).encode())
+        self.assertEqual(recorder.dropped, 2*line)
+        recorder.close()
+        self.assertEqual(self.read(), csv_line(2)+csv_line(3))
+
+    def test_partial_binary_write_keeps_records_aligned(self):
+        recorder = PositionRecorder(os.path.join(self.directory.name, "positions.bin"), fmt='bin', buffer_records=3, fsync_interval=0)
+        recorder.file = ShortFile(BINARY_RECORD.size + 10)
+        for n in range(3):
+            recorder.write(position(n))
+        records = [BINARY_RECORD.pack(*position(n).__dict__.values()) for n in range(3)]
+        # the file got one record and 10 bytes, the retry starts with the second record
+        self.assertEqual(recorder.pending, records[1] + records[2])
+        self.assertIsNone(recorder.file)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+"""
+Tests of the streaming survey-in estimator. Run with python -m pytest or
+python -m unittest.
+"""
+import random
+import types
+import unittest
+
+from geodesy import ecef_distance, llh_to_ecef
+from survey_estimator import SurveyEstimator
+
+LOCATION = (49.634588306, 8.631468147, 149.929)
+
+
+def batch_mean_covariance(points):
+    n = len(points)
+    mean = [sum(p[i] for p in points)/n for i in range(3)]
+    cov = [[sum((p[i]-mean[i])*(p[j]-mean[j]) for p in points)/(n-1) for j in range(3)] for i in range(3)]
+    return mean, cov
+
+
+def hpposllh(lat, lon, height, t, h_acc=0.02, v_acc=0.03, invalid=0):
+    """stands in for an UBX_NAV_HPPOSLLH"""
+    return types.SimpleNamespace(msg_type='NAV-HPPOSLLH', lat=lat, lon=lon, height=height, hAcc=h_acc, vAcc=v_acc,
+                                 invalid=invalid, time_received=t)
+
+
+class SurveyEstimatorTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(1)
+        self.center = llh_to_ecef(*LOCATION)
+
+    def noisy(self, sigma):
+        return tuple(c + self.random.gauss(0, sigma) for c in self.center)
+
+    def test_mean_and_covariance_match_batch_computation(self):
+        estimator = SurveyEstimator(warmup=10**6)
+        points = [self.noisy(0.5) for _ in range(500)]
+        for t, point in enumerate(points):
+            self.assertTrue(estimator.add(point, t))
+        mean, cov = batch_mean_covariance(points)
+        # the estimator works relative to the first fix, ECEF coordinates are ~4e6 m
+        for i in range(3):
+            self.assertAlmostEqual(estimator.mean_ecef()[i], mean[i], delta=1e-6)
+            for j in range(3):
+                self.assertAlmostEqual(estimator.covariance()[i][j], cov[i][j], delta=1e-9)
+        self.assertEqual(estimator.n, 500)
+
+    def test_outliers_are_rejected_only_after_warmup(self):
+        estimator = SurveyEstimator(warmup=20, outlier_sigma=5.0, min_outlier_dist=0.5)
+        outlier = tuple(c + 20.0 for c in self.center)
+        for t in range(19):
+            estimator.add(self.noisy(0.05), t)
+        # still in the warmup, the outlier counts
+        self.assertTrue(estimator.add(outlier, 19))
+        for t in range(20, 100):
+            estimator.add(self.noisy(0.05), t)
+        accepted = estimator.n
+        self.assertFalse(estimator.add(outlier, 100))
+        self.assertEqual((estimator.n, estimator.rejected), (accepted, 1))
+        # within min_outlier_dist even though sigma is larger
+        self.assertTrue(estimator.add(tuple(c + 0.2 for c in estimator.mean_ecef()), 101))
+
+    def test_inaccurate_and_invalid_fixes_are_ignored(self):
+        estimator = SurveyEstimator(max_fix_acc=5.0)
+        self.assertTrue(estimator.consume(hpposllh(*LOCATION, 0)))
+        self.assertFalse(estimator.consume(hpposllh(*LOCATION, 1, h_acc=4.0, v_acc=4.0)))
+        self.assertFalse(estimator.consume(hpposllh(*LOCATION, 2, invalid=1)))
+        self.assertEqual((estimator.n, estimator.rejected), (1, 1))
+
+    def test_converges_on_duration_and_independent_samples(self):
+        estimator = SurveyEstimator(min_duration=180, target_acc=0.5, correlation_time=60)
+        for t in range(0, 170):
+            estimator.add(self.noisy(0.5), t)
+        # enough fixes but not enough duration, sigma of 0.87 m over ~3 independent samples
+        self.assertFalse(estimator.converged())
+        for t in range(170, 1200):
+            estimator.add(self.noisy(0.5), t)
+        self.assertAlmostEqual(estimator.mean_acc(), estimator.sigma()/(1199/60)**0.5)
+        self.assertTrue(estimator.converged())
+        lat, lon, height, acc = estimator.result()
+        self.assertLess(ecef_distance(llh_to_ecef(lat, lon, height), self.center), 0.2)
+        self.assertEqual(acc, estimator.mean_acc())
+
+
+if __name__ == "__main__":
+    unittest.main()
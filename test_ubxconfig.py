@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+"""
+Tests of the ACK tracked configuration transactions against a fake receiver.
+Run with python -m pytest or python -m unittest.
+"""
+import unittest
+
+from ubxconfig import ConfigTransaction, poll, poll_msg_rates
+from ubxhelper import UBXMSG, UBX_ACK_ACK, UBX_ACK_NAK, UBX_CFG_MSG, UBX_CFG_RATE, UBX_CFG_TMODE3
+
+NAV_PVT = b'\x01\x07'
+NAV_SVIN = b'\x01\x3B'
+
+
+def ack(msg: UBXMSG, nak=False):
+    answer = UBX_ACK_NAK() if nak else UBX_ACK_ACK()
+    answer.encode(msg.class_ID, msg.msg_ID)
+    return UBXMSG(answer.buffer)
+
+
+def cfg_msg(msg_id, usb_rate):
+    msg = UBX_CFG_MSG()
+    msg.encode(msg_id, bytes((0, 0, 0, usb_rate, 0, 0)))
+    return msg
+
+
+def cfg_rate(measurement_rate):
+    msg = UBX_CFG_RATE()
+    msg.encode(measurement_rate)
+    return msg
+
+
+class FakeReceiver():
+    """
+    stands in for a GPSParser: answer(msg, attempt) returns the UBX messages
+    the receiver sends for a frame, they are handed to the listeners at once
+    """
+    def __init__(self, answer):
+        self.answer = answer
+        self.listeners = []
+        self.sent = []
+
+    def add_ubx_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_ubx_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def send_to_gps(self, data):
+        self.sent.append(data)
+        msg = UBXMSG(data)
+        for reply in self.answer(msg, self.sent.count(data)):
+            for listener in list(self.listeners):
+                listener(reply)
+
+
+class ConfigTransactionTest(unittest.TestCase):
+    def test_acks_are_matched_by_class_and_id(self):
+        frames = [cfg_rate(1000), cfg_msg(NAV_PVT, 1), UBX_CFG_TMODE3(), cfg_msg(NAV_SVIN, 0)]
+        frames[2].encode_time_mode_off()
+        held = []
+
+        def answer(msg, attempt):
+            held.append(msg)
+            if len(held) < len(frames):
+                return []
+            # all frames are in flight, the ACKs of different class/ID come in another order
+            rate, pvt, tmode3, svin = held
+            return [ack(pvt), ack(tmode3), ack(rate, nak=True), ack(svin)]
+
+        gps = FakeReceiver(answer)
+        transaction = ConfigTransaction(gps, timeout=0.2)
+        for msg in frames:
+            transaction.add(msg)
+        self.assertFalse(transaction.commit())
+        self.assertEqual([frame.result for frame in transaction.frames], ['nak', 'ack', 'ack', 'ack'])
+        self.assertEqual([frame.attempts for frame in transaction.frames], [1, 1, 1, 1])
+        self.assertEqual(gps.listeners, [])
+
+    def test_acks_of_the_same_id_go_to_the_oldest_frame(self):
+        gps = FakeReceiver(lambda msg, attempt: [ack(msg, nak=msg.payload[0:2] == NAV_PVT)])
+        transaction = ConfigTransaction(gps, timeout=0.2).add(cfg_msg(NAV_PVT, 1)).add(cfg_msg(NAV_SVIN, 1))
+        self.assertFalse(transaction.commit())
+        self.assertEqual([frame.result for frame in transaction.frames], ['nak', 'ack'])
+
+    def test_unanswered_frame_is_resent(self):
+        # the first attempt is lost on the link
+        gps = FakeReceiver(lambda msg, attempt: [ack(msg)] if attempt > 1 else [])
+        transaction = ConfigTransaction(gps, timeout=0.05).add(cfg_rate(500))
+        self.assertTrue(transaction.commit())
+        self.assertEqual(transaction.frames[0].attempts, 2)
+        self.assertEqual(len(gps.sent), 2)
+
+    def test_frame_times_out_after_retries(self):
+        gps = FakeReceiver(lambda msg, attempt: [])
+        transaction = ConfigTransaction(gps, timeout=0.05, retries=2).add(cfg_rate(500))
+        self.assertFalse(transaction.commit())
+        self.assertEqual(transaction.frames[0].result, 'timeout')
+        self.assertEqual(len(gps.sent), 3)
+
+    def test_poll_response_comes_before_its_ack(self):
+        gps = FakeReceiver(lambda msg, attempt: [UBXMSG(cfg_rate(200).buffer), ack(msg)])
+        response, = poll(gps, UBX_CFG_RATE())
+        self.assertEqual(response.measurement_rate, 200)
+
+    def test_msg_rates_are_polled_per_message_id(self):
+        rates = {NAV_PVT: 1, NAV_SVIN: 0}
+
+        def answer(msg, attempt):
+            msg_id = msg.payload[0:2]
+            if msg_id not in rates:
+                return [ack(msg, nak=True)]
+            return [UBXMSG(cfg_msg(msg_id, rates[msg_id]).buffer), ack(msg)]
+
+        gps = FakeReceiver(answer)
+        self.assertEqual(poll_msg_rates(gps, [NAV_PVT, NAV_SVIN, b'\x01\x14']), rates)
+
+
+if __name__ == "__main__":
+    unittest.main()
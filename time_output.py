@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+"""
+Outputs of the difference between GNSS time and system time.
+
+NTPSHM writes samples into the shared memory segment read by the ntpd/chrony
+SHM refclock, e.g. in chrony.conf
+
+refclock SHM 2 refid GPS precision 1e-3 offset 0.0
+
+The text file keeps the 20 sample average, written atomically and rate limited.
+
+LatencyCalibration estimates the delay between a GNSS epoch and the arrival
+of its NAV-PVT, which is subtracted from the receive time of every sample.
+"""
+import ctypes
+import os
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+NTPD_BASE = 0x4e545030  # "NTP0"
+IPC_CREAT = 0o1000
+
+
+class ShmTime(ctypes.Structure):
+    """struct shmTime of ntpd refclock_shm.c, time_t is a long on linux"""
+    _fields_ = [
+        ("mode", ctypes.c_int),
+        ("count", ctypes.c_int),
+        ("clockTimeStampSec", ctypes.c_long),
+        ("clockTimeStampUSec", ctypes.c_int),
+        ("receiveTimeStampSec", ctypes.c_long),
+        ("receiveTimeStampUSec", ctypes.c_int),
+        ("leap", ctypes.c_int),
+        ("precision", ctypes.c_int),
+        ("nsamples", ctypes.c_int),
+        ("valid", ctypes.c_int),
+        ("clockTimeStampNSec", ctypes.c_uint),
+        ("receiveTimeStampNSec", ctypes.c_uint),
+        ("dummy", ctypes.c_int*8),
+    ]
+
+
+class NTPSHM():
+    def __init__(self, unit=0, precision=-10):
+        """
+        unit: SHM unit, 0 and 1 are only accessible by root \n
+        precision: log2 of the precision in seconds, -10 is about 1 ms
+        """
+        self.unit = unit
+        perm = 0o600 if unit < 2 else 0o666
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+
+        shm_id = libc.shmget(NTPD_BASE + unit, ctypes.sizeof(ShmTime), IPC_CREAT | perm)
+        if shm_id == -1:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"shmget for NTP SHM unit {unit} failed: {os.strerror(errno)}")
+        address = libc.shmat(shm_id, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"shmat for NTP SHM unit {unit} failed: {os.strerror(errno)}")
+
+        self.shm = ShmTime.from_address(address)
+        self.shm.mode = 1
+        self.shm.precision = precision
+        self.shm.nsamples = 3
+        self.shm.leap = 0
+        logger.info(f"NTPSHM | Attached to NTP SHM unit {unit}")
+
+    def update(self, clock_time, receive_time):
+        """
+        clock_time: true (GNSS) time of the sample \n
+        receive_time: system time at the same instant
+        """
+        clock_ns = int(round(clock_time*1e9))
+        receive_ns = int(round(receive_time*1e9))
+        shm = self.shm
+        # mode 1: readers use the sample only if count did not change while reading
+        shm.valid = 0
+        shm.count += 1
+        shm.clockTimeStampSec, clock_ns = divmod(clock_ns, 1000000000)
+        shm.clockTimeStampUSec = clock_ns//1000
+        shm.clockTimeStampNSec = clock_ns
+        shm.receiveTimeStampSec, receive_ns = divmod(receive_ns, 1000000000)
+        shm.receiveTimeStampUSec = receive_ns//1000
+        shm.receiveTimeStampNSec = receive_ns
+        shm.count += 1
+        shm.valid = 1
+
+
+class RollingAverage():
+    """average of the last n values with O(1) update"""
+    def __init__(self, n=20):
+        self.values = [0]*n
+        self.index = 0
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        self.total += value - self.values[self.index]
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+
+    def average(self):
+        if not self.count:
+            return 0
+        return self.total/self.count
+
+
+def write_file_atomic(filename, content):
+    """readers see the old or the new content, never a partial file. content: str or bytes"""
+    tmp = f"{filename}.tmp"
+    with open(tmp, 'wb' if isinstance(content, bytes) else 'w') as f:
+        f.write(content)
+    os.replace(tmp, filename)
+
+
+class LatencyCalibration():
+    """
+    The arrival delay of an epoch's NAV-PVT is a fixed latency (output delay
+    of the receiver and the bytes sent before it) plus scheduling jitter that
+    is never negative, so the latency is a low quantile of `samples` delays.
+    The system clock has to be synchronized by another source (e.g. network
+    NTP) while calibrating, its offset becomes part of the latency, so never
+    calibrate against a clock that is disciplined by this output. The result
+    is stored in filename and used by later runs, delete the file to
+    calibrate again.
+    """
+    def __init__(self, filename=None, default=0.093, samples=300, quantile=0.1, max_delay=1.0):
+        """
+        filename: file the calibrated latency is stored in, None = do not calibrate, use default \n
+        default: latency in seconds until calibrated \n
+        max_delay: delays outside 0..max_delay seconds mean an unsynchronized clock, they are ignored
+        """
+        self.filename = filename
+        self.value = default
+        self.samples = samples
+        self.quantile = quantile
+        self.max_delay = max_delay
+        self.delays = []
+        self.rejected = 0
+        self.last_delay = 0.0
+        self.calibrated = filename is None or self.load()
+        if not self.calibrated:
+            logger.info(f"LatencyCalibration | Calibrating from {samples} epochs, using {default*1000:.1f}ms until then")
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                self.value = float(f.read())
+        except FileNotFoundError:
+            return False
+        except ValueError:
+            logger.warning(f"LatencyCalibration | {self.filename} holds no latency, calibrating again")
+            return False
+        logger.info(f"LatencyCalibration | Latency {self.value*1000:.1f}ms from {self.filename}")
+        return True
+
+    def add(self, delay):
+        """delay: receive time minus GNSS time of an epoch, returns True when this sample completed the calibration"""
+        self.last_delay = delay
+        if self.calibrated:
+            return False
+        if not 0 <= delay <= self.max_delay:
+            self.rejected += 1
+            if self.rejected == self.samples:
+                logger.warning(f"LatencyCalibration | {self.rejected} delays outside 0..{self.max_delay}s, is the system clock synchronized?")
+            return False
+        self.delays.append(delay)
+        if len(self.delays) < self.samples:
+            return False
+        self.delays.sort()
+        self.value = self.delays[int(len(self.delays)*self.quantile)]
+        median = self.delays[len(self.delays)//2]
+        logger.info(f"LatencyCalibration | Latency {self.value*1000:.1f}ms, median delay {median*1000:.1f}ms, stored in {self.filename}")
+        write_file_atomic(self.filename, f"{self.value:.6f}\n")
+        self.calibrated = True
+        self.delays = []
+        return True
+
+
+class TimeDifferenceOutput():
+    def __init__(self, filename=None, shm_unit=None, min_interval=1.0, samples=20):
+        """
+        filename: text file with the averaged difference in seconds, None = no file \n
+        shm_unit: NTP SHM unit, None = no SHM output \n
+        min_interval: minimum seconds between rewrites of the text file
+        """
+        self.filename = filename
+        self.min_interval = min_interval
+        self.average = RollingAverage(samples)
+        self.last_write = 0
+        self.shm = None
+        if shm_unit is not None:
+            try:
+                self.shm = NTPSHM(shm_unit)
+            except OSError as e:
+                logger.error(f"TimeDifferenceOutput | {e}")
+
+    def update(self, timestamp_gnss, timestamp_system):
+        """timestamp_system: system time at the GNSS epoch, i.e. latency compensated"""
+        if self.shm:
+            self.shm.update(timestamp_gnss, timestamp_system)
+
+        # microseconds keep the running sum exact
+        self.average.add(int(round((timestamp_gnss-timestamp_system)*1e6)))
+        now = time.time()
+        if self.filename and now-self.last_write >= self.min_interval:
+            self.last_write = now
+            write_file_atomic(self.filename, f"{self.average.average()*1e-6:.6f}\n")
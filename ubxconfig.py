@@ -0,0 +1,269 @@
+#! /usr/bin/env python
+"""
+ACK tracked receiver configuration.
+
+A ConfigTransaction pipelines CFG frames to the receiver with up to `window`
+frames in flight. ACK-ACK/ACK-NAK only carry class and message ID, the
+receiver answers in order, so each ACK is matched to the oldest outstanding
+frame with the same class/ID. Frames without answer are resent after
+`timeout` seconds, up to `retries` times.
+
+Polls work the same way, the receiver sends the requested CFG message before
+the ACK-ACK and it is stored as the response of the poll frame.
+
+The baudrate of a UART link is probed with CFG-PRT polls, a poll is only
+answered if both sides use the same rate.
+"""
+import collections
+import threading
+import time
+
+from metrics import METRICS
+from ubxhelper import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+METRICS.describe("ubxconfig_frames_total", "CFG frames sent in configuration transactions by result")
+METRICS.describe("ubxconfig_baudrate_changes_total", "baudrate negotiations by result")
+
+UART_BAUDRATES = [921600, 460800, 230400, 115200, 57600, 38400, 19200, 9600]
+
+
+class PendingFrame():
+    def __init__(self, msg: UBXMSG):
+        self.msg = msg
+        self.data = msg.serialize()
+        self.key = msg.class_ID + msg.msg_ID
+        self.attempts = 0
+        self.sent = 0
+        self.result = None  # 'ack', 'nak' or 'timeout'
+        self.response = None
+
+    def is_poll(self):
+        if self.key == b'\x06\x01':
+            return len(self.msg.payload) == 2
+        # CFG-PRT polls may carry the port id
+        return len(self.msg.payload) <= 1
+
+    def accepts_response(self, msg: UBXMSG):
+        if self.response or msg.class_ID + msg.msg_ID != self.key:
+            return False
+        if self.key == b'\x06\x01':
+            # CFG-MSG polls are answered per message id
+            return msg.payload[0:2] == self.msg.payload[0:2] and len(msg.payload) > 2
+        return len(msg.payload) > len(self.msg.payload)
+
+
+class ConfigTransaction():
+    metric = 'ubxconfig_frames_total'
+    success = 'ack'
+    outcome = 'acknowledged'
+
+    def __init__(self, gpsp, window=8, timeout=0.5, retries=3):
+        self.gpsp = gpsp
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.frames = []
+        self.queue = collections.deque()
+        self.acks = collections.deque()
+        self.condition = threading.Condition()
+        self.metric_labels = getattr(gpsp, 'metric_labels', ())
+
+    def add(self, msg: UBXMSG):
+        self.frames.append(PendingFrame(msg))
+        return self
+
+    def on_ubx_msg(self, msg: UBXMSG):
+        """listener called by the GPSParser reader thread"""
+        if msg.class_ID not in (b'\x05', b'\x06'):
+            return
+        with self.condition:
+            self.acks.append(msg.specify())
+            self.condition.notify()
+
+    def commit(self):
+        """sends all frames, returns True if every frame was acknowledged"""
+        if not self.frames:
+            return True
+        start = time.time()
+        self.queue = collections.deque(self.frames)
+        in_flight = []
+        self.gpsp.add_ubx_listener(self.on_ubx_msg)
+        try:
+            while self.queue or in_flight:
+                while self.queue and len(in_flight) < self.window:
+                    frame = self.queue.popleft()
+                    self.send(frame)
+                    in_flight.append(frame)
+
+                if not in_flight:
+                    continue
+                with self.condition:
+                    if not self.acks:
+                        oldest = min(frame.sent for frame in in_flight)
+                        self.condition.wait(max(0.0, oldest+self.timeout-time.time()))
+                    acks = list(self.acks)
+                    self.acks.clear()
+
+                for ack in acks:
+                    self.handle(ack, in_flight)
+
+                now = time.time()
+                for frame in list(in_flight):
+                    if now-frame.sent < self.timeout:
+                        continue
+                    if frame.attempts > self.retries:
+                        frame.result = 'timeout'
+                        in_flight.remove(frame)
+                    else:
+                        self.send(frame)
+        finally:
+            self.gpsp.remove_ubx_listener(self.on_ubx_msg)
+
+        for frame in self.frames:
+            METRICS.inc(self.metric, 1, self.metric_labels + (('result', frame.result),))
+        failures = self.failures()
+        logger.info(f"{type(self).__name__} | {len(self.frames)-len(failures)}/{len(self.frames)} frames {self.outcome} in {(time.time()-start)*1000:.0f}ms")
+        for frame in failures:
+            logger.warning(f"{type(self).__name__} | {frame.msg.msg_type} {frame.msg.payload.hex()} failed: {frame.result}")
+        return not failures
+
+    def handle(self, msg, in_flight):
+        """processes an answer of the receiver"""
+        if msg.class_ID == b'\x06':
+            self.store_response(msg, in_flight)
+            return
+        frame = self.match(msg, in_flight)
+        if frame:
+            frame.result = 'ack' if msg.msg_type == 'ACK-ACK' else 'nak'
+            in_flight.remove(frame)
+
+    def send(self, frame):
+        frame.attempts += 1
+        frame.sent = time.time()
+        self.gpsp.send_to_gps(frame.data)
+
+    def match(self, ack, in_flight):
+        key = ack.ack_class_ID + ack.ack_msg_ID
+        for frame in in_flight:
+            if frame.key != key:
+                continue
+            if frame.is_poll() and not frame.response:
+                # the response comes before the ACK, this one belongs to an earlier frame
+                continue
+            return frame
+        return None
+
+    def store_response(self, msg, in_flight):
+        for frame in in_flight:
+            if frame.accepts_response(msg):
+                frame.response = msg
+                return
+
+    def responses(self):
+        return [frame.response for frame in self.frames]
+
+    def failures(self):
+        return [frame for frame in self.frames if frame.result != self.success]
+
+
+def poll(gpsp, *msgs, **kwargs):
+    """polls the receiver, returns the responses in the order of msgs, None for failed polls"""
+    transaction = ConfigTransaction(gpsp, **kwargs)
+    for msg in msgs:
+        transaction.add(msg)
+    transaction.commit()
+    return transaction.responses()
+
+
+def query(gpsp, msg: UBXMSG, timeout=0.5, retries=3):
+    """
+    polls a message that is answered without ACK (e.g. SEC-UNIQID),
+    returns the specified response or None
+    """
+    key = msg.class_ID + msg.msg_ID
+    answered = threading.Event()
+    responses = []
+
+    def on_ubx_msg(response: UBXMSG):
+        if response.class_ID + response.msg_ID == key and response.payload:
+            responses.append(response.specify())
+            answered.set()
+
+    gpsp.add_ubx_listener(on_ubx_msg)
+    try:
+        for _ in range(retries+1):
+            gpsp.send_to_gps(msg.serialize_poll())
+            if answered.wait(timeout):
+                return responses[0]
+    finally:
+        gpsp.remove_ubx_listener(on_ubx_msg)
+    return None
+
+
+def poll_msg_rates(gpsp, msg_ids):
+    """returns {msg_id: USB output rate} of the successfully polled message ids"""
+    responses = poll(gpsp, *[UBX_CFG_MSG().encode_poll(msg_id) for msg_id in msg_ids])
+    rates = {}
+    for msg_id, response in zip(msg_ids, responses):
+        if response:
+            rates[msg_id] = response.usb_rate
+    return rates
+
+
+def probe_port(gpsp, timeout=0.3, retries=1):
+    """CFG-PRT of the port the receiver is connected on or None if it does not answer"""
+    return poll(gpsp, UBX_CFG_PRT().encode_poll(), timeout=timeout, retries=retries)[0]
+
+
+def detect_baudrate(gpsp, baudrates=UART_BAUDRATES):
+    """
+    probes the current rate of the link and then every baudrate,
+    returns the CFG-PRT of the port or None
+    """
+    port = probe_port(gpsp)
+    if port:
+        return port
+    for baudrate in [b for b in baudrates if b != gpsp.baudrate]:
+        gpsp.set_baudrate(baudrate)
+        port = probe_port(gpsp)
+        if port:
+            logger.info(f"LinkSpeed | Receiver found at {baudrate} baud")
+            return port
+    logger.warning(f"LinkSpeed | Receiver does not answer at any of {baudrates}")
+    return None
+
+
+def negotiate_baudrate(gpsp, targets):
+    """
+    raises the baudrate of a UART link to the first of targets that works
+    and falls back to the previous rate, returns the CFG-PRT of the port or None
+    """
+    port = detect_baudrate(gpsp)
+    if not port or not port.is_uart():
+        gpsp.set_link_baudrate(None)
+        return port
+    gpsp.set_link_baudrate(port.baudrate)
+
+    for target in targets:
+        if target <= port.baudrate:
+            break
+        previous = port.baudrate
+        logger.info(f"LinkSpeed | Raising baudrate from {previous} to {target}")
+        gpsp.send_to_gps(UBX_CFG_PRT(port.buffer).encode_baudrate(target).serialize())
+        # the receiver acknowledges at the old rate before it switches
+        gpsp.set_baudrate(target, delay=0.1)
+        response = probe_port(gpsp, retries=2)
+        if response and response.baudrate == target:
+            METRICS.inc('ubxconfig_baudrate_changes_total', 1, gpsp.metric_labels + (('result', 'ok'),))
+            logger.info(f"LinkSpeed | Link running at {target} baud")
+            return response
+        METRICS.inc('ubxconfig_baudrate_changes_total', 1, gpsp.metric_labels + (('result', 'fallback'),))
+        logger.warning(f"LinkSpeed | No answer at {target} baud, falling back to {previous}")
+        gpsp.set_baudrate(previous)
+        port = detect_baudrate(gpsp)
+        if not port:
+            return None
+    return port
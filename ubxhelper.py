@@ -1,6 +1,7 @@
 
 #! /usr/bin/env python
 import struct
+from array import array
 from datetime import datetime
 import time
 
@@ -147,11 +148,18 @@ UBX_MSG_IDS = {
 }
 
 
+UBX_MSG_NAMES = {UBX_MSG_IDS[msg]: msg for msg in UBX_MSG_IDS}
+
+
 def get_msg_by_id(id):
-    for msg in UBX_MSG_IDS:
-        if UBX_MSG_IDS[msg] == id:
-            return msg
-    return None
+    return UBX_MSG_NAMES.get(id)
+
+
+def poll_request(msg_type):
+    """empty message of msg_type (e.g. 'NAV-PVT'), serialize_poll() gives the poll"""
+    msg = UBXMSG()
+    msg.class_ID, msg.msg_ID = UBX_MSG_IDS[msg_type][0:1], UBX_MSG_IDS[msg_type][1:2]
+    return msg
 
 
 def get_id_by_msg(msg):
@@ -265,18 +273,48 @@ class UBXMSG(object):
             return UBX_NAV_SOL(self.buffer, self.time_received)
         if (identifier == b'\x01\x07'):
             return UBX_NAV_PVT(self.buffer, self.time_received)
+        if (identifier == b'\x01\x13'):
+            return UBX_NAV_HPPOSECEF(self.buffer, self.time_received)
         if (identifier == b'\x01\x14'):
             return UBX_NAV_HPPOSLLH(self.buffer, self.time_received)
         if (identifier == b'\x01\x21'):
             return UBX_NAV_TIMEUTC(self.buffer, self.time_received)
+        if (identifier == b'\x01\x35'):
+            return UBX_NAV_SAT(self.buffer, self.time_received)
         if (identifier == b'\x01\x3B'):
             return UBX_NAV_SVIN(self.buffer, self.time_received)
+        if (identifier == b'\x01\x43'):
+            return UBX_NAV_SIG(self.buffer, self.time_received)
+        if (identifier == b'\x05\x00'):
+            return UBX_ACK_NAK(self.buffer, self.time_received)
+        if (identifier == b'\x05\x01'):
+            return UBX_ACK_ACK(self.buffer, self.time_received)
+        if (identifier == b'\x06\x00'):
+            return UBX_CFG_PRT(self.buffer, self.time_received)
         if (identifier == b'\x06\x01'):
             return UBX_CFG_MSG(self.buffer, self.time_received)
         if (identifier == b'\x06\x04'):
             return UBX_RST_MSG(self.buffer,self.time_received)
+        if (identifier == b'\x06\x08'):
+            return UBX_CFG_RATE(self.buffer,self.time_received)
+        if (identifier == b'\x06\x09'):
+            return UBX_CFG_CFG(self.buffer,self.time_received)
         if (identifier == b'\x06\x23'):
             return UBX_CFG_NAVX5(self.buffer,self.time_received)
+        if (identifier == b'\x06\x71'):
+            return UBX_CFG_TMODE3(self.buffer,self.time_received)
+        if (identifier == b'\x0A\x02'):
+            return UBX_MON_IO(self.buffer,self.time_received)
+        if (identifier == b'\x0A\x07'):
+            return UBX_MON_RXBUF(self.buffer,self.time_received)
+        if (identifier == b'\x0A\x08'):
+            return UBX_MON_TXBUF(self.buffer,self.time_received)
+        if (identifier == b'\x0A\x36'):
+            return UBX_MON_COMMS(self.buffer,self.time_received)
+        if (identifier == b'\x27\x03'):
+            return UBX_SEC_UNIQID(self.buffer,self.time_received)
+        if (identifier == b'\x13\x00') and len(self.payload) == 68 and self.payload[0] == 0x01:
+            return UBX_MGA_GPS_EPH(self.buffer,self.time_received)
         if (identifier == b'\x13\x60'):
             return UBX_MGA_ACK(self.buffer,self.time_received)
         if (identifier == b'\x13\x80'):
@@ -384,6 +422,21 @@ class UBX_NAV_PVT(UBXMSG):
         self.invalidLLH= flags3 &0x01
         self.lastCorrectionAge = (flags3>>1) &0b1111
 
+class UBX_NAV_HPPOSECEF(UBXMSG):
+    class_ID = b'\x01'
+    msg_ID = b'\x13'
+    msg_type = 'NAV-HPPOSECEF'
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        self.itow = struct.unpack('<I', self.payload[4:8])[0]
+        x_e2, y_e2, z_e2, x_e4, y_e4, z_e4, flags, pAcc_e4 = struct.unpack('<iiibbbBI', self.payload[8:28])
+        self.x = x_e2 * 1e-2 + x_e4 * 1e-4
+        self.y = y_e2 * 1e-2 + y_e4 * 1e-4
+        self.z = z_e2 * 1e-2 + z_e4 * 1e-4
+        self.invalid = flags & 0x01
+        self.pAcc = pAcc_e4 * 1e-4
+
 class UBX_NAV_HPPOSLLH(UBXMSG):
     class_ID = b'\x01'
     msg_ID = b'\x14'
@@ -429,6 +482,10 @@ class UBX_NAV_SVIN(UBXMSG):
         super().__init__(msg,t)
         self.itow = struct.unpack('<I', self.payload[4:8])[0]
         self.dur = struct.unpack('<I', self.payload[8:12])[0]
+        # mean position in ECEF, cm and 0.1 mm high precision part
+        mean_cm = struct.unpack('<iii', self.payload[12:24])
+        mean_hp = struct.unpack('<bbb', self.payload[24:27])
+        self.mean_ecef = tuple(cm*1e-2 + hp*1e-4 for cm, hp in zip(mean_cm, mean_hp))  # in m
         self.mean_acc = struct.unpack('<I', self.payload[28:32])[0]  # in 0.1mm
         self.num_obs = struct.unpack('<I', self.payload[32:36])[
             0]  # Number of observations
@@ -436,6 +493,95 @@ class UBX_NAV_SVIN(UBXMSG):
         self.in_progress = self.payload[37]
 
 
+# structs of n repeated blocks by (block format, n), so a message is unpacked in one call
+_REPEATED_STRUCTS = {}
+
+
+def unpack_blocks(block_format, payload, offset, count):
+    """
+    unpacks count repeated blocks, returns one array per field of the block
+    with the typecodes of the format (e.g. 'BBbh' -> 4 arrays)
+    """
+    key = (block_format, count)
+    repeated = _REPEATED_STRUCTS.get(key)
+    if repeated is None:
+        repeated = _REPEATED_STRUCTS[key] = struct.Struct('<' + block_format*count)
+    values = repeated.unpack_from(payload, offset)
+    codes = [code for code in block_format if code.isalpha() and code != 'x']
+    return [array(code if code != 'I' else 'L', values[i::len(codes)]) for i, code in enumerate(codes)]
+
+
+class UBX_NAV_SAT(UBXMSG):
+    class_ID = b'\x01'
+    msg_ID = b'\x35'
+    msg_type = 'NAV-SAT'
+    BLOCK = 'BBBbhhI'  # gnssId, svId, cno, elev, azim, prRes, flags
+    FLAG_USED = 0x08
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        if msg and len(self.payload) >= 8 and len(self.payload) == 8 + 12*self.payload[5]:
+            self.decode()
+
+    def decode(self):
+        """
+        one array per field, index i is the i-th satellite \n
+        cno in dBHz, elev and azim in degrees, pr_res in 0.1 m
+        """
+        self.itow, self.version, self.num_svs = struct.unpack('<IBB', self.payload[0:6])
+        (self.gnss_id, self.sv_id, self.cno, self.elev, self.azim, self.pr_res,
+            self.flags) = unpack_blocks(self.BLOCK, self.payload, 8, self.num_svs)
+        self.used = array('B', (flags >> 3 & 1 for flags in self.flags))
+
+
+class UBX_NAV_SIG(UBXMSG):
+    """signal information of protocol 27.11 and later (F9), not sent by the M8P"""
+    class_ID = b'\x01'
+    msg_ID = b'\x43'
+    msg_type = 'NAV-SIG'
+    BLOCK = 'BBBBhBBBBH4x'  # gnssId, svId, sigId, freqId, prRes, cno, qualityInd, corrSource, ionoModel, sigFlags
+    FLAG_PR_USED = 0x08
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        if msg and len(self.payload) >= 8 and len(self.payload) == 8 + 16*self.payload[5]:
+            self.decode()
+
+    def decode(self):
+        self.itow, self.version, self.num_sigs = struct.unpack('<IBB', self.payload[0:6])
+        (self.gnss_id, self.sv_id, self.sig_id, self.freq_id, self.pr_res, self.cno, self.quality,
+            self.corr_source, self.iono_model, self.sig_flags) = unpack_blocks(self.BLOCK, self.payload, 8, self.num_sigs)
+        self.used = array('B', (flags >> 3 & 1 for flags in self.sig_flags))
+
+
+class UBX_ACK_ACK(UBXMSG):
+    class_ID = b'\x05'
+    msg_ID = b'\x01'
+    msg_type = 'ACK-ACK'
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        if msg:
+            self.ack_class_ID = self.payload[0:1]
+            self.ack_msg_ID = self.payload[1:2]
+
+    def encode(self, class_ID, msg_ID):
+        """ class_ID and msg_ID of the acknowledged message, 1 byte each"""
+        self.ack_class_ID = class_ID
+        self.ack_msg_ID = msg_ID
+        self.payload = class_ID + msg_ID
+        self.update()
+
+    def refers_to(self, msg: UBXMSG):
+        return self.ack_class_ID == msg.class_ID and self.ack_msg_ID == msg.msg_ID
+
+
+class UBX_ACK_NAK(UBX_ACK_ACK):
+    class_ID = b'\x05'
+    msg_ID = b'\x00'
+    msg_type = 'ACK-NAK'
+
+
 class UBX_CFG_MSG(UBXMSG):
     class_ID = b'\x06'
     msg_ID = b'\x01'
@@ -447,6 +593,7 @@ class UBX_CFG_MSG(UBXMSG):
             if len(self.payload) == 8:
                 self.target_msg_id = self.payload[0:2]
                 self.port = self.payload[2:8]
+                self.usb_rate = self.payload[2+3]
 
             if len(self.payload) == 2:
                 self.target_msg_id = self.payload[0:2]
@@ -477,6 +624,47 @@ class UBX_CFG_MSG(UBXMSG):
         self.update()
         return self
 
+    def encode_poll(self, msg_id):
+        self.target_msg_id = msg_id
+        return self.poll()
+
+
+class UBX_CFG_PRT(UBXMSG):
+    class_ID = b'\x06'
+    msg_ID = b'\x00'
+    msg_type = 'CFG-PRT'
+    PORT_UART1 = 1
+    PORT_UART2 = 2
+    PORT_USB = 3
+    MODE_8N1 = 0x000008D0
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        if msg and len(self.payload) == 20:
+            self.decode()
+
+    def decode(self):
+        self.port_id = self.payload[0]
+        self.tx_ready, self.mode, self.baudrate, self.in_proto, self.out_proto, self.flags = struct.unpack('<HIIHHH', self.payload[2:18])
+
+    def is_uart(self):
+        return self.port_id in (self.PORT_UART1, self.PORT_UART2)
+
+    def encode_poll(self, port_id=None):
+        """poll a port, without port_id the port the poll is received on"""
+        self.payload = b'' if port_id is None else bytes((port_id,))
+        self.update()
+        return self
+
+    def encode_baudrate(self, baudrate):
+        """same port configuration at another baudrate, the decoded payload of a poll response is kept"""
+        payload = bytearray(self.payload)
+        payload[8:12] = struct.pack('<I', baudrate)
+        self.payload = bytes(payload)
+        self.decode()
+        self.update()
+        return self
+
 
 class UBX_RST_MSG(UBXMSG):
     class_ID = b'\x06'
@@ -531,20 +719,143 @@ class UBX_MGA_DBD(UBXMSG):
         super().__init__(msg,t)
 
     def decode(self):
-        self.type = self.payload[0]
-        self.version = self.payload[1]
-        self.infoCode = self.payload[2]
-        self.msgId = self.payload[3]
-        self.msgPayloadStart = self.payload[4:]
+        """entries are opaque to the host, 12 reserved bytes followed by the data"""
+        self.data = self.payload[12:]
+
+
+class UBX_SEC_UNIQID(UBXMSG):
+    class_ID = b'\x27'
+    msg_ID = b'\x03'
+    msg_type = 'SEC-UNIQID'
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        if msg and len(self.payload) == 9:
+            self.decode()
+
+    def decode(self):
+        """5 byte chip ID after version and 3 reserved bytes, as hex string like u-center shows it"""
+        self.version = self.payload[0]
+        self.unique_id = self.payload[4:9].hex()
+
+
+# targets of the per port arrays of MON-TXBUF, MON-RXBUF and MON-IO
+UBX_MON_PORTS = ('i2c', 'uart1', 'uart2', 'usb', 'spi', 'reserved')
+
+
+class UBX_MON_TXBUF(UBXMSG):
+    class_ID = b'\x0A'
+    msg_ID = b'\x08'
+    msg_type = 'MON-TXBUF'
+    ERROR_LIMIT = 0x3F  # buffer limit of the target reached, one bit per target
+    ERROR_MEM = 0x40  # memory allocation error
+    ERROR_ALLOC = 0x80  # allocation error (TX buffer full)
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        if msg and len(self.payload) == 28:
+            self.decode()
+
+    def decode(self):
+        """usage in % of the buffer per target, pending in bytes"""
+        self.pending = struct.unpack('<6H', self.payload[0:12])
+        self.usage = tuple(self.payload[12:18])
+        self.peak_usage = tuple(self.payload[18:24])
+        self.total_usage = self.payload[24]
+        self.total_peak_usage = self.payload[25]
+        self.errors = self.payload[26]
+
+    def limit_reached(self, target):
+        return bool(self.errors & (1 << target))
+
+
+class UBX_MON_RXBUF(UBXMSG):
+    class_ID = b'\x0A'
+    msg_ID = b'\x07'
+    msg_type = 'MON-RXBUF'
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        if msg and len(self.payload) == 24:
+            self.decode()
+
+    def decode(self):
+        self.pending = struct.unpack('<6H', self.payload[0:12])
+        self.usage = tuple(self.payload[12:18])
+        self.peak_usage = tuple(self.payload[18:24])
+
+
+class UBX_MON_IO(UBXMSG):
+    class_ID = b'\x0A'
+    msg_ID = b'\x02'
+    msg_type = 'MON-IO'
+    BLOCK = struct.Struct('<IIHHHHBBH')
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        if msg and self.payload and len(self.payload) % self.BLOCK.size == 0:
+            self.decode()
+
+    def decode(self):
+        """one dict per target in the order of UBX_MON_PORTS, byte and error counters since startup"""
+        self.ports = []
+        for offset in range(0, len(self.payload), self.BLOCK.size):
+            rx_bytes, tx_bytes, parity, framing, overrun, break_cond, rx_busy, tx_busy, _ = self.BLOCK.unpack_from(self.payload, offset)
+            self.ports.append({'rx_bytes': rx_bytes, 'tx_bytes': tx_bytes, 'parity_errors': parity, 'framing_errors': framing,
+                'overrun_errors': overrun, 'break_conditions': break_cond})
+
+
+class UBX_MON_COMMS(UBXMSG):
+    """successor of MON-TXBUF/RXBUF/IO on protocol 23.01 and later (F9), not sent by the M8P"""
+    class_ID = b'\x0A'
+    msg_ID = b'\x36'
+    msg_type = 'MON-COMMS'
+    BLOCK = struct.Struct('<HHIBBHIBBH4H8xI')
+    ERROR_MEM = 0x01
+    ERROR_ALLOC = 0x02
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        if msg and len(self.payload) >= 8 and len(self.payload) == 8 + self.payload[1]*self.BLOCK.size:
+            self.decode()
+
+    def decode(self):
+        """one dict per port, the port is named like in UBX_MON_PORTS by the high byte of its id"""
+        self.version = self.payload[0]
+        self.tx_errors = self.payload[2]
+        self.ports = []
+        for offset in range(8, len(self.payload), self.BLOCK.size):
+            fields = self.BLOCK.unpack_from(self.payload, offset)
+            port_id, tx_pending, tx_bytes, tx_usage, tx_peak, rx_pending, rx_bytes, rx_usage, rx_peak, overrun = fields[:10]
+            target = port_id >> 8
+            self.ports.append({'port': UBX_MON_PORTS[target] if target < len(UBX_MON_PORTS) else f'{port_id:04x}',
+                'tx_pending': tx_pending, 'tx_bytes': tx_bytes, 'tx_usage': tx_usage, 'tx_peak_usage': tx_peak,
+                'rx_pending': rx_pending, 'rx_bytes': rx_bytes, 'rx_usage': rx_usage, 'rx_peak_usage': rx_peak,
+                'overrun_errors': overrun, 'skipped': fields[-1]})
 
 
 class UBX_CFG_TMODE3(UBXMSG):
     class_ID = b'\x06'
     msg_ID = b'\x71'
     msg_type = 'CFG-TMODE3'
+    MODE_DISABLED = 0
+    MODE_SURVEY_IN = 1
+    MODE_FIXED = 2
 
     def __init__(self, msg=b'', t=0):
         super().__init__(msg,t)
+        if msg and len(self.payload) == 40:
+            self.decode()
+
+    def decode(self):
+        self.mode = self.payload[2]
+        lat_e7, lon_e7, alt_e2, lat_hp, lon_hp, alt_hp = struct.unpack('<iiibbb', self.payload[4:19])
+        self.lat = lat_e7*1e-7 + lat_hp*1e-9
+        self.lon = lon_e7*1e-7 + lon_hp*1e-9
+        self.alt = alt_e2*1e-2 + alt_hp*1e-4
+        self.fixed_acc = struct.unpack('<I', self.payload[20:24])[0]*1e-4
+        self.svin_min_dur, svin_acc_limit_e4 = struct.unpack('<II', self.payload[24:32])
+        self.svin_acc_limit = svin_acc_limit_e4*1e-4
 
     def encode_time_mode_off(self):
         self.payload = bytearray(40)
@@ -606,6 +917,8 @@ class UBX_CFG_RATE(UBXMSG):
 
     def __init__(self, msg=b'', t=0):
         super().__init__(msg,t)
+        if msg and len(self.payload) == 6:
+            self.measurement_rate, self.nav_rate, self.time_ref = struct.unpack('<HHH', self.payload)
 
     def encode(self, measurement_rate, nav_rate=1, time_ref=1):
         self.payload = bytearray(6)
@@ -619,6 +932,30 @@ class UBX_CFG_RATE(UBXMSG):
         self.update()
 
 
+class UBX_CFG_CFG(UBXMSG):
+    class_ID = b'\x06'
+    msg_ID = b'\x09'
+    msg_type = 'CFG-CFG'
+    ALL_SECTIONS = 0x00001F1F  # ioPort, msgConf, infMsg, navConf, rxmConf, senConf, rinvConf, antConf, logConf, ftsConf
+    DEVICE_BBR = 0x01
+    DEVICE_FLASH = 0x02
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+
+    def encode(self, clear_mask, save_mask, load_mask, device_mask):
+        self.payload = struct.pack('<IIIB', clear_mask, save_mask, load_mask, device_mask)
+        self.update()
+
+    def encode_save(self, device_mask=DEVICE_BBR, sections=ALL_SECTIONS):
+        """store the current configuration to BBR and/or flash"""
+        self.encode(0, sections, 0, device_mask)
+
+    def encode_load(self, device_mask=DEVICE_BBR, sections=ALL_SECTIONS):
+        """load the stored configuration into the current configuration"""
+        self.encode(0, 0, sections, device_mask)
+
+
 class UBX_CFG_NAVX5(UBXMSG):
     class_ID = b'\x06'
     msg_ID = b'\x23'
@@ -666,6 +1003,9 @@ class UBX_MGA_ACK(UBXMSG):
     class_ID = b'\x13'
     msg_ID = b'\x60'
     msg_type = 'MGA-ACK'
+    TYPE_NOT_USED = 0
+    TYPE_USED = 1
+    INFO_CODES = {0: 'used', 1: 'no time', 2: 'version not supported', 3: 'size mismatch', 4: 'database store failed', 5: 'not ready', 6: 'unknown type'}
 
     def __init__(self, msg=b'', t=0):
         super().__init__(msg,t)
@@ -679,7 +1019,51 @@ class UBX_MGA_ACK(UBXMSG):
         self.msgPayloadStart = self.payload[4:8]
 
     def refers_to_data_msg(self, msg: UBXMSG):
-        return msg.payload[:4] == self.msgPayloadStart
+        return msg.msg_ID[0] == self.msgID and msg.payload[:4] == self.msgPayloadStart
+
+    def reason(self):
+        return self.INFO_CODES.get(self.infoCode, f'info code {self.infoCode}')
+
+
+class UBX_MGA_GPS_EPH(UBXMSG):
+    class_ID = b'\x13'
+    msg_ID = b'\x00'
+    msg_type = 'MGA-GPS-EPH'
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+        if msg and len(self.payload) == 68 and self.payload[0] == 0x01:
+            self.decode()
+
+    def decode(self):
+        self.sv_id = self.payload[2]
+        self.fit_interval = self.payload[4]  # 0 = 4 hours, 1 = more than 4 hours
+        self.sv_health = self.payload[6]
+        self.iodc, toc = struct.unpack('<HH', self.payload[8:12])
+        self.toc = toc*16  # seconds of GPS week
+        self.toe = struct.unpack('<H', self.payload[40:42])[0]*16
+
+    def fit_hours(self):
+        return 4 if self.fit_interval == 0 else 6
+
+
+class UBX_MGA_INI_POS_LLH(UBXMSG):
+    class_ID = b'\x13'
+    msg_ID = b'\x40'
+    msg_type = 'MGA-INI-POS_LLH'
+
+    def __init__(self, msg=b'', t=0):
+        super().__init__(msg,t)
+
+    def encode(self, lat, lon, alt, acc):
+        """
+        lat/lon in deg \n
+        alt in m \n
+        acc - position accuracy in m
+        """
+        self.payload = struct.pack('<BBHiiiI', 0x01, 0, 0, int(round(lat*1e7)), int(round(lon*1e7)),
+            int(round(alt*100)), int(round(acc*100)))
+        self.update()
 
 
 class UBX_MGA_INI_TIME_UTC(UBXMSG):